@@ -1,8 +1,10 @@
 import streamlit as st
 import os
-import tempfile
-import shutil
-from main import run_conversion  # main.pyからrun_conversion関数をインポート
+from concurrent.futures import ThreadPoolExecutor
+from main import convert_image_data, convert_image_data_progressive
+from src.cache import ResultCache
+from src.metrics import ConversionCancelled, Metrics
+from src.stage_cache import StageCache
 
 st.set_page_config(layout="wide", page_title="画像SVG変換ツール")
 
@@ -23,11 +25,113 @@ if "uploaded_file_data" not in st.session_state:
 if "uploaded_file_name" not in st.session_state:
     st.session_state.uploaded_file_name = None
 
+# 変換の各ステージ（前処理・量子化・輪郭抽出など）の結果を保持し、
+# epsilonやストロークだけを変更した場合は近似とSVGの生成だけを再実行します
+if "stage_cache" not in st.session_state:
+    st.session_state.stage_cache = StageCache()
+
 if "converted_svg_content" not in st.session_state:
     st.session_state.converted_svg_content = None
 if "converted_svg_name" not in st.session_state:
     st.session_state.converted_svg_name = None
 
+# バックグラウンドで実行中の変換と、終了した変換の結果のメッセージ
+if "conversion_job" not in st.session_state:
+    st.session_state.conversion_job = None
+if "conversion_message" not in st.session_state:
+    st.session_state.conversion_message = None
+
+# 進捗の表示に使う、パイプラインのステージの順序と名前
+PIPELINE_STAGES = [
+    ("load", "画像の読み込み"),
+    ("resize", "リサイズ"),
+    ("alpha_blend", "透明度の処理"),
+    ("gaussian_blur", "ガウシアンブラー"),
+    ("median_blur", "メディアンブラー"),
+    ("sharpen", "シャープニング"),
+    ("color_histogram", "色の集計"),
+    ("kmeans", "色の量子化"),
+    ("assign", "色の割り当て"),
+    ("label_map", "ラベルマップの作成"),
+    ("despeckle", "小さな領域の統合"),
+    ("tiles", "タイルの処理"),
+    ("extract", "色の輪郭抽出"),
+    ("stitch", "タイルの結合"),
+    ("simplify", "輪郭の近似"),
+    ("serialize", "SVGの書き出し"),
+]
+STAGE_INDEX = {name: i for i, (name, _) in enumerate(PIPELINE_STAGES)}
+STAGE_LABELS = dict(PIPELINE_STAGES)
+
+
+@st.cache_resource
+def get_executor():
+    """全てのセッションで共有する、変換を実行するスレッドプール。"""
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+
+class ConversionJob:
+    """バックグラウンドで実行する1回の変換と、その進み具合。"""
+
+    def __init__(self, output_svg_name):
+        self.output_svg_name = output_svg_name
+        self.stage = None
+        self.done = 0
+        self.total = 0
+        self.metrics = Metrics(on_progress=self._on_progress)
+        self.future = None
+        self.preview_svg = None
+
+    def _on_progress(self, name, done, total):
+        # 変換を実行しているスレッドから呼ばれます。表示は画面側で定期的に読み取ります
+        self.stage, self.done, self.total = name, done, total
+
+    def start(self, image_data, *args, preview=False, **kwargs):
+        """
+        変換をバックグラウンドで開始します。previewがTrueの場合は、先に縮小した画像で
+        変換したプレビューをpreview_svgに設定してから、元の解像度で変換します。
+        """
+        self.future = get_executor().submit(self._run, image_data, args, kwargs, preview)
+
+    def _run(self, image_data, args, kwargs, preview):
+        if not preview:
+            return convert_image_data(image_data, *args, metrics=self.metrics, **kwargs)
+        svg_content = None
+        for kind, svg_content in convert_image_data_progressive(
+            image_data, *args, metrics=self.metrics, **kwargs
+        ):
+            if kind == "preview":
+                self.preview_svg = svg_content
+        return svg_content
+
+    def cancel(self):
+        """変換を中断します。実行中の場合は次のステージや次の色の処理の開始時に止まります。"""
+        self.metrics.cancel()
+        if self.future is not None:
+            self.future.cancel()
+
+    def fraction(self):
+        """パイプライン全体に対する進み具合 (0から1)。"""
+        if self.stage not in STAGE_INDEX:
+            return 0.0
+        within = self.done / self.total if self.total else 0.0
+        return min((STAGE_INDEX[self.stage] + within) / len(PIPELINE_STAGES), 1.0)
+
+    def describe(self):
+        if self.stage is None:
+            return "変換の開始を待っています..."
+        label = STAGE_LABELS.get(self.stage, self.stage)
+        if self.total:
+            return f"{label} ({self.done}/{self.total})"
+        return f"{label}..."
+
+
+def cancel_conversion():
+    """実行中の変換があれば中断します。"""
+    if st.session_state.conversion_job is not None:
+        st.session_state.conversion_job.cancel()
+        st.session_state.conversion_job = None
+
 
 def adjust_ksize(key_suffix):
     """
@@ -76,12 +180,14 @@ if uploaded_file_widget is not None:
         st.session_state.uploaded_file_data = uploaded_file_widget.getvalue()
         st.session_state.uploaded_file_name = uploaded_file_widget.name
         st.success(f"ファイル '{uploaded_file_widget.name}' がアップロードされました。")
+        cancel_conversion()
         st.session_state.converted_svg_content = None
         st.session_state.converted_svg_name = None
 else:
     if st.session_state.uploaded_file_data is not None and uploaded_file_widget is None:
         st.session_state.uploaded_file_data = None
         st.session_state.uploaded_file_name = None
+        cancel_conversion()
         st.session_state.converted_svg_content = None
         st.session_state.converted_svg_name = None
         st.info("アップロードされた画像がクリアされました。")
@@ -225,71 +331,104 @@ if add_stroke:
         help="ストロークの太さを指定します。",
     )
 
+show_preview = st.checkbox(
+    "プレビューを先に表示",
+    value=True,
+    help="縮小した画像で素早く変換したプレビューを先に表示し、元の解像度での変換が終わったら置き換えます。プレビューと同じ色を使うため、色は変わりません。",
+)
+
+compact_output = st.checkbox(
+    "コンパクトなSVGを出力",
+    value=False,
+    help="同じ色のパスを1つにまとめ、相対座標と短いコマンドを使ってSVGのファイルサイズを小さくします。",
+)
+
 
 # --- 変換実行ボタン ---
 st.header("4. SVG変換")
-if st.session_state.uploaded_file_data is not None:
-    if st.button("SVGに変換"):
-        temp_dir = tempfile.mkdtemp()
-        input_image_path = os.path.join(temp_dir, st.session_state.uploaded_file_name)
 
-        with open(input_image_path, "wb") as f:
-            f.write(st.session_state.uploaded_file_data)
 
+@st.fragment(run_every=0.5)
+def show_conversion_progress():
+    """
+    実行中の変換の進み具合を定期的に表示します。
+    変換が終わったら結果を保存し、アプリ全体を再実行して結果を表示します。
+    """
+    job = st.session_state.conversion_job
+    if job is None:
+        return
+    if not job.future.done():
+        st.progress(job.fraction(), text=job.describe())
+        if st.button("キャンセル"):
+            cancel_conversion()
+            st.session_state.conversion_message = ("info", "SVG変換をキャンセルしました。")
+            st.rerun()
+        if job.preview_svg is not None:
+            st.caption("プレビュー（縮小した画像で変換したもの）。元の解像度での変換が終わると置き換わります。")
+            st.components.v1.html(job.preview_svg, height=400, scrolling=True)
+        return
+
+    st.session_state.conversion_job = None
+    try:
+        svg_content_str = job.future.result()
+    except ConversionCancelled:
+        return
+    except Exception as e:
+        st.session_state.conversion_message = ("error", f"予期せぬエラーが発生しました: {e}")
+        st.rerun()
+        return
+
+    if svg_content_str is not None:
+        st.session_state.conversion_message = ("success", "SVG変換が完了しました！")
+        st.session_state.converted_svg_content = svg_content_str
+        st.session_state.converted_svg_name = job.output_svg_name
+        st.session_state.converted_svg_bytes = svg_content_str.encode("utf-8")
+    else:
+        st.session_state.conversion_message = (
+            "error",
+            "SVG変換中にエラーが発生しました。詳細はコンソール出力を確認してください。",
+        )
+    st.rerun()
+
+
+if st.session_state.uploaded_file_data is not None:
+    if st.button("SVGに変換"):
         output_svg_name = (
             os.path.splitext(st.session_state.uploaded_file_name)[0] + ".svg"
         )
-        output_svg_path = os.path.join(temp_dir, output_svg_name)
-
-        # Spinner added here
-        with st.spinner("SVG変換中です...しばらくお待ちください。"):
-            try:
-                success = run_conversion(
-                    input_image_path,
-                    output_svg_path,
-                    num_colors,
-                    apply_sharpening,
-                    median_blur_ksize,
-                    dilate_iterations,
-                    epsilon_factor,
-                    bg_color_str,
-                    apply_resizing,
-                    max_side_length,
-                    gaussian_blur_ksize,
-                    add_stroke,
-                    stroke_color_str,
-                    stroke_width,
-                )
-
-                if success:
-                    st.success("SVG変換が完了しました！")
-
-                    if os.path.exists(output_svg_path):
-                        with open(output_svg_path, "rb") as f:
-                            svg_content_bytes = f.read()
-
-                        with open(output_svg_path, "r") as f:
-                            svg_content_str = f.read()
-
-                        st.session_state.converted_svg_content = svg_content_str
-                        st.session_state.converted_svg_name = output_svg_name
-                        st.session_state.converted_svg_bytes = svg_content_bytes
-
-                    else:
-                        st.error(
-                            "出力SVGファイルが見つかりません。変換に失敗した可能性があります。"
-                        )
-                else:
-                    st.error(
-                        "SVG変換中にエラーが発生しました。詳細はコンソール出力を確認してください。"
-                    )
-
-            except Exception as e:
-                st.error(f"予期せぬエラーが発生しました: {e}")
-            finally:
-                if os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir)
-                    st.info(f"一時ディレクトリ '{temp_dir}' をクリーンアップしました。")
+
+        # 前の変換が終わっていなければ中断し、新しい設定で変換し直します
+        cancel_conversion()
+        st.session_state.conversion_message = None
+        job = ConversionJob(output_svg_name)
+        # アップロードされたデータを一時ファイルに保存せず、メモリ上で直接変換します。
+        # 変換はバックグラウンドのスレッドで実行するため、その間も画面を操作できます
+        job.start(
+            st.session_state.uploaded_file_data,
+            num_colors,
+            apply_sharpening,
+            median_blur_ksize,
+            dilate_iterations,
+            epsilon_factor,
+            bg_color_str,
+            apply_resizing,
+            max_side_length,
+            gaussian_blur_ksize,
+            add_stroke,
+            stroke_color_str,
+            stroke_width,
+            compact=compact_output,
+            preview=show_preview,
+            cache=ResultCache(),  # 同じ画像と設定の再変換ではキャッシュを使います
+            stage_cache=st.session_state.stage_cache,
+        )
+        st.session_state.conversion_job = job
+
+    show_conversion_progress()
+
+    if st.session_state.conversion_message is not None:
+        level, message = st.session_state.conversion_message
+        getattr(st, level)(message)
 else:
     st.warning("SVGに変換するには、まず画像をアップロードしてください。")
 
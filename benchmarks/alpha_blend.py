@@ -0,0 +1,82 @@
+"""
+透明なPNGのアルファ合成について、従来の浮動小数点による方法と
+src.common.composite_alphaによる整数の固定小数点演算を比較します。
+両者の出力の差が±1以内であることも確認します。
+
+使い方:
+    python -m benchmarks.alpha_blend --width 6000 --height 4000
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from src.common import composite_alpha
+
+
+def make_bgra(width, height, seed=0):
+    """半透明の画素を含む計測用のBGRA画像を作成します。"""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+
+
+def blend_before(img, background_fill_color):
+    """従来の方法: チャンネルを分割し、float64のアルファで合成します。"""
+    b, g, r, a = cv2.split(img)
+    img_3_channel = cv2.merge((b, g, r))
+    bg_b, bg_g, bg_r = background_fill_color
+    background = np.full_like(img_3_channel, (bg_r, bg_g, bg_b))
+    alpha_normalized = a / 255.0
+    alpha_3_channel = cv2.merge((alpha_normalized, alpha_normalized, alpha_normalized))
+    return (img_3_channel * alpha_3_channel).astype(np.uint8) + (
+        background * (1 - alpha_3_channel)
+    ).astype(np.uint8)
+
+
+def measure(func, *args):
+    """関数の実行時間 (秒) とピークメモリ (バイト) を計測します。"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def max_difference_all_values():
+    """前景・アルファ・背景の全ての組み合わせについて、2つの方法の差の最大値を返します。"""
+    fg = np.repeat(np.arange(256, dtype=np.uint8), 256).reshape(256, 256)
+    alpha = np.tile(np.arange(256, dtype=np.uint8), 256).reshape(256, 256)
+    img = np.dstack([fg, fg, fg, alpha])
+    worst = 0
+    for value in range(256):
+        color = (value, value, value)
+        diff = cv2.absdiff(blend_before(img, color), composite_alpha(img, color))
+        worst = max(worst, int(diff.max()))
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description="アルファ合成のベンチマーク")
+    parser.add_argument("--width", type=int, default=6000, help="画像の幅 (デフォルト: 6000)")
+    parser.add_argument("--height", type=int, default=4000, help="画像の高さ (デフォルト: 4000)")
+    args = parser.parse_args()
+
+    img = make_bgra(args.width, args.height)
+    color = (255, 255, 255)
+    old, old_time, old_peak = measure(blend_before, img, color)
+    new, new_time, new_peak = measure(composite_alpha, img, color)
+
+    print(f"画像サイズ: {args.width}x{args.height}")
+    print(f"before: {old_time:8.3f} 秒, ピークメモリ {old_peak / 1e6:8.1f} MB")
+    print(f"after : {new_time:8.3f} 秒, ピークメモリ {new_peak / 1e6:8.1f} MB")
+    print(f"出力の差の最大値: {int(cv2.absdiff(old, new).max())}")
+    print(f"全ての値の組み合わせでの差の最大値: {max_difference_all_values()}")
+
+
+if __name__ == "__main__":
+    main()
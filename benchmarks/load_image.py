@@ -0,0 +1,112 @@
+"""
+縮小時の画像読み込みについて、従来の方法（フル解像度でデコードしてからリサイズ）と
+preprocess_imageの縮小デコードを比較します。ピークメモリを正しく測るため、
+各方法は別のプロセスで実行します。
+
+使い方:
+    python -m benchmarks.load_image --input photo.jpg --max_side_length 1024
+    python -m benchmarks.load_image --width 8000 --height 5000   # 合成したJPEGで計測
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from src.common import preprocess_image
+
+
+def make_jpeg(path, width, height, seed=0):
+    """計測用の合成JPEG画像を作成します。"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (height // 64 + 1, width // 64 + 1, 3), dtype=np.uint8)
+    img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+
+def load_before(path, max_side_length):
+    """従来の方法: IMREAD_UNCHANGEDでフル解像度をデコードし、INTER_LINEARでリサイズします。"""
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    h, w = img.shape[:2]
+    scale = max_side_length / max(h, w)
+    return cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_LINEAR)
+
+
+def load_after(path, max_side_length):
+    """現在の方法: preprocess_imageによる縮小デコード。"""
+    return preprocess_image(path, (255, 255, 255), True, max_side_length)
+
+
+def run_variant(variant, path, max_side_length):
+    """1つの方法を実行し、処理時間とピークメモリ (RSSの増加分) をJSONで出力します。"""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    func = load_before if variant == "before" else load_after
+    start = time.perf_counter()
+    img = func(path, max_side_length)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        json.dumps(
+            {
+                "elapsed": elapsed,
+                "peak_kb": peak - baseline,
+                "shape": list(img.shape),
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="縮小時の画像読み込みのベンチマーク")
+    parser.add_argument("--input", help="入力JPEG画像 (省略時は合成画像を使います)")
+    parser.add_argument("--width", type=int, default=8000, help="合成画像の幅 (デフォルト: 8000)")
+    parser.add_argument("--height", type=int, default=5000, help="合成画像の高さ (デフォルト: 5000)")
+    parser.add_argument(
+        "--max_side_length", type=int, default=1024, help="縮小後の最大辺の長さ (デフォルト: 1024)"
+    )
+    parser.add_argument("--variant", choices=("before", "after"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args.variant, args.input, args.max_side_length)
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = args.input
+        if path is None:
+            path = os.path.join(temp_dir, "synthetic.jpg")
+            make_jpeg(path, args.width, args.height)
+
+        for variant in ("before", "after"):
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.load_image",
+                    "--variant",
+                    variant,
+                    "--input",
+                    path,
+                    "--max_side_length",
+                    str(args.max_side_length),
+                ],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{variant:6}: {result['elapsed']:6.3f} 秒, "
+                f"ピークメモリ +{result['peak_kb'] / 1024:7.1f} MB, 出力 {result['shape']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+再現可能な合成画像 (と任意の実画像) に対して、png_color_to_svg_high_fidelityを
+オプションの組み合わせごとに実行し、処理時間・ピークメモリ・出力サイズ・パス数・頂点数を
+JSONに記録します。保存したベースラインと比較し、閾値を超えて悪化した項目を報告します。
+
+ピークメモリ (プロセスの最大RSS) を正しく測るため、各ケースは別のプロセスで実行します。
+
+使い方:
+    python -m benchmarks.suite --output result.json
+    python -m benchmarks.suite --output new.json --baseline result.json --threshold 0.1
+    python -m benchmarks.suite --corpus images/ --images noisy_photo --num_colors 16
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from src.convert import png_color_to_svg_high_fidelity
+from src.metrics import Metrics, peak_memory_bytes
+
+# ベースラインと比較する項目 (いずれも値が大きいほど悪い)
+COMPARED_FIELDS = ("seconds", "peak_memory_bytes", "output_bytes", "vertices")
+
+
+def make_flat_logo(size, rng):
+    """少ない色の図形と文字からなるロゴ画像。"""
+    img = np.full((size, size, 3), 255, dtype=np.uint8)
+    palette = rng.integers(0, 256, (6, 3))
+    for i in range(24):
+        color = tuple(int(c) for c in palette[i % len(palette)])
+        center = tuple(int(v) for v in rng.integers(0, size, 2))
+        if i % 2:
+            cv2.circle(img, center, int(rng.integers(size // 40, size // 6)), color, -1)
+        else:
+            corner = tuple(int(v) for v in rng.integers(0, size, 2))
+            cv2.rectangle(img, center, corner, color, -1)
+    cv2.putText(
+        img, "to-svg", (size // 10, size // 2), cv2.FONT_HERSHEY_SIMPLEX, size / 200, (0, 0, 0), size // 60
+    )
+    return img
+
+
+def make_gradient(size, rng):
+    """線形と放射状のグラデーションを重ねた画像。"""
+    h, w = size * 3 // 4, size
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    cx, cy = rng.uniform(0, w), rng.uniform(0, h)
+    radial = np.sqrt((x - cx) ** 2 + (y - cy) ** 2) / np.hypot(w, h)
+    img = np.stack([x / w * 255, y / h * 255, (1 - radial) * 255], axis=2)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def make_noisy_photo(size, rng):
+    """滑らかな色の変化にノイズを加えた、写真のような画像。"""
+    h, w = size * 3 // 4, size
+    coarse = rng.integers(0, 256, (h // 32 + 1, w // 32 + 1, 3), dtype=np.uint8)
+    img = cv2.resize(coarse, (w, h), interpolation=cv2.INTER_CUBIC).astype(np.int16)
+    img += rng.normal(0, 12, img.shape).astype(np.int16)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def make_transparent(size, rng):
+    """境界がぼけた半透明の図形を持つBGRA画像。"""
+    img = np.zeros((size, size, 4), dtype=np.uint8)
+    for _ in range(12):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3)) + (255,)
+        center = tuple(int(v) for v in rng.integers(0, size, 2))
+        cv2.circle(img, center, int(rng.integers(size // 20, size // 5)), color, -1)
+    img[:, :, 3] = cv2.GaussianBlur(img[:, :, 3], (0, 0), size / 200)
+    return img
+
+
+def make_large_canvas(size, rng):
+    """多数の単色の図形を描いた巨大な画像。"""
+    img = np.full((size, size, 3), 240, dtype=np.uint8)
+    palette = rng.integers(0, 256, (12, 3))
+    for i in range(400):
+        color = tuple(int(c) for c in palette[i % len(palette)])
+        center = tuple(int(v) for v in rng.integers(0, size, 2))
+        cv2.circle(img, center, int(rng.integers(size // 200, size // 20)), color, -1)
+    return img
+
+
+# 合成画像の名前と (生成関数, デフォルトの大きさ)
+SYNTHETIC_IMAGES = {
+    "flat_logo": (make_flat_logo, 1024),
+    "gradient": (make_gradient, 1024),
+    "noisy_photo": (make_noisy_photo, 1024),
+    "transparent": (make_transparent, 800),
+    "large_canvas": (make_large_canvas, 6000),
+}
+
+
+def generate_corpus(work_dir, names, seed=0, scale=1.0):
+    """合成画像をPNGとして書き出し、(名前, パス) のリストを返します。同じシードなら同じ画像になります。"""
+    images = []
+    for name in names:
+        func, size = SYNTHETIC_IMAGES[name]
+        path = os.path.join(work_dir, f"{name}.png")
+        if not os.path.exists(path):
+            rng = np.random.default_rng(seed)
+            cv2.imwrite(path, func(max(int(size * scale), 64), rng))
+        images.append((name, path))
+    return images
+
+
+def build_matrix(args):
+    """コマンドライン引数からオプションの組み合わせのリストを作成します。"""
+    matrix = []
+    for num_colors, epsilon_factor, median_blur_ksize, max_side_length in itertools.product(
+        args.num_colors, args.epsilon_factor, args.median_blur_ksize, args.max_side_length
+    ):
+        matrix.append(
+            {
+                "num_colors": num_colors,
+                "epsilon_factor": epsilon_factor,
+                "median_blur_ksize": median_blur_ksize,
+                "apply_resizing": max_side_length > 0,
+                "max_side_length": max_side_length if max_side_length > 0 else 1024,
+                "quantizer": args.quantizer,
+                "random_seed": 0,
+            }
+        )
+    return matrix
+
+
+def case_id(image_name, options):
+    """比較に使う、ケースを一意に表す文字列。"""
+    return f"{image_name} " + " ".join(
+        f"{key}={options[key]}" for key in sorted(options) if key != "random_seed"
+    )
+
+
+def run_case(path, options, repeat):
+    """1つのケースを実行し、結果をJSONで標準出力に書き出します (別プロセスで呼ばれます)。"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_path = os.path.join(temp_dir, "out.svg")
+        best = None
+        for _ in range(repeat):
+            metrics = Metrics()
+            start = time.perf_counter()
+            png_color_to_svg_high_fidelity(path, output_path, metrics=metrics, **options)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best[0]:
+                best = (elapsed, metrics.to_dict())
+    elapsed, report = best
+    print(
+        json.dumps(
+            {
+                "seconds": elapsed,
+                "peak_memory_bytes": peak_memory_bytes(),
+                "output_bytes": report["counters"].get("output_bytes", 0),
+                "paths": report["counters"].get("paths", 0),
+                "vertices": report["counters"].get("vertices_after", 0),
+                "stages": report["stages"],
+            }
+        )
+    )
+
+
+def run_suite(images, matrix, repeat):
+    """全てのケースを別プロセスで実行し、結果のリストを返します。"""
+    results = []
+    for (name, path), options in itertools.product(images, matrix):
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.suite",
+                "--case",
+                json.dumps({"path": path, "options": options, "repeat": repeat}),
+            ],
+            capture_output=True,
+            text=True,
+        )
+        if output.returncode != 0:
+            print(f"エラー: {case_id(name, options)} の実行に失敗しました\n{output.stderr}")
+            continue
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        result.update(id=case_id(name, options), image=name, options=options)
+        results.append(result)
+        print(
+            f"{result['seconds']:8.3f} 秒 {(result['peak_memory_bytes'] or 0) / 1e6:8.1f} MB "
+            f"{result['output_bytes']:9d} バイト {result['paths']:6d} パス "
+            f"{result['vertices']:8d} 頂点  {result['id']}"
+        )
+    return results
+
+
+def compare(results, baseline, threshold, min_seconds=0.05):
+    """
+    ベースラインと比較し、(閾値を超えて悪化した項目のリスト, 比較したケース数) を返します。
+    処理時間がmin_seconds未満のケースは、誤差が大きいため時間を比較しません。
+    """
+    base_by_id = {case["id"]: case for case in baseline["cases"]}
+    regressions = []
+    compared = 0
+    for case in results:
+        base = base_by_id.get(case["id"])
+        if base is None:
+            continue
+        compared += 1
+        for field in COMPARED_FIELDS:
+            old, new = base.get(field), case.get(field)
+            if not old or new is None:
+                continue
+            if field == "seconds" and max(old, new) < min_seconds:
+                continue
+            change = new / old - 1
+            if change > threshold:
+                regressions.append((case["id"], field, old, new, change))
+    return regressions, compared
+
+
+def environment():
+    """結果の解釈に必要な実行環境の情報。"""
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="変換処理のベンチマークスイート")
+    parser.add_argument("--output", help="結果を書き込むJSONファイル")
+    parser.add_argument("--baseline", help="比較するベースラインのJSONファイル")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="悪化とみなす増加率 (デフォルト: 0.1 = 10%%)"
+    )
+    parser.add_argument(
+        "--images",
+        nargs="+",
+        choices=sorted(SYNTHETIC_IMAGES),
+        default=sorted(SYNTHETIC_IMAGES),
+        help="使う合成画像 (デフォルト: すべて)",
+    )
+    parser.add_argument("--corpus", help="合成画像に加えて使う実画像のディレクトリ")
+    parser.add_argument("--scale", type=float, default=1.0, help="合成画像の大きさの倍率 (デフォルト: 1.0)")
+    parser.add_argument("--seed", type=int, default=0, help="合成画像の乱数シード (デフォルト: 0)")
+    parser.add_argument("--work_dir", help="合成画像を保存するディレクトリ (デフォルト: 一時ディレクトリ)")
+    parser.add_argument("--num_colors", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--epsilon_factor", type=float, nargs="+", default=[0.001, 0.005])
+    parser.add_argument("--median_blur_ksize", type=int, nargs="+", default=[0, 5])
+    parser.add_argument(
+        "--max_side_length",
+        type=int,
+        nargs="+",
+        default=[0, 1024],
+        help="リサイズ後の最大辺の長さ。0はリサイズしません (デフォルト: 0 1024)",
+    )
+    parser.add_argument("--quantizer", default="full", help="色の量子化の方法 (デフォルト: full)")
+    parser.add_argument("--repeat", type=int, default=1, help="各ケースの繰り返し回数。最短の時間を記録します")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        case = json.loads(args.case)
+        run_case(case["path"], case["options"], case["repeat"])
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        images = generate_corpus(work_dir, args.images, args.seed, args.scale)
+        if args.corpus:
+            from main import collect_input_paths
+
+            images += [
+                (os.path.relpath(path, args.corpus), path)
+                for path in collect_input_paths([args.corpus])
+            ]
+        results = run_suite(images, build_matrix(args), args.repeat)
+
+    report = {"environment": environment(), "cases": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果を {args.output} に書き込みました")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions, compared = compare(results, baseline, args.threshold)
+        print(f"ベースラインと {compared} ケースを比較しました (閾値 {args.threshold:.0%})")
+        for case, field, old, new, change in regressions:
+            print(f"悪化: {case}: {field} {old:.4g} -> {new:.4g} (+{change:.1%})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
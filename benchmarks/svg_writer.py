@@ -0,0 +1,114 @@
+"""
+svgwriteでDOMを構築する従来の方法と、src.svg_writer.write_svgによる逐次書き込みを比較します。
+
+使い方:
+    python -m benchmarks.svg_writer --paths 2000 --vertices 100
+"""
+
+import argparse
+import io
+import os
+import time
+import tracemalloc
+
+import numpy as np
+import svgwrite
+
+from src.common import points_to_svg_path
+from src.svg_writer import write_svg
+
+
+def make_paths(num_paths, num_vertices, width, height, seed=0):
+    """ランダムな多角形のパスを生成します。"""
+    rng = np.random.default_rng(seed)
+    paths = []
+    for _ in range(num_paths):
+        points = np.stack(
+            [
+                rng.integers(0, width, num_vertices),
+                rng.integers(0, height, num_vertices),
+            ],
+            axis=1,
+        ).astype(np.int32)
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        paths.append({"points": points, "color": color})
+    return paths
+
+
+def svgwrite_to_string(width, height, paths, stroke_color=None, stroke_width=1.0):
+    """従来のsvgwriteによる方法でSVG文字列を生成します。"""
+    dwg = svgwrite.Drawing(profile="full", size=(width, height))
+    stroke_settings = {}
+    if stroke_color is not None:
+        stroke_settings = {
+            "stroke": svgwrite.rgb(*stroke_color, "RGB"),
+            "stroke_width": stroke_width,
+        }
+    for item in paths:
+        b, g, r = item["color"]
+        path_data = f"M {item['points'][0][0]},{item['points'][0][1]}"
+        for x, y in item["points"][1:]:
+            path_data += f" L {x},{y}"
+        path_data += " Z"
+        dwg.add(dwg.path(d=path_data, fill=svgwrite.rgb(r, g, b, "RGB"), **stroke_settings))
+    buffer = io.StringIO()
+    dwg.write(buffer)
+    return buffer.getvalue()
+
+
+def write_svg_to_string(width, height, paths, stroke_color=None, stroke_width=1.0):
+    """write_svgによる逐次書き込みでSVG文字列を生成します。"""
+    buffer = io.StringIO()
+    write_svg(buffer, width, height, paths, stroke_color, stroke_width)
+    return buffer.getvalue()
+
+
+def write_svg_to_devnull(width, height, paths, stroke_color=None, stroke_width=1.0):
+    """write_svgでファイル (os.devnull) に直接書き込みます。"""
+    with open(os.devnull, "w", encoding="utf-8") as f:
+        write_svg(f, width, height, paths, stroke_color, stroke_width)
+
+
+def measure(func, *args):
+    """関数の実行時間 (秒) とPythonのピークメモリ (バイト) を計測します。"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SVG書き込みのベンチマーク")
+    parser.add_argument("--paths", type=int, default=2000, help="パスの数 (デフォルト: 2000)")
+    parser.add_argument(
+        "--vertices", type=int, default=100, help="1パスあたりの頂点数 (デフォルト: 100)"
+    )
+    parser.add_argument("--stroke", action="store_true", help="ストロークを追加します。")
+    args = parser.parse_args()
+
+    width, height = 4096, 4096
+    paths = make_paths(args.paths, args.vertices, width, height)
+    stroke_color = (0, 0, 0) if args.stroke else None
+
+    old, old_time, old_peak = measure(svgwrite_to_string, width, height, paths, stroke_color)
+    new, new_time, new_peak = measure(write_svg_to_string, width, height, paths, stroke_color)
+    _, file_time, file_peak = measure(write_svg_to_devnull, width, height, paths, stroke_color)
+
+    print(f"パス数: {args.paths}, 頂点数: {args.paths * args.vertices}")
+    print(f"svgwrite : {old_time:8.3f} 秒, ピークメモリ {old_peak / 1e6:8.1f} MB")
+    print(f"write_svg: {new_time:8.3f} 秒, ピークメモリ {new_peak / 1e6:8.1f} MB")
+    print(f"write_svg (ファイルへ直接): {file_time:8.3f} 秒, ピークメモリ {file_peak / 1e6:8.1f} MB")
+    print(f"出力が一致: {old == new}")
+
+    # パス文字列の生成だけを比較します
+    start = time.perf_counter()
+    for item in paths:
+        points_to_svg_path(item["points"])
+    print(f"points_to_svg_pathのみ: {time.perf_counter() - start:8.3f} 秒")
+
+
+if __name__ == "__main__":
+    main()
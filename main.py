@@ -1,11 +1,36 @@
 import argparse
+import contextlib
+import functools
+import glob
+import io
+import json
 import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import src.convert as convert
+import src.incremental as incremental
+import src.sequence as sequence
+import src.server as server
+from src.cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, ResultCache
+from src.extract import MIN_CONTOUR_AREA
+from src.fidelity import FIDELITY_METRICS, TUNE_GRID, tune_parameters
+from src.metrics import Metrics
+from src.palette import fit_palette, load_palette, save_palette
+from src.quantize import PALETTE_SPACES, QUANTIZERS
+from src.tiling import DEFAULT_TILE_SIZE
 
+# ディレクトリやglobパターンから入力として扱う画像の拡張子
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".webp", ".tif", ".tiff")
+# ディレクトリやglobパターンから入力として扱う全ての拡張子 (GIFや動画を含みます)
+INPUT_EXTENSIONS = IMAGE_EXTENSIONS + sequence.SEQUENCE_EXTENSIONS
+# globパターンとして展開する入力に含まれる文字
+GLOB_PATTERN = re.compile(r"[*?[]")
 
-def run_conversion(
-    input_path,
-    output_path,
+
+def build_conversion_options(
     num_colors,
     apply_sharpening,
     median_blur_ksize,
@@ -18,22 +43,30 @@ def run_conversion(
     add_stroke,
     stroke_color,
     stroke_width,
+    quantizer="full",
+    quantizer_sample_size=100000,
+    random_seed=None,
+    min_area=MIN_CONTOUR_AREA,
+    despeckle=False,
+    tile_size=0,
+    workers=1,
+    compact=False,
+    cache=None,
+    stage_cache=None,
+    palette=None,
+    palette_space="rgb",
 ):
     """
-    画像をSVGに変換する処理を実行する関数。
+    変換オプションを検証し、convert.image_to_svgに渡すキーワード引数を作成します。
+    無効なオプションが指定された場合はNoneを返します。
     """
-    # outputのデフォルト値を設定
-    if output_path is None:
-        base_name, _ = os.path.splitext(input_path)
-        output_path = f"{base_name}.svg"
-
     # 背景色の解析
     try:
         r, g, b = map(int, bg_color.split(","))
         background_fill_color = (r, g, b)
     except ValueError:
         print(f"エラー: 無効な背景色形式 '{bg_color}'。'R,G,B'形式を使用してください。")
-        return False
+        return None
     
     # ストローク色の解析
     stroke_color_rgb = None
@@ -43,11 +76,7 @@ def run_conversion(
             stroke_color_rgb = (sr, sg, sb)
         except ValueError:
             print(f"エラー: 無効なストローク色形式 '{stroke_color}'。'R,G,B'形式を使用してください。")
-            return False
-
-    if not os.path.exists(input_path):
-        print(f"エラー: 入力画像ファイル '{input_path}' が見つかりません。")
-        return False
+            return None
 
     # median_blur_ksizeが偶数で0でない場合は奇数に調整
     if median_blur_ksize % 2 == 0 and median_blur_ksize != 0:
@@ -63,37 +92,422 @@ def run_conversion(
             f"警告: gaussian_blur_ksizeは奇数である必要があります。{gaussian_blur_ksize} に調整しました。"
         )
 
+    return {
+        "num_colors": num_colors,
+        "epsilon_factor": epsilon_factor,
+        "background_fill_color": background_fill_color,
+        "apply_sharpening": apply_sharpening,
+        "median_blur_ksize": median_blur_ksize,
+        "dilate_iterations": dilate_iterations,
+        "apply_resizing": apply_resizing,
+        "max_side_length": max_side_length,
+        "gaussian_blur_ksize": gaussian_blur_ksize,
+        "add_stroke": add_stroke,
+        "stroke_color": stroke_color_rgb,
+        "stroke_width": stroke_width,
+        "quantizer": quantizer,
+        "quantizer_sample_size": quantizer_sample_size,
+        "random_seed": random_seed,
+        "min_area": min_area,
+        "despeckle": despeckle,
+        "tile_size": tile_size,
+        "workers": workers,
+        "compact": compact,
+        "cache": cache,
+        "stage_cache": stage_cache,
+        "palette": palette,
+        "palette_space": palette_space,
+    }
+
+
+def run_conversion(
+    input_path,
+    output_path,
+    num_colors,
+    apply_sharpening,
+    median_blur_ksize,
+    dilate_iterations,
+    epsilon_factor,
+    bg_color,
+    apply_resizing,
+    max_side_length,
+    gaussian_blur_ksize,
+    add_stroke,
+    stroke_color,
+    stroke_width,
+    quantizer="full",
+    quantizer_sample_size=100000,
+    random_seed=None,
+    min_area=MIN_CONTOUR_AREA,
+    despeckle=False,
+    tile_size=0,
+    workers=1,
+    compact=False,
+    cache=None,
+    palette=None,
+    palette_space="rgb",
+    levels=None,
+    max_vertices=0,
+    max_bytes=0,
+    budget_allocation="area",
+    animate=False,
+    change_threshold=sequence.DEFAULT_CHANGE_THRESHOLD,
+    incremental_update=False,
+    metrics=None,
+):
+    """
+    画像をSVGに変換する処理を実行する関数。
+    levels (list) を指定すると、輪郭の抽出を1回だけ行って詳細度の異なるSVGを
+    レベルごとに出力します (出力先はlevel_output_pathsを参照)。
+    max_vertices / max_bytes を指定すると、頂点数やファイルサイズがその上限に収まる
+    できるだけ細かい近似で出力します (epsilon_factorは使いません)。
+    GIFや動画を指定した場合はフレームごとにSVGを出力し、animateがTrueの場合は
+    1つのアニメーションSVGに出力します (sequence.sequence_to_svgを参照)。
+    palette (BGR色の (k, 3) 配列) を指定すると、k-meansを行わずにこの色に割り当てます。
+    incremental_updateがTrueの場合は、出力SVGファイルの隣に保存した前回の変換結果 ({出力名}.npz) と
+    比べて、画像の変化した部分だけを変換し直します (incremental.png_color_to_svg_incrementalを参照)。
+    metrics (Metrics) を指定すると、ステージごとの処理時間などを記録します。
+    """
+    # outputのデフォルト値を設定
+    if output_path is None:
+        base_name, _ = os.path.splitext(input_path)
+        output_path = f"{base_name}.svg"
+
+    options = build_conversion_options(
+        num_colors,
+        apply_sharpening,
+        median_blur_ksize,
+        dilate_iterations,
+        epsilon_factor,
+        bg_color,
+        apply_resizing,
+        max_side_length,
+        gaussian_blur_ksize,
+        add_stroke,
+        stroke_color,
+        stroke_width,
+        quantizer=quantizer,
+        quantizer_sample_size=quantizer_sample_size,
+        random_seed=random_seed,
+        min_area=min_area,
+        despeckle=despeckle,
+        tile_size=tile_size,
+        workers=workers,
+        compact=compact,
+        cache=cache,
+        palette=palette,
+        palette_space=palette_space,
+    )
+    if options is None:
+        return False
+
+    if not os.path.exists(input_path):
+        print(f"エラー: 入力画像ファイル '{input_path}' が見つかりません。")
+        return False
+
+    budget = max_vertices > 0 or max_bytes > 0
+    if levels and budget:
+        print("エラー: --levels と --max-vertices / --max-bytes は同時に指定できません。")
+        return False
+
+    if incremental_update and (levels or budget or sequence.is_sequence_path(input_path)):
+        print("エラー: --incremental は --levels、--max-vertices、--max-bytes、動画・GIFの変換と同時に使えません。")
+        return False
+
+    if sequence.is_sequence_path(input_path):
+        if levels or budget:
+            print("エラー: 動画・GIFの変換では--levels、--max-vertices、--max-bytesは使えません。")
+            return False
+        # フレームの連続の変換では変換結果のキャッシュを使いません
+        del options["cache"]
+        print(f"画像処理で '{input_path}' の各フレームを変換しています...")
+        return sequence.sequence_to_svg(
+            input_path,
+            output_path,
+            animate,
+            change_threshold,
+            metrics=metrics,
+            **options,
+        )
+
+    if levels:
+        output_paths = level_output_paths(output_path, levels)
+        print(
+            f"画像処理で '{input_path}' を {len(levels)} レベルの詳細度 "
+            f"({', '.join(output_paths)}) に変換しています..."
+        )
+        return convert.png_color_to_svg_levels(
+            input_path, output_paths, levels, budget_allocation, metrics=metrics, **options
+        )
+
+    if budget:
+        print(f"画像処理で '{input_path}' を上限に収まるよう '{output_path}' に変換しています...")
+        return convert.png_color_to_svg_budget(
+            input_path,
+            output_path,
+            max_vertices,
+            max_bytes,
+            budget_allocation,
+            metrics=metrics,
+            **options,
+        )
+
+    if incremental_update:
+        # 前回の変換結果を更新する必要があるため、変換結果のキャッシュは使いません
+        del options["cache"]
+        print(f"画像処理で '{input_path}' の変化した部分を '{output_path}' に変換しています...")
+        return incremental.png_color_to_svg_incremental(
+            input_path, output_path, metrics=metrics, **options
+        )
 
     print(f"画像処理で '{input_path}' を '{output_path}' に変換しています...")
-    convert.png_color_to_svg_high_fidelity(
-        image_path=input_path,
-        output_path=output_path,
-        num_colors=num_colors,
-        epsilon_factor=epsilon_factor,
-        background_fill_color=background_fill_color,
-        apply_sharpening=apply_sharpening,
-        median_blur_ksize=median_blur_ksize,
-        dilate_iterations=dilate_iterations,
-        apply_resizing=apply_resizing,
-        max_side_length=max_side_length,
-        gaussian_blur_ksize=gaussian_blur_ksize,
-        add_stroke=add_stroke,
-        stroke_color=stroke_color_rgb,
-        stroke_width=stroke_width,
-    )
-    return True
+    return convert.png_color_to_svg_high_fidelity(
+        input_path, output_path, metrics=metrics, **options
+    )
 
 
-def main():
+def convert_image_data(image_data, *args, metrics=None, **kwargs):
+    """
+    メモリ上の画像データ（画像ファイルのバイト列または画像配列）をSVG文字列に変換します。
+    一時ファイルを使わずに変換するため、Webアプリなどから利用します。
+    image_data以外の引数はrun_conversionの変換オプションと同じです。
+    metrics (Metrics) を指定すると、進み具合の通知や別のスレッドからの中断ができます。
+
+    Returns:
+        str: SVG文字列。変換に失敗した場合はNone。
+    """
+    options = build_conversion_options(*args, **kwargs)
+    if options is None:
+        return None
+    return convert.image_to_svg(image_data, metrics=metrics, **options)
+
+
+def convert_image_data_progressive(
+    image_data,
+    *args,
+    metrics=None,
+    preview_max_side_length=convert.PREVIEW_MAX_SIDE_LENGTH,
+    **kwargs,
+):
+    """
+    convert_image_dataと同じ変換を、縮小した画像で素早く変換したプレビュー、
+    元の解像度での変換の順に行います (convert.image_to_svg_progressiveを参照)。
+
+    Yields:
+        tuple: ("preview", SVG文字列)、続いて ("final", SVG文字列)。
+               変換に失敗した場合は何も返しません。
+    """
+    options = build_conversion_options(*args, **kwargs)
+    if options is None:
+        return
+    yield from convert.image_to_svg_progressive(
+        image_data, metrics=metrics, preview_max_side_length=preview_max_side_length, **options
+    )
+
+
+def collect_input_paths(inputs):
+    """
+    コマンドライン引数の入力（ファイル、globパターン、ディレクトリ）を
+    入力画像ファイルのリストに展開します。GIFや動画のファイルも含みます。
+    """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(
+                os.path.join(item, name)
+                for name in sorted(os.listdir(item))
+                if name.lower().endswith(INPUT_EXTENSIONS)
+                and os.path.isfile(os.path.join(item, name))
+            )
+        elif GLOB_PATTERN.search(item):
+            paths.extend(
+                path
+                for path in sorted(glob.glob(item, recursive=True))
+                if path.lower().endswith(INPUT_EXTENSIONS) and os.path.isfile(path)
+            )
+        else:
+            paths.append(item)
+    # 同じファイルが複数回指定された場合は1回だけ変換します
+    return list(dict.fromkeys(paths))
+
+
+def resolve_output_path(input_path, output_dir=None):
+    """入力画像に対応する出力SVGファイルのパスを返します。"""
+    base_name, _ = os.path.splitext(input_path)
+    if output_dir is not None:
+        base_name = os.path.join(output_dir, os.path.basename(base_name))
+    return f"{base_name}.svg"
+
+
+def level_output_paths(output_path, levels):
+    """詳細度のレベルごとの出力SVGファイルのパス ({出力名}_{レベル}.svg) を返します。"""
+    base_name, _ = os.path.splitext(output_path)
+    return [f"{base_name}_{level:g}.svg" for level in levels]
+
+
+def is_up_to_date(input_path, output_path):
+    """出力SVGファイルが入力画像より新しい場合にTrueを返します。"""
+    return (
+        os.path.exists(output_path)
+        and os.path.exists(input_path)
+        and os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+    )
+
+
+def _convert_task(input_path, output_path, options, profile=False):
+    """
+    1ファイルを変換し、結果と処理時間を返します（プロセスプールのワーカーから呼ばれます）。
+    profileがTrueの場合は、ステージごとの処理時間などを "metrics" に含めます。
+    """
+    cache = options.get("cache")
+    hits_before = cache.hits if cache is not None else 0
+    metrics = Metrics() if profile else None
+    if metrics is not None:
+        # このプロセスでは1ファイルずつ変換するため、ピークメモリをファイルごとに測ります
+        metrics.measure_peak_memory()
+    start = time.perf_counter()
+    try:
+        success = run_conversion(input_path, output_path, **options, metrics=metrics)
+        error = None if success else "変換に失敗しました"
+    except Exception as e:
+        success = False
+        error = str(e)
+    return {
+        "input": input_path,
+        "output": output_path,
+        "success": success,
+        "elapsed": time.perf_counter() - start,
+        "error": error,
+        "cache_hit": cache is not None and cache.hits > hits_before,
+        "metrics": metrics.to_dict() if metrics is not None else None,
+    }
+
+
+def write_profile(path, results):
+    """変換結果とステージごとの処理時間などをJSONファイルに書き込みます。"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"プロファイルを {path} に書き込みました")
+
+
+def run_batch(input_paths, output_dir, options, jobs=1, force=False, profile_json=None):
+    """
+    複数の画像をSVGに変換し、最後に処理時間と失敗の一覧を表示します。
+
+    Args:
+        input_paths (list): 入力画像ファイルへのパスのリスト。
+        output_dir (str): 出力先のディレクトリ。Noneの場合は入力画像と同じ場所に出力します。
+        options (dict): run_conversionに渡す変換オプション。
+        jobs (int): 並列に実行するプロセス数。0の場合はCPU数を使います。
+        force (bool): 出力が入力より新しい場合も変換し直すかどうか。
+        profile_json (str): 指定すると、各ファイルの処理時間などをこのJSONファイルに書き込みます。
+
+    Returns:
+        bool: すべての変換が成功した場合はTrue。
+    """
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    tasks = []
+    skipped = 0
+    for input_path in input_paths:
+        output_path = resolve_output_path(input_path, output_dir)
+        if options.get("levels"):
+            up_to_date = all(
+                is_up_to_date(input_path, path)
+                for path in level_output_paths(output_path, options["levels"])
+            )
+        elif sequence.is_sequence_path(input_path) and not options.get("animate"):
+            # フレームごとに出力する場合は、最初のフレームのSVGで判定します
+            base_name, _ = os.path.splitext(output_path)
+            up_to_date = is_up_to_date(input_path, f"{base_name}_0000.svg")
+        else:
+            up_to_date = is_up_to_date(input_path, output_path)
+        if not force and up_to_date:
+            skipped += 1
+            continue
+        tasks.append((input_path, output_path))
+
+    jobs = jobs if jobs > 0 else os.cpu_count() or 1
+    profile = profile_json is not None
+    start = time.perf_counter()
+    results = []
+    if jobs == 1 or len(tasks) <= 1:
+        for input_path, output_path in tasks:
+            results.append(_convert_task(input_path, output_path, options, profile))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(_convert_task, input_path, output_path, options, profile)
+                for input_path, output_path in tasks
+            ]
+            for future in as_completed(futures):
+                results.append(future.result())
+    total_elapsed = time.perf_counter() - start
+
+    # --- 結果のまとめ ---
+    results.sort(key=lambda r: r["elapsed"], reverse=True)
+    failures = [r for r in results if not r["success"]]
+    print("\n--- 変換結果 ---")
+    for r in results:
+        status = "成功" if r["success"] else "失敗"
+        print(f"{r['elapsed']:8.2f} 秒  {status}  {r['input']}")
+    print(
+        f"合計: {len(input_paths)} ファイル (変換 {len(results) - len(failures)}, "
+        f"スキップ {skipped}, 失敗 {len(failures)}) / {total_elapsed:.2f} 秒 ({jobs} プロセス)"
+    )
+    if results:
+        mean = sum(r["elapsed"] for r in results) / len(results)
+        print(f"1ファイルあたりの平均処理時間: {mean:.2f} 秒")
+    if options.get("cache") is not None:
+        hits = sum(1 for r in results if r["cache_hit"])
+        print(f"キャッシュ: ヒット {hits}, ミス {len(results) - hits}")
+    for r in failures:
+        print(f"エラー: '{r['input']}': {r['error']}")
+    if profile:
+        write_profile(profile_json, results)
+    return not failures
+
+
+def prune_cache(argv):
+    """
+    変換結果のキャッシュを指定したサイズ以下になるまで削除するコマンド。
+    (例: python main.py prune-cache --max_mb 100)
+    """
     parser = argparse.ArgumentParser(
-        description="画像をSVGに変換します。画像処理を使用します。"
+        prog="main.py prune-cache",
+        description="変換結果のキャッシュを、最も長く使われていないものから削除します。",
     )
-    parser.add_argument("input", help="入力画像ファイルへのパス (例: test.png)")
     parser.add_argument(
-        "--output",
-        help="出力SVGファイルへのパス (デフォルト: 入力ファイルの拡張子を.svgに変更したもの)",
+        "--cache_dir",
+        help=f"キャッシュディレクトリ (デフォルト: 環境変数TO_SVG_CACHE_DIR、または {DEFAULT_CACHE_DIR})",
+    )
+    parser.add_argument(
+        "--max_mb",
+        type=float,
+        default=DEFAULT_MAX_BYTES / (1024 * 1024),
+        help="削除後のキャッシュの最大サイズ (MB)。0を指定するとすべて削除します。",
+    )
+    args = parser.parse_args(argv)
+
+    cache = ResultCache(args.cache_dir)
+    before = cache.stats()
+    removed, freed = cache.prune(int(args.max_mb * 1024 * 1024))
+    print(
+        f"キャッシュ '{cache.cache_dir}': {before['files']} ファイル "
+        f"({before['bytes'] / 1e6:.1f} MB) から {removed} ファイル "
+        f"({freed / 1e6:.1f} MB) を削除しました。"
     )
 
+
+def add_conversion_arguments(parser):
+    """変換オプションのコマンドライン引数を追加します（通常の変換とclientコマンドで共通）。"""
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="1枚の画像の色ごとの輪郭抽出と近似を並列に実行するスレッド数。0に設定するとCPU数を使います。出力はスレッド数によらず同一です (デフォルト: 1)",
+    )
     parser.add_argument(
         "--num_colors",
         type=int,
@@ -122,6 +536,18 @@ def main():
         help="輪郭抽出前の膨張処理の繰り返し回数を指定します。 (デフォルト: 1)",
     )
 
+    parser.add_argument(
+        "--min_area",
+        type=float,
+        default=MIN_CONTOUR_AREA,
+        help=f"これより面積の小さい領域を除きます。1以上の値は画素数、1未満の値は画像の面積に対する割合 (例: 0.0001) として扱います (デフォルト: {MIN_CONTOUR_AREA})",
+    )
+    parser.add_argument(
+        "--despeckle",
+        action="store_true",
+        help="輪郭抽出の前に、面積がmin_area未満の小さな領域を隣の最も接している色に統合します。ノイズの多い画像で処理時間を大きく削減でき、穴も残りません。",
+    )
+
     # 共通オプション
     parser.add_argument(
         "--epsilon_factor",
@@ -161,24 +587,645 @@ def main():
         default=1.0,
         help="ストロークの太さを指定します (デフォルト: 1.0)",
     )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="同じ色のパスを1つにまとめ、相対座標と短いコマンドを使ったサイズの小さいSVGを出力します。",
+    )
+    parser.add_argument(
+        "--quantizer",
+        choices=QUANTIZERS,
+        default="full",
+        help="色の量子化の方法を指定します。full: 全画素でk-means、sample: 抽出した画素でk-means、minibatch: 抽出した画素でミニバッチk-means、histogram: 一意な色を画素数で重み付けしてk-means (fullより大幅に速く、誤差はほぼ同じです)。画像の色数がnum_colors以下の場合はいずれもk-meansを省略します。これまでと同じ出力になるよう、デフォルトはfullのままです (デフォルト: full)",
+    )
+    parser.add_argument(
+        "--sample_size",
+        type=int,
+        default=100000,
+        help="sample/minibatchでパレットの推定に使う最大画素数を指定します (デフォルト: 100000)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="色の量子化の乱数シードを指定します。指定すると結果が再現可能になります。",
+    )
+    parser.add_argument(
+        "--tile_size",
+        type=int,
+        default=0,
+        help=f"画像をこの大きさのタイルに分割して処理し、メモリ使用量を抑えます。巨大な画像をリサイズせずに変換する場合に使います (例: {DEFAULT_TILE_SIZE})。0に設定すると分割しません (デフォルト: 0)",
+    )
 
-    args = parser.parse_args()
-    run_conversion(
+
+def add_cache_arguments(parser):
+    """変換結果のキャッシュのコマンドライン引数を追加します。"""
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="変換結果をキャッシュし、同じ画像と設定の変換ではキャッシュしたSVGを再利用します。",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        help=f"キャッシュディレクトリ (デフォルト: 環境変数TO_SVG_CACHE_DIR、または {DEFAULT_CACHE_DIR})",
+    )
+    parser.add_argument(
+        "--cache_max_mb",
+        type=float,
+        default=DEFAULT_MAX_BYTES / (1024 * 1024),
+        help="キャッシュの最大サイズ (MB)。超えた分は最も長く使われていないものから削除します。",
+    )
+
+
+def conversion_options_from_args(args):
+    """add_conversion_argumentsで追加した引数から、run_conversionの変換オプションを作成します。"""
+    return {
+        "num_colors": args.num_colors,
+        "apply_sharpening": args.apply_sharpening,
+        "median_blur_ksize": args.median_blur_ksize,
+        "dilate_iterations": args.dilate_iterations,
+        "epsilon_factor": args.epsilon_factor,
+        "bg_color": args.bg_color,
+        "apply_resizing": args.apply_resizing,
+        "max_side_length": args.max_side_length,
+        "gaussian_blur_ksize": args.gaussian_blur_ksize,
+        "add_stroke": args.add_stroke,
+        "stroke_color": args.stroke_color,
+        "stroke_width": args.stroke_width,
+        "quantizer": args.quantizer,
+        "quantizer_sample_size": args.sample_size,
+        "random_seed": args.seed,
+        "min_area": args.min_area,
+        "despeckle": args.despeckle,
+        "tile_size": args.tile_size,
+        "workers": args.threads,
+        "compact": args.compact,
+    }
+
+
+def palette_from_args(args, options):
+    """
+    --palette-in / --palette-out の指定に従ってパレットを用意します。
+
+    --palette-inはパレットファイルを読み込み、--palette-outは入力画像 (ディレクトリや
+    globパターンの場合は全ての画像) から抽出した画素でパレットを求めて保存します。
+
+    Returns:
+        tuple: (成功したかどうか, パレット)。どちらも指定されていない場合のパレットはNone。
+    """
+    if args.palette_in and args.palette_out:
+        print("エラー: --palette-in と --palette-out は同時に指定できません。")
+        return False, None
+    if args.palette_in:
+        palette = load_palette(args.palette_in)
+        return palette is not None, palette
+    if not args.palette_out:
+        return True, None
+
+    # パレットは静止画から求めます (GIFや動画のフレームは読み込みません)
+    input_paths = [
+        path for path in collect_input_paths(args.input) if not sequence.is_sequence_path(path)
+    ]
+    conversion = build_conversion_options(**options)
+    if conversion is None:
+        return False, None
+    # パレットの推定に使わないSVGの出力に関するオプションを除きます
+    for key in ("add_stroke", "stroke_color", "stroke_width", "compact", "cache", "stage_cache"):
+        del conversion[key]
+    palette = fit_palette(input_paths, **conversion)
+    if palette is None:
+        return False, None
+    save_palette(args.palette_out, palette)
+    return True, palette
+
+
+def cache_from_args(args):
+    """add_cache_argumentsで追加した引数からResultCacheを作成します。無効な場合はNone。"""
+    if not args.cache:
+        return None
+    return ResultCache(args.cache_dir, int(args.cache_max_mb * 1024 * 1024))
+
+
+def default_conversion_options():
+    """コマンドラインで何も指定しない場合の変換オプションを返します。"""
+    parser = argparse.ArgumentParser(add_help=False)
+    add_conversion_arguments(parser)
+    return conversion_options_from_args(parser.parse_args([]))
+
+
+# 変換サーバーのX-Optionsで受け付ける変換オプションと、その値の型。
+# add_conversion_argumentsのコマンドライン引数の型と合わせます。タプルは選択肢を表します
+SERVER_OPTION_TYPES = {
+    "num_colors": int,
+    "apply_sharpening": bool,
+    "median_blur_ksize": int,
+    "dilate_iterations": int,
+    "epsilon_factor": float,
+    "bg_color": str,
+    "apply_resizing": bool,
+    "max_side_length": int,
+    "gaussian_blur_ksize": int,
+    "add_stroke": bool,
+    "stroke_color": str,
+    "stroke_width": float,
+    "quantizer": QUANTIZERS,
+    "quantizer_sample_size": int,
+    "random_seed": int,
+    "min_area": float,
+    "despeckle": bool,
+    "tile_size": int,
+    "workers": int,
+    "compact": bool,
+}
+
+
+def validate_conversion_options(options):
+    """
+    JSONなどで受け取った変換オプションを、コマンドライン引数と同じ型に変換して検証します。
+
+    Returns:
+        tuple: (変換オプション, エラーメッセージ)。無効な場合は変換オプションがNone。
+    """
+    unknown = sorted(set(options) - set(SERVER_OPTION_TYPES))
+    if unknown:
+        return None, f"無効な変換オプション {', '.join(unknown)}"
+    defaults = default_conversion_options()
+    validated = {}
+    for name, value in options.items():
+        value_type = SERVER_OPTION_TYPES[name]
+        choices = None
+        if isinstance(value_type, tuple):
+            choices, value_type = value_type, str
+        if value_type is bool:
+            # store_trueの引数はJSONの真偽値だけを受け付けます
+            if not isinstance(value, bool):
+                return None, f"変換オプション {name} はtrueまたはfalseである必要があります"
+        elif not (value is None and defaults[name] is None):
+            try:
+                if isinstance(value, (bool, list, dict)) or value is None:
+                    raise TypeError
+                if value_type is int and isinstance(value, float) and not value.is_integer():
+                    raise ValueError
+                value = value_type(value)
+            except (TypeError, ValueError):
+                return None, f"変換オプション {name} の値 {json.dumps(value, ensure_ascii=False)} が無効です"
+            if choices is not None and value not in choices:
+                return None, (
+                    f"変換オプション {name} は {', '.join(choices)} のいずれかである必要があります"
+                )
+        validated[name] = value
+    return validated, None
+
+
+def _serve_task(image_data, options, cache=None):
+    """
+    変換サーバーのワーカーで1件の画像データを変換します。
+    指定されていない変換オプションには、コマンドラインのデフォルト値を使います。
+
+    Returns:
+        tuple: (SVG文字列, エラーメッセージ)。変換中に表示されたエラーをメッセージとして返します。
+    """
+    defaults = default_conversion_options()
+    # キャッシュはクライアントではなくサーバー側で決めます
+    unknown = sorted(set(options) - set(defaults))
+    if unknown:
+        return None, f"無効な変換オプション {', '.join(unknown)}"
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        svg_content = convert_image_data(image_data, **{**defaults, **options}, cache=cache)
+    if svg_content is not None:
+        return svg_content, None
+    errors = [
+        line.removeprefix("エラー: ")
+        for line in output.getvalue().splitlines()
+        if line.startswith("エラー")
+    ]
+    return None, "\n".join(errors) or "変換に失敗しました"
+
+
+def serve_command(argv):
+    """
+    常駐するワーカープロセスで変換する変換サーバーを起動するコマンド。
+    (例: python main.py serve --address 127.0.0.1:8765 --workers 4)
+    """
+    parser = argparse.ArgumentParser(
+        prog="main.py serve",
+        description="変換サーバーを起動します。ワーカープロセスがOpenCVなどを読み込んだまま待機するため、小さな画像を大量に変換する場合の起動時間を省けます。変換は 'python main.py client' で依頼します。",
+    )
+    parser.add_argument(
+        "--address",
+        default=os.environ.get("TO_SVG_SERVER", server.DEFAULT_ADDRESS),
+        help=f"待ち受けるアドレス。'host:port' またはUnixソケットのパス (例: unix:/tmp/to-svg.sock) (デフォルト: 環境変数TO_SVG_SERVER、または {server.DEFAULT_ADDRESS})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="ワーカープロセスの数。0に設定するとCPU数を使います (デフォルト: 0)",
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=server.DEFAULT_QUEUE_SIZE,
+        help=f"処理待ちにできるリクエストの最大数。超えたリクエストはすぐに503で断ります (デフォルト: {server.DEFAULT_QUEUE_SIZE})",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=server.DEFAULT_TIMEOUT,
+        help=f"1リクエストのタイムアウト (秒)。処理待ちの時間を含みます。超えた変換はワーカーを終了させて打ち切ります (デフォルト: {server.DEFAULT_TIMEOUT})",
+    )
+    add_cache_arguments(parser)
+    args = parser.parse_args(argv)
+
+    cache = cache_from_args(args)
+    convert_func = functools.partial(_serve_task, cache=cache) if cache is not None else _serve_task
+    try:
+        server.serve(
+            convert_func,
+            args.address,
+            args.workers,
+            args.queue_size,
+            args.timeout,
+            validate_options=validate_conversion_options,
+        )
+    except FileExistsError as e:
+        print(f"エラー: {e}")
+        sys.exit(1)
+
+
+def tune_command(argv):
+    """
+    変換オプションの組み合わせを試し、SVGのサイズ・頂点数・忠実度のパレート最適な設定を表示するコマンド。
+    (例: python main.py tune logo.png --num_colors 8 16 --epsilon_factor 0.001 0.005)
+    """
+    parser = argparse.ArgumentParser(
+        prog="main.py tune",
+        description="変換結果を画素に戻して元の画像と比べ (PSNR/SSIM)、SVGのサイズ・頂点数・忠実度のパレート最適な変換オプションを探します。前処理・色の量子化・輪郭抽出の結果は、同じ設定の組み合わせで共有します。",
+    )
+    parser.add_argument("input", help="入力画像ファイルへのパス")
+    for name, values in TUNE_GRID.items():
+        parser.add_argument(
+            f"--{name}",
+            type=float if name == "epsilon_factor" else int,
+            nargs="+",
+            default=values,
+            help=f"試す値 (デフォルト: {' '.join(map(str, values))})",
+        )
+    parser.add_argument(
+        "--fidelity",
+        choices=FIDELITY_METRICS,
+        default="ssim",
+        help="パレート最適を求める際の忠実度の指標 (デフォルト: ssim)",
+    )
+    parser.add_argument(
+        "--bg_color",
+        default="255,255,255",
+        help="透明な領域の背景色をRGB形式で指定します ('R,G,B') (デフォルト: '255,255,255')",
+    )
+    parser.add_argument(
+        "--apply_resizing", action="store_true", help="処理前に画像のサイズを調整します。"
+    )
+    parser.add_argument(
+        "--max_side_length",
+        type=int,
+        default=1024,
+        help="調整後の画像の最も長い辺の最大ピクセル数 (デフォルト: 1024)",
+    )
+    parser.add_argument(
+        "--min_area",
+        type=float,
+        default=MIN_CONTOUR_AREA,
+        help=f"これより面積の小さい領域を除きます (デフォルト: {MIN_CONTOUR_AREA})",
+    )
+    parser.add_argument(
+        "--quantizer",
+        choices=QUANTIZERS,
+        default="full",
+        help="色の量子化の方法 (デフォルト: full)",
+    )
+    parser.add_argument(
+        "--sample_size",
+        type=int,
+        default=100000,
+        help="sample/minibatchでパレットの推定に使う最大画素数 (デフォルト: 100000)",
+    )
+    parser.add_argument("--seed", type=int, default=None, help="色の量子化の乱数シード")
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="色ごとの輪郭抽出と近似を並列に実行するスレッド数 (デフォルト: 1)",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="SVGのサイズをコンパクト形式で見積もります。",
+    )
+    parser.add_argument(
+        "--json",
+        help="試した全ての組み合わせとパレート最適な組み合わせをこのJSONファイルに書き込みます。",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        r, g, b = map(int, args.bg_color.split(","))
+    except ValueError:
+        print(f"エラー: 無効な背景色形式 '{args.bg_color}'。'R,G,B'形式を使用してください。")
+        sys.exit(1)
+    grid = {name: getattr(args, name) for name in TUNE_GRID}
+    for name in ("median_blur_ksize", "gaussian_blur_ksize"):
+        adjusted = [k + 1 if k % 2 == 0 and k != 0 else k for k in grid[name]]
+        if adjusted != grid[name]:
+            print(f"警告: {name}は奇数である必要があります。{adjusted} に調整しました。")
+        grid[name] = list(dict.fromkeys(adjusted))
+
+    if not os.path.exists(args.input):
+        print(f"エラー: 入力画像ファイル '{args.input}' が見つかりません。")
+        sys.exit(1)
+    start = time.perf_counter()
+    result = tune_parameters(
         args.input,
-        args.output,
-        args.num_colors,
-        args.apply_sharpening,
-        args.median_blur_ksize,
-        args.dilate_iterations,
-        args.epsilon_factor,
-        args.bg_color,
-        args.apply_resizing,
-        args.max_side_length,
-        args.gaussian_blur_ksize,
-        args.add_stroke,
-        args.stroke_color,
-        args.stroke_width,
+        grid,
+        fidelity=args.fidelity,
+        compact=args.compact,
+        background_fill_color=(r, g, b),
+        apply_resizing=args.apply_resizing,
+        max_side_length=args.max_side_length,
+        min_area=args.min_area,
+        quantizer=args.quantizer,
+        quantizer_sample_size=args.sample_size,
+        random_seed=args.seed,
+        workers=args.threads,
+    )
+    if result is None:
+        print(f"エラー: 画像ファイル '{args.input}' を読み込めません。")
+        sys.exit(1)
+    candidates, front = result
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"\n--- パレート最適な設定 ({len(front)} / {len(candidates)} 件、{elapsed:.2f} 秒) ---"
+    )
+    names = list(TUNE_GRID)
+    print(f"{'バイト':>10} {'頂点数':>8} {'PSNR':>7} {'SSIM':>7}  " + " ".join(names))
+    for c in front:
+        print(
+            f"{c['bytes']:>10} {c['vertices']:>8} {c['psnr']:>7.2f} {c['ssim']:>7.4f}  "
+            + " ".join(f"{c['params'][name]:g}" for name in names)
+        )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"candidates": candidates, "front": front}, f, ensure_ascii=False, indent=2)
+        print(f"結果を {args.json} に書き込みました")
+
+
+def client_command(argv):
+    """
+    変換サーバーに変換を依頼するコマンド。変換オプションは通常の変換と同じです。
+    (例: python main.py client icons/ --output svg/ --jobs 8)
+    """
+    parser = argparse.ArgumentParser(
+        prog="main.py client",
+        description="'python main.py serve' で起動した変換サーバーで画像をSVGに変換します。",
+    )
+    parser.add_argument(
+        "input",
+        nargs="+",
+        help="入力画像ファイルへのパス。複数のファイル、globパターン、ディレクトリも指定できます",
+    )
+    parser.add_argument(
+        "--output",
+        help="出力SVGファイルへのパス。複数の入力を変換する場合は出力先のディレクトリ (デフォルト: 入力ファイルの拡張子を.svgに変更したもの)",
+    )
+    parser.add_argument(
+        "--server",
+        help=f"変換サーバーのアドレス (デフォルト: 環境変数TO_SVG_SERVER、または {server.DEFAULT_ADDRESS})",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="同時に送るリクエストの数。0に設定するとCPU数を使います (デフォルト: 1)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=server.DEFAULT_TIMEOUT,
+        help=f"1リクエストのタイムアウト (秒)。サーバーのタイムアウトより長くはなりません (デフォルト: {server.DEFAULT_TIMEOUT})",
+    )
+    add_conversion_arguments(parser)
+    args = parser.parse_args(argv)
+    options = conversion_options_from_args(args)
+
+    single_input = args.input[0]
+    if len(args.input) == 1 and not os.path.isdir(single_input) and not GLOB_PATTERN.search(single_input):
+        tasks = [(single_input, args.output or resolve_output_path(single_input))]
+    else:
+        if args.output is not None:
+            os.makedirs(args.output, exist_ok=True)
+        tasks = [
+            (input_path, resolve_output_path(input_path, args.output))
+            for input_path in collect_input_paths(args.input)
+        ]
+    if not tasks:
+        print("エラー: 変換する入力画像ファイルが見つかりません。")
+        sys.exit(1)
+
+    # 接続を使い回すため、スレッドごとにクライアントを作成します
+    local = threading.local()
+
+    def convert_one(task):
+        input_path, output_path = task
+        if not hasattr(local, "client"):
+            local.client = server.ConversionClient(args.server, timeout=args.timeout)
+        try:
+            with open(input_path, "rb") as f:
+                image_data = f.read()
+        except OSError:
+            return input_path, "入力画像ファイルが見つかりません"
+        svg_content, error = local.client.convert(image_data, options)
+        if svg_content is None:
+            return input_path, error
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(svg_content)
+        return input_path, None
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+    start = time.perf_counter()
+    if jobs == 1 or len(tasks) == 1:
+        results = [convert_one(task) for task in tasks]
+    else:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(convert_one, tasks))
+
+    failures = [(input_path, error) for input_path, error in results if error is not None]
+    for input_path, error in failures:
+        print(f"エラー: '{input_path}': {error}")
+    if len(tasks) == 1:
+        if not failures:
+            print(f"高精細SVGファイルが {tasks[0][1]} に正常に作成されました")
+    else:
+        print(
+            f"合計: {len(tasks)} ファイル (変換 {len(tasks) - len(failures)}, 失敗 {len(failures)}) "
+            f"/ {time.perf_counter() - start:.2f} 秒"
+        )
+    if failures:
+        sys.exit(1)
+
+
+def main():
+    if sys.argv[1:2] == ["prune-cache"]:
+        prune_cache(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["serve"]:
+        serve_command(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["client"]:
+        client_command(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["tune"]:
+        tune_command(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(
+        description="画像をSVGに変換します。画像処理を使用します。",
+        epilog="キャッシュの削除: python main.py prune-cache --max_mb 100 / 変換サーバー: python main.py serve、python main.py client / 変換オプションの探索: python main.py tune",
+    )
+    parser.add_argument(
+        "input",
+        nargs="+",
+        help="入力画像ファイルへのパス。複数のファイル、globパターン (例: 'images/*.png')、ディレクトリも指定できます (例: test.png)",
+    )
+    parser.add_argument(
+        "--output",
+        help="出力SVGファイルへのパス。複数の入力を変換する場合は出力先のディレクトリ (デフォルト: 入力ファイルの拡張子を.svgに変更したもの)",
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="複数の入力を変換する際に並列に実行するプロセス数。0に設定するとCPU数を使います (デフォルト: 1)",
+    )
+    parser.add_argument(
+        "--profile-json",
+        dest="profile_json",
+        help="ステージごとの処理時間、k-meansの反復回数、輪郭数・頂点数、ピークメモリなどをこのJSONファイルに書き込みます。",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="複数の入力を変換する際、入力より新しい出力SVGファイルがあっても変換し直します。",
+    )
+    parser.add_argument(
+        "--levels",
+        type=float,
+        nargs="+",
+        help="複数の詳細度のSVGを出力します (例: --levels 0.01 0.002 0.0005 または --levels 500 5000)。1未満の値はepsilon_factor、1以上の値は頂点数の合計の上限として扱います。色の量子化と輪郭抽出は1回だけ行い、各レベルを {出力名}_{レベル}.svg に書き込みます。",
+    )
+    parser.add_argument(
+        "--max-vertices",
+        dest="max_vertices",
+        type=int,
+        default=0,
+        help="頂点数の合計がこの値以下になる、できるだけ細かい近似で出力します (epsilon_factorの代わりに使います)。輪郭の抽出は1回だけ行い、近似だけを繰り返して探します。",
+    )
+    parser.add_argument(
+        "--max-bytes",
+        dest="max_bytes",
+        type=int,
+        default=0,
+        help="SVGファイルのサイズがこの値 (バイト) 以下になる、できるだけ細かい近似で出力します。サイズはファイルに書き込まずに見積もります。--max-verticesと同時に指定すると両方を満たします。",
+    )
+    parser.add_argument(
+        "--budget-allocation",
+        dest="budget_allocation",
+        choices=convert.BUDGET_ALLOCATIONS,
+        default="area",
+        help="--max-vertices / --max-bytes / --levelsの頂点数の上限を輪郭に配分する方法。area: 全ての輪郭を同じ距離 (px) で近似し、大きな領域ほど多くの頂点を割り当てます。uniform: 全ての輪郭に同じepsilon_factorを使います (デフォルト: area)",
+    )
+    parser.add_argument(
+        "--animate",
+        action="store_true",
+        help="GIFや動画 (.gif, .mp4など) を入力した場合に、フレームごとのSVG ({出力名}_0000.svg, ...) ではなく、SMILアニメーションで切り替える1つのSVGに出力します。",
+    )
+    parser.add_argument(
+        "--change_threshold",
+        type=float,
+        default=sequence.DEFAULT_CHANGE_THRESHOLD,
+        help=f"GIFや動画の変換で、直前に輪郭を抽出したフレームからラベルが変わった画素の割合がこの値以下の場合、輪郭を抽出せずに直前のフレームの結果を再利用します。負の値を指定すると再利用しません (デフォルト: {sequence.DEFAULT_CHANGE_THRESHOLD})",
+    )
+    parser.add_argument(
+        "--incremental",
+        dest="incremental_update",
+        action="store_true",
+        help="変換結果 (パレット、ラベルマップ、領域ごとのパス) を出力SVGファイルの隣の {出力名}.npz に保存し、次回の変換ではこれと比べて画像の変化した部分だけを変換し直します。変化のないパスは前回とバイト単位で同じになります。",
+    )
+    parser.add_argument(
+        "--palette-in",
+        dest="palette_in",
+        help="パレットファイル (JSON) の色を使って変換します。k-meansを行わず、各画素をパレットの最も近い色に割り当てるため、多数のファイルを同じ色で高速に変換できます。",
+    )
+    parser.add_argument(
+        "--palette-out",
+        dest="palette_out",
+        help="入力画像 (複数の入力やディレクトリの場合は全ての画像) から抽出した画素でパレットを求めてこのJSONファイルに保存し、そのパレットで全ての入力を変換します。",
+    )
+    parser.add_argument(
+        "--palette-space",
+        dest="palette_space",
+        choices=PALETTE_SPACES,
+        default="rgb",
+        help="--palette-in / --palette-out のパレットの色に割り当てる際に距離を測る色空間。rgb: RGBの距離 (--palette-outでパレットを求める際と同じ色空間)、lab: 見た目の近さ (CIE L*a*b*) (デフォルト: rgb)",
+    )
+    add_conversion_arguments(parser)
+    add_cache_arguments(parser)
+
+    args = parser.parse_args()
+    options = conversion_options_from_args(args)
+    success, palette = palette_from_args(args, options)
+    if not success:
+        sys.exit(1)
+    options["palette"] = palette
+    options["palette_space"] = args.palette_space
+    options["cache"] = cache_from_args(args)
+    options["levels"] = args.levels
+    options["max_vertices"] = args.max_vertices
+    options["max_bytes"] = args.max_bytes
+    options["budget_allocation"] = args.budget_allocation
+    options["animate"] = args.animate
+    options["change_threshold"] = args.change_threshold
+    options["incremental_update"] = args.incremental_update
+
+    # 単一のファイルが指定された場合は従来どおり1ファイルだけ変換します
+    single_input = args.input[0]
+    if (
+        len(args.input) == 1
+        and not os.path.isdir(single_input)
+        and not GLOB_PATTERN.search(single_input)
+    ):
+        if args.profile_json:
+            result = _convert_task(single_input, args.output, options, profile=True)
+            write_profile(args.profile_json, [result])
+            success = result["success"]
+        else:
+            success = run_conversion(single_input, args.output, **options)
+    else:
+        input_paths = collect_input_paths(args.input)
+        if not input_paths:
+            print("エラー: 変換する入力画像ファイルが見つかりません。")
+            sys.exit(1)
+        success = run_batch(
+            input_paths,
+            args.output,
+            options,
+            jobs=args.jobs,
+            force=args.force,
+            profile_json=args.profile_json,
+        )
+
+    if not success:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import tempfile
+from importlib import metadata
+
+import numpy as np
+
+# キャッシュディレクトリのデフォルト（環境変数 TO_SVG_CACHE_DIR で変更できます）
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "to-svg")
+# キャッシュの最大サイズのデフォルト (バイト)
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# 他のプロセスが書き込んだ分を反映するため、この回数の保存ごとにディレクトリを走査し直します
+RESCAN_INTERVAL = 1000
+# 最大サイズを超えた場合は、この割合まで削除します。続けて保存するたびに削除
+# (ディレクトリの走査) が起きないよう、余裕を持たせます
+PRUNE_TARGET_RATIO = 0.9
+
+_library_version = None
+
+
+def library_version():
+    """
+    キャッシュキーに含めるライブラリのバージョン文字列を返します。
+    パッケージのバージョンに加えてソースコードのハッシュを含めるため、
+    変換処理が変更された場合は古いキャッシュが使われません。
+    """
+    global _library_version
+    if _library_version is None:
+        try:
+            version = metadata.version("to-svg")
+        except metadata.PackageNotFoundError:
+            version = "unknown"
+        digest = hashlib.sha256()
+        src_dir = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(src_dir)):
+            if name.endswith(".py"):
+                with open(os.path.join(src_dir, name), "rb") as f:
+                    digest.update(f.read())
+        _library_version = f"{version}+{digest.hexdigest()[:16]}"
+    return _library_version
+
+
+def image_digest(image):
+    """
+    入力画像の内容のハッシュを返します。OpenCVでデコードせずに計算できるよう、
+    パスやバイト列の場合はエンコードされたファイルの内容をハッシュします。
+    読み込めない場合はNoneを返します。
+    """
+    digest = hashlib.sha256()
+    if isinstance(image, np.ndarray):
+        digest.update(f"{image.shape}{image.dtype}".encode())
+        digest.update(np.ascontiguousarray(image).data)
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        digest.update(image)
+    else:
+        try:
+            with open(image, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        except OSError:
+            return None
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    変換結果のSVGを保存する、内容アドレス方式のディスクキャッシュ。
+
+    キーは入力画像のハッシュ、全ての変換オプション、ライブラリのバージョンから作られます。
+    合計サイズがmax_bytesを超えると、最も長く使われていないSVGから削除します (LRU)。
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or os.environ.get("TO_SVG_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # 合計サイズの見積もり。保存のたびにディレクトリを走査しないよう、
+        # 最初の保存時に1回だけ求め、以降は保存と削除の分だけ更新します
+        self._total_bytes = None
+        self._puts_since_scan = 0
+
+    def make_key(self, image, options):
+        """入力画像と変換オプションからキャッシュキーを作成します。"""
+        image_hash = image_digest(image)
+        if image_hash is None:
+            return None
+        payload = json.dumps(
+            {"version": library_version(), "image": image_hash, "options": options},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.svg")
+
+    def get(self, key):
+        """キャッシュされたSVG文字列を返します。見つからない場合はNoneを返します。"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                svg_content = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        # 最終使用時刻を更新し、LRUで削除されにくくします
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return svg_content
+
+    def put(self, key, svg_content):
+        """
+        SVG文字列をキャッシュに保存します。合計サイズが最大サイズを超えた場合は、
+        最大サイズのPRUNE_TARGET_RATIOの割合になるまで、最も長く使われていないSVGから削除します。
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self._total_bytes is None or self._puts_since_scan >= RESCAN_INTERVAL:
+            self._total_bytes = sum(size for _, size, _ in self._entries())
+            self._puts_since_scan = 0
+        try:
+            replaced_size = os.path.getsize(path)
+        except OSError:
+            replaced_size = 0
+        # 並列に書き込まれても壊れたファイルが読まれないよう、一時ファイルから置き換えます
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(svg_content)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        self._total_bytes += size - replaced_size
+        self._puts_since_scan += 1
+        if self._total_bytes > self.max_bytes:
+            self.prune(int(self.max_bytes * PRUNE_TARGET_RATIO))
+
+    def _entries(self):
+        """キャッシュ内のSVGファイルを (最終使用時刻, サイズ, パス) のリストで返します。"""
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for sub in os.scandir(self.cache_dir):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith(".svg"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def prune(self, max_bytes=None):
+        """
+        合計サイズがmax_bytes以下になるまで、最も長く使われていないSVGから削除します。
+
+        Returns:
+            tuple: (削除したファイル数, 削除したバイト数)。
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        removed = freed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+            freed += size
+        self._total_bytes = total
+        self._puts_since_scan = 0
+        return removed, freed
+
+    def stats(self):
+        """キャッシュの状態 (ファイル数, 合計サイズ, ヒット数, ミス数) を返します。"""
+        entries = self._entries()
+        return {
+            "files": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -1,47 +1,211 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
+from .metrics import NULL_METRICS
 
-def contour_to_svg_path(contour, epsilon_factor=0.001):
-    """OpenCVの輪郭データをSVGパス文字列に変換します（近似付き）"""
+def approximate_contour(contour, epsilon_factor=0.001, tolerance=0):
+    """
+    OpenCVの輪郭を近似し、頂点の (N, 2) 配列を返します。近似できない場合はNoneを返します。
+    tolerance (px) が0より大きい場合は、周囲長によらずこの距離で近似します。
+    """
     
     # 輪郭が空でないことを確認
     if contour is None or len(contour) < 3: # 少なくとも3点必要
-        return ""
+        return None
 
     # epsilonを計算します（輪郭の周囲長に対する比率）
     perimeter = cv2.arcLength(contour, True)
     if perimeter == 0: # 周囲長が0の場合は処理しない
-        return ""
-    epsilon = epsilon_factor * perimeter
+        return None
+    epsilon = tolerance if tolerance > 0 else epsilon_factor * perimeter
     
     # 輪郭を近似します
     approx_contour = cv2.approxPolyDP(contour, epsilon, True)
     
-    # 近似された輪郭からパスデータを生成します
-    if len(approx_contour) < 1: # 近似された輪郭が空の場合を処理します
+    # 近似された輪郭が空の場合を処理します
+    if len(approx_contour) < 1:
+        return None
+    return approx_contour.reshape(-1, 2)
+
+def points_to_svg_path(points):
+    """
+    頂点の (N, 2) 配列をSVGパス文字列 (M x,y L x,y ... Z) に変換します。
+    文字列の連結を繰り返さず、全頂点を1回の書式化でまとめて変換します。
+    """
+    coords = np.asarray(points).reshape(-1).tolist()
+    template = "M %d,%d" + " L %d,%d" * (len(coords) // 2 - 1) + " Z"
+    return template % tuple(coords)
+
+def contour_to_svg_path(contour, epsilon_factor=0.001):
+    """OpenCVの輪郭データをSVGパス文字列に変換します（近似付き）"""
+    points = approximate_contour(contour, epsilon_factor)
+    if points is None:
         return ""
+    return points_to_svg_path(points)
+
+# JPEGのフレームヘッダ (SOFn) のマーカー。画像サイズを含みます
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# アルファ合成で一度に処理する画素数（一時メモリの上限を決めます）
+ALPHA_BLEND_CHUNK_PIXELS = 1 << 20
+# 縮小デコードの倍率と、対応するOpenCVの読み込みフラグ
+_REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+def read_jpeg_size(data):
+    """
+    JPEGのヘッダから画像の (幅, 高さ) を読み取ります。JPEGでない場合はNoneを返します。
+    """
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF: # 詰め物のバイトを読み飛ばします
+            i += 1
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9: # 長さを持たないマーカー
+            i += 2
+            continue
+        i += 2 + ((data[i + 2] << 8) | data[i + 3])
+    return None
+
+def _decode_image(image, max_side_length=0):
+    """
+    画像を読み込み、(画像, 元の画像の (幅, 高さ)) を返します。読み込めなかった場合は (None, None)。
+
+    max_side_lengthが0より大きく、入力がJPEGの場合は、最大辺がmax_side_length以上に
+    保たれる範囲でデコーダーの縮小デコード (IMREAD_REDUCED_*) を使い、
+    デコードの時間とメモリを削減します。JPEGはアルファチャンネルを持たないため、
+    透明度の処理は変わりません。
+    """
+    if isinstance(image, np.ndarray):
+        img = image
+    else:
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            data = image
+        elif max_side_length > 0:
+            # 縮小デコードの判定のため、エンコードされたファイルをそのまま読み込みます
+            try:
+                with open(image, "rb") as f:
+                    data = f.read()
+            except OSError:
+                print(f"エラー: {image} から画像を読み込めませんでした")
+                return None, None
+        else:
+            data = None
+
+        flags = cv2.IMREAD_UNCHANGED
+        original_size = None
+        if data is not None and max_side_length > 0:
+            original_size = read_jpeg_size(data)
+            if original_size is not None:
+                for factor, reduced_flag in _REDUCED_DECODE_FLAGS:
+                    if max(original_size) / factor >= max_side_length:
+                        # IMREAD_UNCHANGEDと同様にEXIFの回転情報は無視します
+                        flags = reduced_flag | cv2.IMREAD_IGNORE_ORIENTATION
+                        break
+
+        if data is None:
+            img = cv2.imread(image, flags)
+        else:
+            buffer = np.frombuffer(data, dtype=np.uint8)
+            if buffer.size == 0:
+                print("エラー: 画像データが空です")
+                return None, None
+            img = cv2.imdecode(buffer, flags)
+        if img is None:
+            if isinstance(image, (bytes, bytearray, memoryview)):
+                print("エラー: 画像データをデコードできませんでした")
+            else:
+                print(f"エラー: {image} から画像を読み込めませんでした")
+            return None, None
+        if flags != cv2.IMREAD_UNCHANGED:
+            return img, original_size
 
-    path_data = f"M {approx_contour[0][0][0]},{approx_contour[0][0][1]}"
-    for point in approx_contour[1:]:
-        x, y = point[0]
-        path_data += f" L {x},{y}"
-    path_data += " Z"
-    return path_data
+    # グレースケール画像は3チャンネルに変換します
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    return img, (img.shape[1], img.shape[0])
 
-def preprocess_image(image_path: str, background_fill_color: tuple, apply_resizing: bool, max_side_length: int):
+def load_image(image):
+    """
+    画像ファイルへのパス、エンコードされた画像のバイト列、または画像配列から
+    OpenCV形式 (BGR/BGRA) の画像を取得します。読み込めなかった場合はNoneを返します。
+    """
+    img, _ = _decode_image(image)
+    return img
+
+def composite_alpha(img, background_fill_color):
+    """
+    BGRA画像を指定した背景色の上に合成し、BGR画像を返します。
+
+    浮動小数点の一時配列を作らず、uint16の固定小数点演算
+    (前景 * a + 背景 * (255 - a)) // 255 で行ごとに合成するため、
+    一時メモリは最大ALPHA_BLEND_CHUNK_PIXELS画素分に抑えられます。
+    アルファが全て不透明または全て透明の場合は合成を省略します。
+
+    Args:
+        img (np.ndarray): (高さ, 幅, 4) のBGRA画像。
+        background_fill_color (tuple): 背景色を表すRGBタプル。
+
+    Returns:
+        np.ndarray: (高さ, 幅, 3) のBGR画像。
+    """
+    h, w = img.shape[:2]
+    alpha = img[:, :, 3]
+
+    # 指定された背景塗りつぶし色を使用します（OpenCV用にBGRに変換）
+    bg_r, bg_g, bg_b = background_fill_color # RGBタプルを展開します
+    background_color_bgr = np.array((bg_b, bg_g, bg_r), dtype=np.uint16)
+
+    alpha_min, alpha_max = alpha.min(), alpha.max()
+    if alpha_min == 255: # 完全に不透明な場合は前景をそのまま使います
+        return cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+    if alpha_max == 0: # 完全に透明な場合は背景色だけの画像になります
+        return np.full((h, w, 3), background_color_bgr.astype(np.uint8), dtype=np.uint8)
+
+    img_blended = np.empty((h, w, 3), dtype=np.uint8)
+    rows = max(ALPHA_BLEND_CHUNK_PIXELS // max(w, 1), 1)
+    for y0 in range(0, h, rows):
+        y1 = min(y0 + rows, h)
+        a = alpha[y0:y1, :, None].astype(np.uint16)
+        # 前景 * a + 背景 * (255 - a) は最大 255 * 255 なのでuint16に収まります
+        blended = img[y0:y1, :, :3].astype(np.uint16)
+        blended *= a
+        np.subtract(255, a, out=a)
+        blended += a * background_color_bgr
+        blended //= 255
+        img_blended[y0:y1] = blended
+    return img_blended
+
+def preprocess_image(image, background_fill_color: tuple, apply_resizing: bool, max_side_length: int, metrics=NULL_METRICS):
     """
     画像を読み込み、透明度を処理し、必要に応じてリサイズします。
+    imageには画像ファイルへのパス、画像のバイト列、または画像配列を指定できます。
+    縮小する場合、可能であれば縮小した解像度で直接デコードします。
+    metricsを指定すると、読み込み・リサイズ・アルファ合成の時間を記録します。
     """
-    img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    resize_target = max_side_length if apply_resizing else 0
+    with metrics.stage("load"):
+        img, original_size = _decode_image(image, resize_target)
     if img is None:
-        print(f"エラー: {image_path} から画像を読み込めませんでした")
         return None
+    w_orig, h_orig = original_size
+    metrics.set("input_pixels", w_orig * h_orig)
 
     # 画像サイズ調整を適用
     if apply_resizing and max_side_length > 0:
-        h_orig, w_orig = img.shape[:2]
-        
-        # 現在の画像の最も長い辺の長さを計算
+        # 元の画像の最も長い辺の長さを計算（縮小デコードした場合も元のサイズを基準にします）
         current_max_side = max(h_orig, w_orig)
 
         # 指定されたmax_side_lengthに合わせて画像をリサイズ
@@ -51,34 +215,65 @@ def preprocess_image(image_path: str, background_fill_color: tuple, apply_resizi
             new_w = int(w_orig * scaling_factor)
             new_h = int(h_orig * scaling_factor)
             
-            # 拡大の場合はcv2.INTER_LINEARまたはcv2.INTER_CUBIC、縮小の場合はcv2.INTER_AREAが適している
-            # ここでは汎用的にcv2.INTER_LINEARを使用するか、
-            # もしくは拡大と縮小で補間方法を切り替えることも可能
-            # 今回はシンプルにINTER_LINEARを使用します。
-            img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+            # 縮小の場合はcv2.INTER_AREA、拡大の場合はcv2.INTER_LINEARを使用します
+            if scaling_factor < 1:
+                interpolation = cv2.INTER_AREA
+            else:
+                interpolation = cv2.INTER_LINEAR
+            if img.shape[:2] != (new_h, new_w):
+                with metrics.stage("resize"):
+                    img = cv2.resize(img, (new_w, new_h), interpolation=interpolation)
             print(f"画像を {w_orig}x{h_orig} から {new_w}x{new_h} にリサイズしました。")
 
     # 透明なPNGのアルファチャンネルを処理します
     if img.shape[2] == 4: # 画像が4チャンネル（BGRA）の場合
-        b, g, r, a = cv2.split(img) # チャンネルを分割します
-        
-        # 処理用の3チャンネル画像を作成します
-        img_3_channel = cv2.merge((b, g, r))
-        
-        # 指定された背景塗りつぶし色を使用します（OpenCV用にBGRに変換）
-        bg_b, bg_g, bg_r = background_fill_color # RGBタプルを展開します
-        background_color_bgr = (bg_r, bg_g, bg_b) # OpenCVはBGR順
-
-        # 背景画像を作成します
-        background = np.full_like(img_3_channel, background_color_bgr)
-        
-        # アルファチャンネルを正規化してマスクとして使用します
-        alpha_normalized = a / 255.0
-        alpha_3_channel = cv2.merge((alpha_normalized, alpha_normalized, alpha_normalized))
-        
-        # 前景と背景をブレンドします
-        img_blended = (img_3_channel * alpha_3_channel).astype(np.uint8) + \
-                      (background * (1 - alpha_3_channel)).astype(np.uint8)
-        return img_blended
+        with metrics.stage("alpha_blend"):
+            return composite_alpha(img, background_fill_color)
     else: # 3チャンネル画像（BGR）の場合、そのまま返します
         return img
+
+def filter_image(img, gaussian_blur_ksize=0, median_blur_ksize=0, apply_sharpening=False, metrics=NULL_METRICS):
+    """
+    画像にガウシアンブラー、メディアンブラー、シャープニングを順に適用します。
+    """
+    # ガウシアンブラーを適用します
+    if gaussian_blur_ksize > 0:
+        with metrics.stage("gaussian_blur"):
+            img = cv2.GaussianBlur(img, (gaussian_blur_ksize, gaussian_blur_ksize), 0)
+
+    # ノイズ除去のためにメディアンブラーを適用します
+    if median_blur_ksize > 0:
+        with metrics.stage("median_blur"):
+            img = cv2.medianBlur(img, median_blur_ksize)
+
+    # シャープニングを適用
+    if apply_sharpening:
+        sharpening_kernel = np.array(
+            [[0, -1, 0], [-1, 5, -1], [0, -1, 0]], dtype=np.float32
+        )
+        with metrics.stage("sharpen"):
+            img = cv2.filter2D(img, -1, sharpening_kernel)
+
+    return img
+
+def filter_margin(gaussian_blur_ksize=0, median_blur_ksize=0, apply_sharpening=False):
+    """
+    filter_imageの結果が、画像の一部を切り出して処理しても変わらないために必要な余白 (px)。
+    """
+    return max(gaussian_blur_ksize, 0) // 2 + max(median_blur_ksize, 0) // 2 + int(apply_sharpening)
+
+def resolve_workers(workers):
+    """スレッド数の指定を解決します。0以下の場合はCPU数を使います。"""
+    return workers if workers > 0 else os.cpu_count() or 1
+
+def parallel_map(func, items, workers=1):
+    """
+    itemsの各要素にfuncを適用した結果のリストを、itemsと同じ順序で返します。
+    workersが2以上の場合はスレッドプールで並列に実行します
+    （OpenCVの処理の多くはGILを解放するため、スレッドでも並列に動作します）。
+    """
+    workers = resolve_workers(workers)
+    if workers == 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
@@ -1,12 +1,183 @@
+import inspect
+import io
+import itertools
+import os
+import time
 import cv2
 import numpy as np
-import svgwrite
-from .common import contour_to_svg_path, preprocess_image
+from .cache import image_digest
+from .common import approximate_contour, filter_image, parallel_map, preprocess_image
+from .extract import (
+    MIN_CONTOUR_AREA,
+    build_label_map,
+    despeckle_label_map,
+    extract_color_contours,
+    resolve_min_area,
+)
+from .metrics import NULL_METRICS
+from .quantize import assign_to_palette, quantize_colors
+from .svg_writer import write_compact_svg, write_svg
+from .tiling import extract_regions_tiled
 
+# プレビューに使う縮小画像の最大辺の長さのデフォルト (px)
+PREVIEW_MAX_SIDE_LENGTH = 256
 
-def png_color_to_svg_high_fidelity(
-    image_path,
-    output_path,
+# 頂点数やファイルサイズの上限から近似の度合いを探す範囲 (epsilon_factorと、
+# 輪郭からの距離 (px) で近似する場合の許容誤差) と、探索を終える上下限の比
+EPSILON_SEARCH_RANGE = (1e-5, 0.1)
+TOLERANCE_SEARCH_RANGE = (0.01, 100.0)
+BUDGET_SEARCH_RATIO = 1.02
+# 頂点数やファイルサイズの上限を輪郭に配分する方法
+BUDGET_ALLOCATIONS = ("area", "uniform")
+
+
+def preprocess_stage(
+    image,
+    background_fill_color,
+    apply_resizing,
+    max_side_length,
+    gaussian_blur_ksize,
+    median_blur_ksize,
+    apply_sharpening,
+    metrics=NULL_METRICS,
+):
+    """
+    ステージ1: 画像を読み込み、透明度の処理・リサイズ・ブラー・シャープニングを適用します。
+    画像を読み込めなかった場合はNoneを返します。
+    """
+    img_processed = preprocess_image(
+        image, background_fill_color, apply_resizing, max_side_length, metrics
+    )
+    if img_processed is None:
+        return None
+
+    return filter_image(
+        img_processed, gaussian_blur_ksize, median_blur_ksize, apply_sharpening, metrics
+    )
+
+
+def quantize_stage(
+    img_processed,
+    num_colors,
+    quantizer,
+    quantizer_sample_size,
+    random_seed,
+    palette=None,
+    palette_space="rgb",
+    metrics=NULL_METRICS,
+):
+    """
+    ステージ2: 色を量子化し、(ラベルマップ, 各ラベルのBGR色) を返します。
+    paletteを指定した場合はk-meansを行わず、各画素をパレットの最も近い色に
+    (palette_spaceの色空間で測った距離で) 割り当てます。
+    """
+    if palette is not None:
+        with metrics.stage("assign"):
+            labels, _ = assign_to_palette(
+                img_processed.reshape((-1, 3)), palette, color_space=palette_space
+            )
+        with metrics.stage("label_map"):
+            return build_label_map(
+                labels, np.asarray(palette, dtype=np.uint8), img_processed.shape[:2]
+            )
+
+    labels, centers, mse = quantize_colors(
+        img_processed,
+        num_colors,
+        quantizer=quantizer,
+        sample_size=quantizer_sample_size,
+        random_seed=random_seed,
+        metrics=metrics,
+    )
+    print(f"色の量子化 ({quantizer}): 平均二乗誤差 {mse:.2f}")
+    metrics.set("quantize_mse", float(mse))
+
+    # 量子化画像を作る代わりにラベルマップを直接使い、各色が占める範囲だけを処理します
+    with metrics.stage("label_map"):
+        return build_label_map(labels, centers, img_processed.shape[:2])
+
+
+def despeckle_stage(label_map, num_labels, min_area, workers=1, metrics=NULL_METRICS):
+    """
+    ステージ2.5: 面積がmin_area未満の連結成分を、隣の最も接している色に統合します。
+    """
+    with metrics.stage("despeckle"):
+        return despeckle_label_map(
+            label_map,
+            num_labels,
+            resolve_min_area(min_area, label_map.shape),
+            workers,
+            metrics,
+        )
+
+
+def extract_stage(
+    label_map,
+    num_labels,
+    dilate_iterations,
+    min_area=MIN_CONTOUR_AREA,
+    workers=1,
+    metrics=NULL_METRICS,
+):
+    """
+    ステージ3: 各色の輪郭を抽出し、面積がmin_area未満の領域を除いたリストを返します。
+    各要素は "label", "area", "contour" を持つ辞書です。
+    workersを指定すると色ごとの処理をスレッドで並列に実行します。
+    """
+    min_area = resolve_min_area(min_area, label_map.shape)
+    regions = []
+    found = 0
+
+    # Cannyエッジ検出のロジックを削除し、常に色の輪郭抽出を実行
+    with metrics.stage("extract"):
+        for label, contours in extract_color_contours(
+            label_map, num_labels, dilate_iterations, workers, metrics
+        ):
+            found += len(contours)
+            for contour in contours:
+                area = cv2.contourArea(contour)
+                if area < min_area:
+                    continue
+                regions.append({"label": label, "area": area, "contour": contour})
+    metrics.count("contours_found", found)
+    metrics.count("contours_kept", len(regions))
+    return regions
+
+
+def simplify_stage(
+    regions, colors, epsilon_factor, workers=1, metrics=NULL_METRICS, tolerance=0
+):
+    """
+    ステージ4: 輪郭を近似し、描画順（面積の大きい順）に並べたパスのリストを返します。
+    workersを指定すると輪郭の近似をスレッドで並列に実行します。
+    tolerance (px) が0より大きい場合はepsilon_factorの代わりに、全ての輪郭をこの距離で近似します。
+    """
+    completed = itertools.count(1)
+
+    def approximate(region):
+        points = approximate_contour(region["contour"], epsilon_factor, tolerance)
+        metrics.progress("simplify", next(completed), len(regions))
+        return points
+
+    with metrics.stage("simplify"):
+        all_points = parallel_map(approximate, regions, workers)
+    all_paths = []
+    for region, points in zip(regions, all_points):
+        if points is None:
+            continue
+        all_paths.append(
+            {"area": region["area"], "points": points, "color": colors[region["label"]]}
+        )
+
+    all_paths.sort(key=lambda p: p["area"], reverse=True)
+    metrics.count("vertices_before", sum(len(region["contour"]) for region in regions))
+    metrics.count("vertices_after", sum(len(path["points"]) for path in all_paths))
+    metrics.count("paths", len(all_paths))
+    return all_paths
+
+
+def vectorize_image(
+    image,
     num_colors=16,
     epsilon_factor=0.001,
     background_fill_color=(255, 255, 255),
@@ -16,17 +187,29 @@ def png_color_to_svg_high_fidelity(
     apply_resizing=False,
     max_side_length=1024,
     gaussian_blur_ksize=0,
-    add_stroke=False,
-    stroke_color=(0, 0, 0),
-    stroke_width=1.0,
+    quantizer="full",
+    quantizer_sample_size=100000,
+    random_seed=None,
+    min_area=MIN_CONTOUR_AREA,
+    despeckle=False,
+    tile_size=0,
+    palette=None,
+    palette_space="rgb",
+    workers=1,
+    stage_cache=None,
+    metrics=None,
 ):
     """
-    カラーPNGを高精細なSVGに<path>要素を使用して変換します。
+    カラー画像を色ごとの輪郭（SVGの<path>要素の元になる多角形）に変換します。
     画像の前処理（ノイズ除去など）を追加し、透明度を処理します。
 
+    処理は 前処理 → 色の量子化 → 輪郭抽出 → 近似 のステージに分かれており、
+    stage_cacheを指定すると各ステージの結果を再利用します。
+
     Args:
-        image_path (str): 入力PNG画像へのパス。
-        output_path (str): 出力SVGファイルを保存するパス。
+        image (str | bytes | np.ndarray): 入力画像。画像ファイルへのパス、
+                                          エンコードされた画像ファイルのバイト列、
+                                          またはOpenCV形式 (BGR/BGRA) の画像配列。
         num_colors (int): 画像を量子化する色の数。
         epsilon_factor (float): 輪郭近似のための係数。
         background_fill_color (tuple): 透明な領域の背景色を表すRGBタプル
@@ -38,97 +221,1081 @@ def png_color_to_svg_high_fidelity(
         apply_resizing (bool): 処理前に画像を縮小するかどうか。
         max_side_length (int): 画像を縮小する場合の最大辺の長さ (px)。
         gaussian_blur_ksize (int): ガウシアンブラーのカーネルサイズ。0に設定するとブラーを適用しません。
-        add_stroke (bool): 生成されるSVGパスにストロークを追加するかどうか。
-        stroke_color (tuple): ストロークの色を表すRGBタプル。
-        stroke_width (float): ストロークの太さ。
+        quantizer (str): 色の量子化の方法 ("full", "sample", "minibatch", "histogram")。
+        quantizer_sample_size (int): "sample"/"minibatch"でパレットの推定に使う最大画素数。
+        random_seed (int): 量子化の乱数シード。指定すると結果が再現可能になります。
+        min_area (float): これより面積の小さい領域を除きます。1以上の値は画素数、
+                          1未満の値は画像の面積に対する割合として扱います。
+        despeckle (bool): 輪郭を抽出する前に、面積がmin_area未満の連結成分を
+                          接している長さが最も長い隣の色に統合するかどうか。
+                          ノイズの多い画像で輪郭抽出の時間を大きく削減でき、穴も残りません。
+        tile_size (int): 0より大きい場合、画像をこの大きさのタイルに分割して処理します。
+                         パレットは抽出した画素から画像全体で共通のものを求め、
+                         タイルの境界をまたぐ輪郭はつなぎ合わせます。
+                         巨大な画像をリサイズせずに変換する場合に使います。
+        palette (np.ndarray): 量子化に使うBGR色 (k, 3)。指定するとk-meansを行わず、
+                              各画素を最も近い色に割り当てます (num_colorsなどは使いません)。
+        palette_space (str): paletteの色に割り当てる際に距離を測る色空間 ("rgb", "lab")。
+                             "lab"の場合はCIE L*a*b*で見た目に最も近い色に割り当てます。
+        workers (int): 色ごとの輪郭抽出と近似を並列に実行するスレッド数。0の場合はCPU数を使います。
+                       出力はスレッド数によらず同一です。
+        stage_cache (StageCache): ステージごとの結果のキャッシュ。パラメータを少しずつ変えて
+                                  繰り返し変換する場合 (Webアプリなど) に指定します。
+        metrics (Metrics): 指定するとステージごとの処理時間や輪郭数・頂点数を記録します。
+                           stage_cacheで再利用されたステージは記録されません。
+                           進み具合の通知と中断にも使います (中断された場合は
+                           ConversionCancelledが送出されます)。
+
+    Returns:
+        dict: "width", "height" と、描画順（面積の大きい順）に並んだ "paths"、
+              量子化に使った色 "palette" (uint8の (k, 3) 配列) を持つ辞書。
+              各パスは "area", "points" (近似した頂点の (N, 2) 配列), "color" (BGR) を持ちます。
+              画像を読み込めなかった場合はNone。
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+
+    key, extracted = _extract_regions(
+        image,
+        num_colors=num_colors,
+        background_fill_color=background_fill_color,
+        apply_sharpening=apply_sharpening,
+        median_blur_ksize=median_blur_ksize,
+        dilate_iterations=dilate_iterations,
+        apply_resizing=apply_resizing,
+        max_side_length=max_side_length,
+        gaussian_blur_ksize=gaussian_blur_ksize,
+        quantizer=quantizer,
+        quantizer_sample_size=quantizer_sample_size,
+        random_seed=random_seed,
+        min_area=min_area,
+        despeckle=despeckle,
+        tile_size=tile_size,
+        palette=palette,
+        palette_space=palette_space,
+        workers=workers,
+        stage_cache=stage_cache,
+        metrics=metrics,
+    )
+    if extracted is None:
+        return None
+
+    # --- ステップ4: 輪郭を近似します ---
+    _, all_paths = _run_stage(
+        stage_cache,
+        "simplify",
+        key,
+        {"epsilon_factor": epsilon_factor},
+        simplify_stage,
+        extracted["regions"],
+        extracted["colors"],
+        workers=workers,
+        metrics=metrics,
+    )
+    return {
+        "width": extracted["width"],
+        "height": extracted["height"],
+        "paths": all_paths,
+        "palette": extracted["colors"],
+    }
+
+
+def _run_stage(stage_cache, stage, parent_key, params, func, *inputs, **options):
+    """
+    ステージを実行し、(ステージのキー, 結果) を返します。stage_cacheがあれば結果を再利用します。
+    optionsは結果に影響しない引数 (スレッド数、metricsなど) で、キーには含めません。
+    parent_keyがNoneの場合 (キャッシュを使わない場合) はキーもNoneになります。
+    """
+    if stage_cache is None or parent_key is None:
+        return None, func(*inputs, **params, **options)
+    key = stage_cache.make_key(parent_key, stage, params)
+    return key, stage_cache.get_or_compute(
+        stage, key, lambda: func(*inputs, **params, **options)
+    )
+
+
+def _extract_regions(
+    image,
+    num_colors,
+    background_fill_color,
+    apply_sharpening,
+    median_blur_ksize,
+    dilate_iterations,
+    apply_resizing,
+    max_side_length,
+    gaussian_blur_ksize,
+    quantizer,
+    quantizer_sample_size,
+    random_seed,
+    min_area,
+    despeckle,
+    tile_size,
+    palette,
+    palette_space,
+    workers,
+    stage_cache,
+    metrics,
+):
+    """
+    vectorize_imageのステージ1〜3 (前処理・色の量子化・輪郭抽出) を実行します。
+
+    Returns:
+        tuple: (キー, 結果)。結果は "width", "height", "regions" (extract_stageの領域のリスト)、
+               "colors" (各ラベルのBGR色) を持つ辞書で、画像を読み込めなかった場合はNone。
+               キーは近似のステージをstage_cacheに保存するためのもので、キャッシュを
+               使わない場合はNone。
     """
+    if tile_size > 0:
+        return None, _extract_regions_tiled(
+            image,
+            tile_size,
+            num_colors=num_colors,
+            background_fill_color=background_fill_color,
+            apply_sharpening=apply_sharpening,
+            median_blur_ksize=median_blur_ksize,
+            dilate_iterations=dilate_iterations,
+            apply_resizing=apply_resizing,
+            max_side_length=max_side_length,
+            gaussian_blur_ksize=gaussian_blur_ksize,
+            quantizer=quantizer,
+            quantizer_sample_size=quantizer_sample_size,
+            random_seed=random_seed,
+            min_area=min_area,
+            despeckle=despeckle,
+            palette=palette,
+            palette_space=palette_space,
+            workers=workers,
+            metrics=metrics,
+        )
+
+    image_hash = image_digest(image) if stage_cache is not None else None
 
     # --- ステップ1: 画像の読み込みと前処理 ---
-    img_processed = preprocess_image(
-        image_path, background_fill_color, apply_resizing, max_side_length
+    key, img_processed = _run_stage(
+        stage_cache,
+        "preprocess",
+        image_hash,
+        {
+            "background_fill_color": background_fill_color,
+            "apply_resizing": apply_resizing,
+            "max_side_length": max_side_length,
+            "gaussian_blur_ksize": gaussian_blur_ksize,
+            "median_blur_ksize": median_blur_ksize,
+            "apply_sharpening": apply_sharpening,
+        },
+        preprocess_stage,
+        image,
+        metrics=metrics,
     )
     if img_processed is None:
+        return None, None
+
+    # --- ステップ2: 色の量子化 ---
+    key, (label_map, colors) = _run_stage(
+        stage_cache,
+        "quantize",
+        key,
+        {
+            "num_colors": num_colors,
+            "quantizer": quantizer,
+            "quantizer_sample_size": quantizer_sample_size,
+            "random_seed": random_seed,
+            # キャッシュキーに使えるよう、配列ではなくリストで渡します
+            "palette": None if palette is None else np.asarray(palette).tolist(),
+            "palette_space": palette_space,
+        },
+        quantize_stage,
+        img_processed,
+        metrics=metrics,
+    )
+
+    # --- 小さな領域を隣の色に統合します ---
+    if despeckle:
+        key, label_map = _run_stage(
+            stage_cache,
+            "despeckle",
+            key,
+            {"min_area": min_area},
+            despeckle_stage,
+            label_map,
+            len(colors),
+            workers=workers,
+            metrics=metrics,
+        )
+
+    # --- ステップ3: 各色の輪郭を抽出します ---
+    key, regions = _run_stage(
+        stage_cache,
+        "extract",
+        key,
+        {"dilate_iterations": dilate_iterations, "min_area": min_area},
+        extract_stage,
+        label_map,
+        len(colors),
+        workers=workers,
+        metrics=metrics,
+    )
+
+    h, w, _ = img_processed.shape
+    return key, {"width": w, "height": h, "regions": regions, "colors": colors}
+
+
+def _extract_regions_tiled(
+    image,
+    tile_size,
+    num_colors,
+    background_fill_color,
+    apply_sharpening,
+    median_blur_ksize,
+    dilate_iterations,
+    apply_resizing,
+    max_side_length,
+    gaussian_blur_ksize,
+    quantizer,
+    quantizer_sample_size,
+    random_seed,
+    min_area,
+    despeckle,
+    palette,
+    palette_space,
+    workers,
+    metrics,
+):
+    """_extract_regionsのタイル分割版。ステージのキャッシュは使いません。"""
+    if despeckle:
+        # 連結成分はタイルの境界をまたぐため、タイルごとには正しく統合できません
+        print("警告: タイル分割での処理ではdespeckleは使えません。min_areaによる除去だけを行います。")
+    img = preprocess_image(
+        image, background_fill_color, apply_resizing, max_side_length, metrics
+    )
+    if img is None:
+        return None
+
+    regions, colors = extract_regions_tiled(
+        img,
+        tile_size,
+        num_colors,
+        quantizer,
+        quantizer_sample_size,
+        random_seed,
+        dilate_iterations,
+        min_area=min_area,
+        gaussian_blur_ksize=gaussian_blur_ksize,
+        median_blur_ksize=median_blur_ksize,
+        apply_sharpening=apply_sharpening,
+        palette=palette,
+        palette_space=palette_space,
+        workers=workers,
+        metrics=metrics,
+    )
+    h, w = img.shape[:2]
+    return {"width": w, "height": h, "regions": regions, "colors": colors}
+
+
+def count_vertices(regions, epsilon_factor=0, workers=1, tolerance=0):
+    """領域の輪郭をsimplify_stageと同じ方法で近似した場合の頂点数の合計を返します。"""
+
+    def vertices(region):
+        points = approximate_contour(region["contour"], epsilon_factor, tolerance)
+        return 0 if points is None else len(points)
+
+    return sum(parallel_map(vertices, regions, workers))
+
+
+def _search_smallest(fits, low, high):
+    """
+    fits(x) がTrueになる、できるだけ小さいxを [low, high] の範囲で対数スケールの
+    二分探索により求めます (xが大きいほど満たしやすいと仮定します)。
+    highでも満たさない場合はNoneを返します。
+    """
+    if fits(low):
+        return low
+    if not fits(high):
+        return None
+    while high / low > BUDGET_SEARCH_RATIO:
+        middle = (low * high) ** 0.5
+        if fits(middle):
+            high = middle
+        else:
+            low = middle
+    return high
+
+
+def _describe_simplification(params):
+    """近似のパラメータ (fit_simplificationを参照) を表示用の文字列にします。"""
+    if params.get("tolerance", 0) > 0:
+        return f"許容誤差 {params['tolerance']:.3g} px"
+    return f"epsilon_factor {params['epsilon_factor']:.3g}"
+
+
+def fit_simplification(
+    regions,
+    colors,
+    max_vertices=0,
+    max_bytes=0,
+    size_of=None,
+    allocation="area",
+    workers=1,
+):
+    """
+    抽出済みの輪郭から、上限に収まるできるだけ細かい近似を探します。
+
+    近似 (approxPolyDP) だけを繰り返して頂点数を数え、max_bytesを指定した場合は
+    size_ofでSVGのサイズをファイルに書き込まずに求めます。
+
+    Args:
+        regions (list): extract_stageが返す領域のリスト。
+        colors (np.ndarray): 各ラベルのBGR色。
+        max_vertices (int): 近似後の頂点数の合計の上限。0の場合は制限しません。
+        max_bytes (int): SVGのサイズ (バイト) の上限。0の場合は制限しません。
+        size_of (callable): simplify_stageが返すパスのリストを受け取り、SVGのサイズを返す関数。
+        allocation (str): 上限を輪郭に配分する方法。
+                          "area"は全ての輪郭を同じ距離 (px) で近似し、元の輪郭からのずれを
+                          どこでも同じにします。大きな領域ほど多くの頂点が割り当てられます。
+                          "uniform"は全ての輪郭に同じepsilon_factor (周囲長に対する比率) を使います。
+        workers (int): 近似を並列に実行するスレッド数。
+
+    Returns:
+        dict: simplify_stageに渡す近似のパラメータ ("epsilon_factor" と、"area"の場合は "tolerance")。
+              範囲の最も粗い近似でも上限に収まらない場合は、警告を表示してそれを返します。
+    """
+    if allocation not in BUDGET_ALLOCATIONS:
+        raise ValueError(
+            f"不明な配分方法 '{allocation}'。{', '.join(BUDGET_ALLOCATIONS)} のいずれかを指定してください。"
+        )
+
+    def params(value):
+        if allocation == "area":
+            return {"epsilon_factor": 0, "tolerance": value}
+        return {"epsilon_factor": value}
+
+    def fits(value):
+        vertices_over = (
+            max_vertices > 0
+            and count_vertices(regions, workers=workers, **params(value)) > max_vertices
+        )
+        if vertices_over:
+            return False
+        if max_bytes > 0:
+            paths = simplify_stage(regions, colors, workers=workers, **params(value))
+            if size_of(paths) > max_bytes:
+                return False
+        return True
+
+    low, high = TOLERANCE_SEARCH_RANGE if allocation == "area" else EPSILON_SEARCH_RANGE
+    value = _search_smallest(fits, low, high)
+    if value is None:
+        limits = []
+        if max_vertices > 0:
+            limits.append(f"頂点数 {max_vertices}")
+        if max_bytes > 0:
+            limits.append(f"{max_bytes} バイト")
+        print(
+            f"警告: {'、'.join(limits)} 以下にできません。"
+            f"{_describe_simplification(params(high))} で近似します。"
+        )
+        value = high
+    return params(value)
+
+
+def vectorize_image_levels(image, levels, budget_allocation="area", metrics=None, **kwargs):
+    """
+    前処理・色の量子化・輪郭抽出を1回だけ行い、複数の詳細度で輪郭を近似します。
+
+    サムネイル用、Web用、印刷用のように同じ画像を複数の詳細度で出力する場合に、
+    epsilon_factorごとにvectorize_imageを呼ぶと量子化と輪郭抽出を繰り返すことになります。
+    この関数では抽出した輪郭を使い回し、レベルごとに近似だけを行います。
+
+    Args:
+        image (str | bytes | np.ndarray): 入力画像 (vectorize_imageを参照)。
+        levels (list): 各レベルの詳細度。min_areaと同様に、1未満の値はepsilon_factor、
+                       1以上の値は近似後の頂点数の合計の上限として扱います
+                       (上限に収まる最も細かい近似を探します)。
+        budget_allocation (str): 頂点数の上限を輪郭に配分する方法 (fit_simplificationを参照)。
+        metrics (Metrics): vectorize_imageを参照。
+        **kwargs: vectorize_imageの変換オプション (epsilon_factorは使いません)。
+
+    Returns:
+        list: levelsと同じ順序の、vectorize_imageと同じ形式の辞書のリスト。
+              各辞書は使った近似のパラメータ (fit_simplificationを参照) も
+              "simplification" に持ちます。画像を読み込めなかった場合はNone。
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+    bound = inspect.signature(vectorize_image).bind(None, **kwargs)
+    bound.apply_defaults()
+    options = dict(bound.arguments)
+    del options["image"], options["metrics"], options["epsilon_factor"]
+
+    key, extracted = _extract_regions(image, metrics=metrics, **options)
+    if extracted is None:
+        return None
+
+    results = []
+    for level in levels:
+        if level >= 1:
+            with metrics.stage("budget_search"):
+                params = fit_simplification(
+                    extracted["regions"],
+                    extracted["colors"],
+                    max_vertices=level,
+                    allocation=budget_allocation,
+                    workers=options["workers"],
+                )
+        else:
+            params = {"epsilon_factor": level}
+        _, paths = _run_stage(
+            options["stage_cache"],
+            "simplify",
+            key,
+            params,
+            simplify_stage,
+            extracted["regions"],
+            extracted["colors"],
+            workers=options["workers"],
+            metrics=metrics,
+        )
+        results.append(
+            {
+                "width": extracted["width"],
+                "height": extracted["height"],
+                "paths": paths,
+                "palette": extracted["colors"],
+                "simplification": params,
+            }
+        )
+    return results
+
+
+def vectorize_image_budget(
+    image,
+    max_vertices=0,
+    max_bytes=0,
+    size_of=None,
+    budget_allocation="area",
+    metrics=None,
+    **kwargs,
+):
+    """
+    前処理・色の量子化・輪郭抽出を1回だけ行い、頂点数やSVGのサイズの上限に収まる
+    できるだけ細かい近似で輪郭を近似します (fit_simplificationを参照)。
+
+    epsilon_factorを変えながら変換を繰り返す代わりに、抽出した輪郭に対して近似だけを
+    繰り返して上限に収まる近似の度合いを探します。
+
+    Args:
+        image (str | bytes | np.ndarray): 入力画像 (vectorize_imageを参照)。
+        max_vertices (int): 近似後の頂点数の合計の上限。0の場合は制限しません。
+        max_bytes (int): SVGのサイズ (バイト) の上限。0の場合は制限しません。
+        size_of (callable): vectorize_imageと同じ形式の辞書を受け取り、SVGのサイズ (バイト) を
+                            返す関数。max_bytesを指定する場合に必要です。
+        budget_allocation (str): 上限を輪郭に配分する方法 (fit_simplificationを参照)。
+        metrics (Metrics): vectorize_imageを参照。
+        **kwargs: vectorize_imageの変換オプション (epsilon_factorは使いません)。
+
+    Returns:
+        dict: vectorize_imageと同じ形式の辞書。使った近似のパラメータも "simplification" に持ちます。
+              画像を読み込めなかった場合はNone。
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+    bound = inspect.signature(vectorize_image).bind(None, **kwargs)
+    bound.apply_defaults()
+    options = dict(bound.arguments)
+    del options["image"], options["metrics"], options["epsilon_factor"]
+
+    key, extracted = _extract_regions(image, metrics=metrics, **options)
+    if extracted is None:
+        return None
+
+    def paths_size(paths):
+        return size_of({"width": extracted["width"], "height": extracted["height"], "paths": paths})
+
+    with metrics.stage("budget_search"):
+        params = fit_simplification(
+            extracted["regions"],
+            extracted["colors"],
+            max_vertices=max_vertices,
+            max_bytes=max_bytes,
+            size_of=paths_size,
+            allocation=budget_allocation,
+            workers=options["workers"],
+        )
+    _, paths = _run_stage(
+        options["stage_cache"],
+        "simplify",
+        key,
+        params,
+        simplify_stage,
+        extracted["regions"],
+        extracted["colors"],
+        workers=options["workers"],
+        metrics=metrics,
+    )
+    return {
+        "width": extracted["width"],
+        "height": extracted["height"],
+        "paths": paths,
+        "palette": extracted["colors"],
+        "simplification": params,
+    }
+
+
+def _scale_ksize(ksize, scale):
+    """縮小した画像に使うブラーのカーネルサイズ。3未満になる場合は適用しません (0)。"""
+    scaled = int(round(ksize * scale))
+    if scaled < 3:
+        return 0
+    return scaled if scaled % 2 == 1 else scaled + 1
+
+
+def _scale_vectorized(vectorized, width, height):
+    """縮小した画像で得たvectorize_imageの結果を、元の解像度 (width, height) の座標に拡大します。"""
+    scale = np.array(
+        [width / vectorized["width"], height / vectorized["height"]], dtype=np.float64
+    )
+    paths = [
+        {
+            "area": path["area"] * scale[0] * scale[1],
+            "points": np.rint(path["points"] * scale).astype(np.int32),
+            "color": path["color"],
+        }
+        for path in vectorized["paths"]
+    ]
+    return {"width": width, "height": height, "paths": paths, "palette": vectorized["palette"]}
+
+
+def _preview_stage(img, scale, palette, workers=1, metrics=NULL_METRICS, **options):
+    """
+    vectorize_image_progressiveのプレビューのステージ1〜3。画像をscale倍に縮小して
+    _extract_regionsを実行し、その結果を返します (縮小後の座標のままです)。
+    """
+    h, w = img.shape[:2]
+    small = cv2.resize(
+        img, (max(int(w * scale), 1), max(int(h * scale), 1)), interpolation=cv2.INTER_AREA
+    )
+    _, extracted = _extract_regions(
+        small,
+        palette=None if palette is None else np.asarray(palette, dtype=np.uint8),
+        workers=workers,
+        stage_cache=None,
+        metrics=metrics,
+        **options,
+    )
+    return extracted
+
+
+def vectorize_image_progressive(
+    image, preview_max_side_length=PREVIEW_MAX_SIDE_LENGTH, metrics=None, **kwargs
+):
+    """
+    まず縮小した画像で素早く変換したプレビューを、続いて元の解像度で変換した結果を返します。
+
+    プレビューは、preprocess_imageで読み込んだ画像を最大辺がpreview_max_side_lengthになるよう
+    縮小して同じパイプラインで変換し、座標を元の解像度に拡大したものです。
+    元の解像度での変換ではプレビューで求めたパレットをそのまま使うため、k-meansを繰り返さず、
+    結果が置き換わっても色は変わりません。画像がpreview_max_side_length以下の場合は
+    プレビューを省略します。
+
+    Args:
+        image (str | bytes | np.ndarray): 入力画像 (vectorize_imageを参照)。
+        preview_max_side_length (int): プレビューに使う画像の最大辺の長さ (px)。0の場合はプレビューを省略します。
+        metrics (Metrics): vectorize_imageを参照。プレビューの時間は "preview_seconds" に記録します。
+        **kwargs: vectorize_imageの変換オプション。
+
+    Yields:
+        tuple: ("preview", vectorized)、続いて ("final", vectorized)。vectorizedは
+               vectorize_imageと同じ形式です。画像を読み込めなかった場合は何も返しません。
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+    bound = inspect.signature(vectorize_image).bind(None, **kwargs)
+    bound.apply_defaults()
+    options = dict(bound.arguments)
+    del options["image"], options["metrics"]
+
+    img = preprocess_image(
+        image,
+        options["background_fill_color"],
+        options["apply_resizing"],
+        options["max_side_length"],
+        metrics,
+    )
+    if img is None:
         return
+    # 以降は読み込み済みの画像を使うため、リサイズと透明度の処理は済んでいます
+    options["apply_resizing"] = False
 
-    # ガウシアンブラーを適用します
-    if gaussian_blur_ksize > 0:
-        img_processed = cv2.GaussianBlur(img_processed, (gaussian_blur_ksize, gaussian_blur_ksize), 0)
+    h, w = img.shape[:2]
+    scale = preview_max_side_length / max(h, w) if preview_max_side_length > 0 else 1.0
+    if scale < 1:
+        start = time.perf_counter()
+        min_area = options["min_area"]
+        params = {
+            name: value
+            for name, value in options.items()
+            if name not in ("epsilon_factor", "workers", "stage_cache")
+        }
+        params.update(
+            scale=scale,
+            median_blur_ksize=_scale_ksize(options["median_blur_ksize"], scale),
+            gaussian_blur_ksize=_scale_ksize(options["gaussian_blur_ksize"], scale),
+            # 画素数で指定された最小面積は縮小率に合わせます（割合の場合はそのまま）。
+            # 1未満にすると割合として扱われるため、1画素を下限にします
+            min_area=min_area if 0 < min_area < 1 else max(min_area * scale * scale, 1),
+            tile_size=0,
+            # キャッシュキーに使えるよう、配列ではなくリストで渡します
+            palette=None if options["palette"] is None else np.asarray(options["palette"]).tolist(),
+        )
+        # プレビューの輪郭とパレットはepsilon_factor以外のオプションだけで決まるため、
+        # 近似の度合いだけを変えた場合はk-meansをやり直さず、最終結果のキーも変わりません
+        stage_cache = options["stage_cache"]
+        _, extracted = _run_stage(
+            stage_cache,
+            "preview",
+            image_digest(img) if stage_cache is not None else None,
+            params,
+            _preview_stage,
+            img,
+            workers=options["workers"],
+            metrics=metrics,
+        )
+        preview = {
+            "width": extracted["width"],
+            "height": extracted["height"],
+            "paths": simplify_stage(
+                extracted["regions"],
+                extracted["colors"],
+                options["epsilon_factor"],
+                options["workers"],
+                metrics,
+            ),
+            "palette": extracted["colors"],
+        }
+        metrics.set("preview_seconds", time.perf_counter() - start)
+        yield "preview", _scale_vectorized(preview, w, h)
+        if options["palette"] is None:
+            # k-meansで求めたパレットは、k-meansと同じRGBの距離で割り当てます
+            options["palette_space"] = "rgb"
+        options["palette"] = preview["palette"]
 
-    # ノイズ除去のためにメディアンブラーを適用します
-    if median_blur_ksize > 0:
-        img_processed = cv2.medianBlur(img_processed, median_blur_ksize)
+    yield "final", vectorize_image(img, metrics=metrics, **options)
 
-    # シャープニングを適用
-    if apply_sharpening:
-        sharpening_kernel = np.array(
-            [[0, -1, 0], [-1, 5, -1], [0, -1, 0]], dtype=np.float32
+
+class _ByteCounter:
+    """書き込まれた文字列のサイズ (UTF-8のバイト数) だけを数えるストリーム。"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, text):
+        self.size += len(text.encode("utf-8"))
+
+
+def _write_vectorized(
+    stream,
+    vectorized,
+    add_stroke,
+    stroke_color,
+    stroke_width,
+    compact=False,
+    metrics=NULL_METRICS,
+):
+    """vectorize_imageの結果をSVGとして書き込みます。"""
+    writer = write_compact_svg if compact else write_svg
+    with metrics.stage("serialize"):
+        writer(
+            stream,
+            vectorized["width"],
+            vectorized["height"],
+            vectorized["paths"],
+            stroke_color=stroke_color if add_stroke else None,
+            stroke_width=stroke_width,
         )
-        img_processed = cv2.filter2D(img_processed, -1, sharpening_kernel)
 
-    # 色の量子化
-    pixels = img_processed.reshape((-1, 3))
-    pixels = np.float32(pixels)
 
-    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 1.0)
-    _, labels, centers = cv2.kmeans(
-        pixels, num_colors, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS
+def serialized_size(
+    vectorized, add_stroke=False, stroke_color=(0, 0, 0), stroke_width=1.0, compact=False
+):
+    """vectorize_imageの結果をSVGとして書き込んだ場合のサイズ (バイト) を、書き込まずに求めます。"""
+    counter = _ByteCounter()
+    _write_vectorized(counter, vectorized, add_stroke, stroke_color, stroke_width, compact)
+    return counter.size
+
+
+def _cache_options(add_stroke, stroke_color, stroke_width, compact, kwargs):
+    """キャッシュキーに使う、デフォルト値を補った全ての変換オプションを返します。"""
+    bound = inspect.signature(vectorize_image).bind(None, **kwargs)
+    bound.apply_defaults()
+    options = dict(bound.arguments)
+    del options["image"]
+    del options["stage_cache"]
+    del options["workers"]
+    del options["metrics"]
+    if options["palette"] is not None:
+        options["palette"] = np.asarray(options["palette"]).tolist()
+    options.update(
+        add_stroke=add_stroke,
+        stroke_color=stroke_color if add_stroke else None,
+        stroke_width=stroke_width if add_stroke else None,
+        compact=compact,
     )
-    centers = np.uint8(centers)
-    quantized_img = centers[labels.flatten()].reshape((img_processed.shape))
+    return options
 
-    # --- ステップ2: 各色の輪郭を抽出します ---
-    all_paths = []
-    kernel = np.ones((3, 3), np.uint8)
 
-    # Cannyエッジ検出のロジックを削除し、常に色の輪郭抽出を実行
-    for color in centers:
-        mask = cv2.inRange(quantized_img, color, color)
+def write_image_svg(
+    image,
+    stream,
+    add_stroke=False,
+    stroke_color=(0, 0, 0),
+    stroke_width=1.0,
+    compact=False,
+    cache=None,
+    metrics=None,
+    **kwargs,
+):
+    """
+    カラー画像を高精細なSVGに変換し、ファイルライクオブジェクト (ファイル、sys.stdoutなど) に
+    逐次書き込みます。
 
-        if dilate_iterations > 0:
-            mask_dilated = cv2.dilate(mask, kernel, iterations=dilate_iterations)
-        else:
-            mask_dilated = mask.copy()
-
-        contours, _ = cv2.findContours(
-            mask_dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE
-        )
-
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if area < 50:
-                continue
-
-            path_data = contour_to_svg_path(contour, epsilon_factor=epsilon_factor)
-            if not path_data:
-                continue
-
-            b, g, r = color
-            fill_color = svgwrite.rgb(r, g, b, "RGB")
-
-            stroke_settings = {}
-            if add_stroke:
-                stroke_settings = {
-                    "stroke": svgwrite.rgb(stroke_color[0], stroke_color[1], stroke_color[2], "RGB"),
-                    "stroke_width": stroke_width
-                }
-
-            all_paths.append(
-                {
-                    "area": area,
-                    "path_data": path_data,
-                    "fill_color": fill_color,
-                    "stroke_settings": stroke_settings,
-                }
+    Args:
+        image (str | bytes | np.ndarray): 入力画像 (vectorize_imageを参照)。
+        stream: 書き込み先のテキストファイルライクオブジェクト。
+        add_stroke (bool): 生成されるSVGパスにストロークを追加するかどうか。
+        stroke_color (tuple): ストロークの色を表すRGBタプル。
+        stroke_width (float): ストロークの太さ。
+        compact (bool): 同じ色のパスをまとめ、相対座標を使ったサイズの小さいSVGを出力するかどうか。
+        cache (ResultCache): 変換結果のキャッシュ。指定するとキャッシュにあるSVGを再利用します。
+        metrics (Metrics): 指定するとステージごとの処理時間やカウンタを記録します
+                           (vectorize_imageを参照)。SVGの書き込み時間 (serialize) も含みます。
+        **kwargs: vectorize_imageの変換オプション (num_colors, epsilon_factorなど)。
+
+    Returns:
+        bool: 変換に成功した場合はTrue、画像を読み込めなかった場合はFalse。
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+
+    key = None
+    if cache is not None:
+        key = cache.make_key(
+            image, _cache_options(add_stroke, stroke_color, stroke_width, compact, kwargs)
+        )
+        svg_content = cache.get(key) if key is not None else None
+        metrics.set("result_cache_hit", svg_content is not None)
+        if svg_content is not None:
+            stream.write(svg_content)
+            return True
+
+    vectorized = vectorize_image(image, metrics=metrics, **kwargs)
+    if vectorized is None:
+        return False
+
+    if key is None:
+        _write_vectorized(
+            stream, vectorized, add_stroke, stroke_color, stroke_width, compact, metrics
+        )
+    else:
+        buffer = io.StringIO()
+        _write_vectorized(
+            buffer, vectorized, add_stroke, stroke_color, stroke_width, compact, metrics
+        )
+        cache.put(key, buffer.getvalue())
+        stream.write(buffer.getvalue())
+    return True
+
+
+def image_to_svg(image, **kwargs):
+    """
+    カラー画像を高精細なSVGに変換し、SVG文字列を返します。
+    ファイルを介さずに変換できるため、Webアプリなどからも直接利用できます。
+
+    Args:
+        image (str | bytes | np.ndarray): 入力画像。画像ファイルへのパス、
+                                          エンコードされた画像ファイルのバイト列、
+                                          またはOpenCV形式 (BGR/BGRA) の画像配列。
+        **kwargs: write_image_svgの変換オプション (num_colors, add_strokeなど)。
+
+    Returns:
+        str: SVG文字列。画像を読み込めなかった場合はNone。
+    """
+    buffer = io.StringIO()
+    if not write_image_svg(image, buffer, **kwargs):
+        return None
+    return buffer.getvalue()
+
+
+def image_to_svg_progressive(
+    image,
+    add_stroke=False,
+    stroke_color=(0, 0, 0),
+    stroke_width=1.0,
+    compact=False,
+    cache=None,
+    metrics=None,
+    preview_max_side_length=PREVIEW_MAX_SIDE_LENGTH,
+    **kwargs,
+):
+    """
+    プレビューのSVG文字列と、元の解像度で変換したSVG文字列を順に返します
+    (vectorize_image_progressiveを参照)。引数はwrite_image_svgと同じです。
+
+    Yields:
+        tuple: ("preview", SVG文字列)、続いて ("final", SVG文字列)。
+               キャッシュにある場合は ("final", SVG文字列) だけを返します。
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+
+    key = None
+    if cache is not None:
+        options = _cache_options(add_stroke, stroke_color, stroke_width, compact, kwargs)
+        # 最終結果のパレットはプレビューから求めるため、通常の変換とは別にキャッシュします
+        options["preview_max_side_length"] = preview_max_side_length
+        key = cache.make_key(image, options)
+        svg_content = cache.get(key) if key is not None else None
+        metrics.set("result_cache_hit", svg_content is not None)
+        if svg_content is not None:
+            yield "final", svg_content
+            return
+
+    for kind, vectorized in vectorize_image_progressive(
+        image, preview_max_side_length, metrics=metrics, **kwargs
+    ):
+        buffer = io.StringIO()
+        _write_vectorized(
+            buffer, vectorized, add_stroke, stroke_color, stroke_width, compact, metrics
+        )
+        if kind == "final" and key is not None:
+            cache.put(key, buffer.getvalue())
+        yield kind, buffer.getvalue()
+
+
+def png_color_to_svg_high_fidelity(
+    image_path,
+    output_path,
+    add_stroke=False,
+    stroke_color=(0, 0, 0),
+    stroke_width=1.0,
+    compact=False,
+    cache=None,
+    metrics=None,
+    **kwargs,
+):
+    """
+    カラーPNGを高精細なSVGに<path>要素を使用して変換し、ファイルに保存します。
+
+    Args:
+        image_path (str): 入力PNG画像へのパス。
+        output_path (str): 出力SVGファイルを保存するパス。
+        add_stroke (bool): 生成されるSVGパスにストロークを追加するかどうか。
+        stroke_color (tuple): ストロークの色を表すRGBタプル。
+        stroke_width (float): ストロークの太さ。
+        compact (bool): 同じ色のパスをまとめ、相対座標を使ったサイズの小さいSVGを出力するかどうか。
+        cache (ResultCache): 変換結果のキャッシュ。指定するとキャッシュにあるSVGを再利用します。
+        metrics (Metrics): 指定するとステージごとの処理時間やカウンタを記録します
+                           (vectorize_imageを参照)。SVGの書き込み時間 (serialize) も含みます。
+        **kwargs: vectorize_imageの変換オプション (num_colors, epsilon_factorなど)。
+
+    Returns:
+        bool: 変換に成功した場合はTrue、画像を読み込めなかった場合はFalse。
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+
+    key = None
+    if cache is not None:
+        key = cache.make_key(
+            image_path,
+            _cache_options(add_stroke, stroke_color, stroke_width, compact, kwargs),
+        )
+        svg_content = cache.get(key) if key is not None else None
+        metrics.set("result_cache_hit", svg_content is not None)
+        if svg_content is not None:
+            with open(output_path, "w", encoding="utf-8") as f:
+                f.write(svg_content)
+            print(f"キャッシュから高精細SVGファイル {output_path} を作成しました")
+            return True
+
+    vectorized = vectorize_image(image_path, metrics=metrics, **kwargs)
+    if vectorized is None:
+        return False
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        _write_vectorized(
+            f, vectorized, add_stroke, stroke_color, stroke_width, compact, metrics
+        )
+    print(f"高精細SVGファイルが {output_path} に正常に作成されました")
+    metrics.set("output_bytes", os.path.getsize(output_path))
+
+    if key is not None:
+        with open(output_path, "r", encoding="utf-8") as f:
+            cache.put(key, f.read())
+
+    if compact:
+        # 通常形式で出力した場合のサイズを、ファイルに書き込まずに求めて比較します
+        normal_size = serialized_size(vectorized, add_stroke, stroke_color, stroke_width)
+        compact_size = os.path.getsize(output_path)
+        reduction = 100.0 * (1 - compact_size / normal_size) if normal_size else 0.0
+        print(
+            f"コンパクト形式: {compact_size} バイト "
+            f"(通常形式 {normal_size} バイトから {reduction:.1f}% 削減)"
+        )
+    return True
+
+
+def png_color_to_svg_levels(
+    image_path,
+    output_paths,
+    levels,
+    budget_allocation="area",
+    add_stroke=False,
+    stroke_color=(0, 0, 0),
+    stroke_width=1.0,
+    compact=False,
+    cache=None,
+    metrics=None,
+    **kwargs,
+):
+    """
+    カラー画像を複数の詳細度のSVGに変換し、それぞれのファイルに保存します。
+    輪郭の抽出は1回だけ行います (vectorize_image_levelsを参照)。
+
+    Args:
+        image_path (str): 入力画像へのパス。
+        output_paths (list): levelsと同じ順序の、出力SVGファイルを保存するパスのリスト。
+        levels (list): 各レベルの詳細度 (vectorize_image_levelsを参照)。
+        budget_allocation (str): 頂点数の上限を輪郭に配分する方法 (fit_simplificationを参照)。
+        cache (ResultCache): 変換結果のキャッシュ。全てのレベルがキャッシュにある場合は
+                             画像を処理せずにキャッシュにあるSVGを書き込みます。
+        その他の引数はpng_color_to_svg_high_fidelityと同じです (epsilon_factorは使いません)。
+
+    Returns:
+        bool: 変換に成功した場合はTrue、画像を読み込めなかった場合はFalse。
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+
+    keys = [None] * len(levels)
+    if cache is not None:
+        for i, level in enumerate(levels):
+            options = _cache_options(
+                add_stroke,
+                stroke_color,
+                stroke_width,
+                compact,
+                # epsilon_factorのレベルは通常の変換と同じキーになります
+                {**kwargs, "epsilon_factor": level if level < 1 else None},
             )
+            if level >= 1:
+                options.update(max_vertices=level, budget_allocation=budget_allocation)
+            keys[i] = cache.make_key(image_path, options)
+        cached = [cache.get(key) if key is not None else None for key in keys]
+        metrics.set("result_cache_hit", all(svg is not None for svg in cached))
+        if all(svg is not None for svg in cached):
+            for output_path, svg_content in zip(output_paths, cached):
+                with open(output_path, "w", encoding="utf-8") as f:
+                    f.write(svg_content)
+                print(f"キャッシュから高精細SVGファイル {output_path} を作成しました")
+            return True
 
-    # --- ステップ3: SVGを生成します ---
-    all_paths.sort(key=lambda p: p["area"], reverse=True)
+    vectorized_levels = vectorize_image_levels(
+        image_path, levels, budget_allocation, metrics=metrics, **kwargs
+    )
+    if vectorized_levels is None:
+        return False
 
-    h, w, _ = img_processed.shape
-    dwg = svgwrite.Drawing(output_path, profile="full", size=(w, h))
+    for output_path, key, vectorized in zip(output_paths, keys, vectorized_levels):
+        buffer = io.StringIO()
+        _write_vectorized(
+            buffer, vectorized, add_stroke, stroke_color, stroke_width, compact, metrics
+        )
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(buffer.getvalue())
+        if key is not None:
+            cache.put(key, buffer.getvalue())
+        vertices = sum(len(path["points"]) for path in vectorized["paths"])
+        print(
+            f"高精細SVGファイルが {output_path} に正常に作成されました "
+            f"({_describe_simplification(vectorized['simplification'])}, 頂点数 {vertices})"
+        )
+    return True
+
+
+def png_color_to_svg_budget(
+    image_path,
+    output_path,
+    max_vertices=0,
+    max_bytes=0,
+    budget_allocation="area",
+    add_stroke=False,
+    stroke_color=(0, 0, 0),
+    stroke_width=1.0,
+    compact=False,
+    cache=None,
+    metrics=None,
+    **kwargs,
+):
+    """
+    カラー画像を、頂点数やファイルサイズの上限に収まるSVGに変換し、ファイルに保存します。
+    輪郭の抽出は1回だけ行い、近似とサイズの見積もりだけを繰り返します
+    (vectorize_image_budgetを参照)。
 
-    for item in all_paths:
-        dwg.add(dwg.path(d=item["path_data"], fill=item["fill_color"], **item["stroke_settings"]))
+    Args:
+        image_path (str): 入力画像へのパス。
+        output_path (str): 出力SVGファイルを保存するパス。
+        max_vertices (int): 近似後の頂点数の合計の上限。0の場合は制限しません。
+        max_bytes (int): SVGファイルのサイズ (バイト) の上限。0の場合は制限しません。
+        budget_allocation (str): 上限を輪郭に配分する方法 (fit_simplificationを参照)。
+        その他の引数はpng_color_to_svg_high_fidelityと同じです (epsilon_factorは使いません)。
 
-    dwg.save()
-    print(f"高精細SVGファイルが {output_path} に正常に作成されました")
\ No newline at end of file
+    Returns:
+        bool: 変換に成功した場合はTrue、画像を読み込めなかった場合はFalse。
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+
+    key = None
+    if cache is not None:
+        options = _cache_options(
+            add_stroke, stroke_color, stroke_width, compact, {**kwargs, "epsilon_factor": None}
+        )
+        options.update(
+            max_vertices=max_vertices, max_bytes=max_bytes, budget_allocation=budget_allocation
+        )
+        key = cache.make_key(image_path, options)
+        svg_content = cache.get(key) if key is not None else None
+        metrics.set("result_cache_hit", svg_content is not None)
+        if svg_content is not None:
+            with open(output_path, "w", encoding="utf-8") as f:
+                f.write(svg_content)
+            print(f"キャッシュから高精細SVGファイル {output_path} を作成しました")
+            return True
+
+    vectorized = vectorize_image_budget(
+        image_path,
+        max_vertices,
+        max_bytes,
+        size_of=lambda v: serialized_size(v, add_stroke, stroke_color, stroke_width, compact),
+        budget_allocation=budget_allocation,
+        metrics=metrics,
+        **kwargs,
+    )
+    if vectorized is None:
+        return False
+
+    buffer = io.StringIO()
+    _write_vectorized(buffer, vectorized, add_stroke, stroke_color, stroke_width, compact, metrics)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(buffer.getvalue())
+    if key is not None:
+        cache.put(key, buffer.getvalue())
+    output_bytes = os.path.getsize(output_path)
+    metrics.set("output_bytes", output_bytes)
+    vertices = sum(len(path["points"]) for path in vectorized["paths"])
+    print(
+        f"高精細SVGファイルが {output_path} に正常に作成されました "
+        f"({_describe_simplification(vectorized['simplification'])}, "
+        f"頂点数 {vertices}, {output_bytes} バイト)"
+    )
+    return True
\ No newline at end of file
@@ -0,0 +1,275 @@
+import itertools
+import time
+import cv2
+import numpy as np
+from .common import parallel_map
+from .metrics import NULL_METRICS
+
+# これより面積の小さい輪郭はノイズとして除きます
+MIN_CONTOUR_AREA = 50
+
+# 小さな領域を隣の色に統合する処理の最大の繰り返し回数
+# （小さな領域が連なっている場合、1回で外側の1層ずつ統合されます）
+DESPECKLE_MAX_ROUNDS = 64
+
+
+def build_label_map(labels, centers, shape):
+    """
+    k-meansのラベル配列から、色ごとに一意なラベルを持つラベルマップを作成します。
+
+    uint8に丸めた後で同じ色になる中心は1つのラベルにまとめます
+    （量子化画像上で同じ色として扱われていたため）。
+
+    Args:
+        labels (np.ndarray): k-meansが返すラベル配列 (N, 1)。
+        centers (np.ndarray): uint8に変換済みの色の中心 (k, 3)。
+        shape (tuple): 画像の (高さ, 幅)。
+
+    Returns:
+        tuple: (label_map, colors)。label_mapは (高さ, 幅) のラベルマップ、
+               colorsは各ラベルに対応するBGR色 (出現順)。
+    """
+    _, first_index, inverse = np.unique(
+        centers, axis=0, return_index=True, return_inverse=True
+    )
+    # 元の中心の順序を保つため、最初に出現した位置の順にラベルを振り直します
+    order = np.argsort(first_index)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    lut = rank[inverse.ravel()]
+    colors = centers[first_index[order]]
+
+    dtype = np.uint8 if len(colors) <= 256 else np.uint16
+    label_map = lut.astype(dtype)[np.asarray(labels).ravel()].reshape(shape)
+    return label_map, colors
+
+
+def label_bounding_boxes(label_map, num_labels):
+    """
+    ラベルマップ全体を数回走査するだけで、全ラベルのバウンディングボックスを求めます。
+
+    Args:
+        label_map (np.ndarray): (高さ, 幅) のラベルマップ。
+        num_labels (int): ラベルの数。
+
+    Returns:
+        np.ndarray: (num_labels, 4) の配列 [x0, y0, x1, y1]（x1, y1は含まない）。
+                    画素を持たないラベルは全て0になります。
+    """
+    h, w = label_map.shape
+    labels = label_map.astype(np.intp)
+
+    # 行ごと・列ごとに各ラベルが出現するかどうかを集計します
+    row_hist = np.bincount(
+        (np.arange(h, dtype=np.intp)[:, None] * num_labels + labels).ravel(),
+        minlength=h * num_labels,
+    ).reshape(h, num_labels)
+    col_hist = np.bincount(
+        (np.arange(w, dtype=np.intp)[None, :] * num_labels + labels).ravel(),
+        minlength=w * num_labels,
+    ).reshape(w, num_labels)
+
+    boxes = np.zeros((num_labels, 4), dtype=np.intp)
+    for label in range(num_labels):
+        rows = np.flatnonzero(row_hist[:, label])
+        if rows.size == 0:
+            continue
+        cols = np.flatnonzero(col_hist[:, label])
+        boxes[label] = (cols[0], rows[0], cols[-1] + 1, rows[-1] + 1)
+    return boxes
+
+
+def label_contours(label_map, label, box, margin, dilate_iterations):
+    """
+    1つのラベルの外側輪郭を、バウンディングボックスの範囲だけを使って抽出します。
+
+    Args:
+        label_map (np.ndarray): (高さ, 幅) のラベルマップ。
+        label (int): 輪郭を抽出するラベル。
+        box (tuple): 抽出する範囲 (x0, y0, x1, y1)（x1, y1は含まない）。
+        margin (int): 範囲の周りに取る余白の画素数。膨張させる分以上を指定します。
+        dilate_iterations (int): マスクを膨張させる回数。
+
+    Returns:
+        list: 画像全体の座標で表した輪郭のリスト (cv2.findContoursの形式)。
+    """
+    h, w = label_map.shape
+    x0, y0, x1, y1 = box
+    if x1 <= x0 or y1 <= y0:
+        return []
+
+    x0 = max(x0 - margin, 0)
+    y0 = max(y0 - margin, 0)
+    x1 = min(x1 + margin, w)
+    y1 = min(y1 + margin, h)
+
+    crop = label_map[y0:y1, x0:x1]
+    mask = np.where(crop == label, np.uint8(255), np.uint8(0))
+
+    if dilate_iterations > 0:
+        kernel = np.ones((3, 3), np.uint8)
+        mask = cv2.dilate(mask, kernel, iterations=dilate_iterations)
+
+    contours, _ = cv2.findContours(
+        mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE, offset=(int(x0), int(y0))
+    )
+    return contours
+
+
+def extract_color_contours(label_map, num_labels, dilate_iterations=1, workers=1, metrics=NULL_METRICS):
+    """
+    ラベルマップから各色の外側輪郭を抽出します。
+
+    色ごとに画像全体のマスクを作る代わりに、そのラベルのバウンディングボックス
+    （膨張分の余白付き）だけを切り出して処理します。余白を取っているため、
+    得られる輪郭は画像全体で処理した場合と同一になります。
+
+    Args:
+        label_map (np.ndarray): (高さ, 幅) のラベルマップ。
+        num_labels (int): ラベルの数。
+        dilate_iterations (int): 輪郭抽出前の膨張処理の繰り返し回数。
+        workers (int): 色ごとの処理を並列に実行するスレッド数。
+                       結果の順序はスレッド数によらず同じです。
+        metrics (Metrics): 指定すると色ごとの処理時間と輪郭数を記録し、進み具合を通知します。
+
+    Yields:
+        tuple: (label, contours)。contoursは画像全体の座標系での輪郭のリスト。
+    """
+    # 膨張で広がる分に加えて、findContoursが境界を正しく扱えるよう1px余白を取ります
+    margin = max(dilate_iterations, 0) + 1
+    boxes = label_bounding_boxes(label_map, num_labels)
+    completed = itertools.count(1)
+
+    def extract_label(label):
+        start = time.perf_counter()
+        contours = label_contours(label_map, label, boxes[label], margin, dilate_iterations)
+        metrics.add_color(label, time.perf_counter() - start, len(contours))
+        metrics.progress("extract", next(completed), num_labels)
+        return contours
+
+    all_contours = parallel_map(extract_label, range(num_labels), workers)
+    for label, contours in enumerate(all_contours):
+        yield label, contours
+
+
+def resolve_min_area(min_area, shape):
+    """
+    最小面積の指定を画素数に変換します。1未満の値は画像の面積に対する割合として扱います。
+    """
+    if 0 < min_area < 1:
+        return min_area * shape[0] * shape[1]
+    return min_area
+
+
+def _small_component_pixels(label_map, label, box, min_area):
+    """
+    ラベルの8近傍で連結な成分のうち、画素数がmin_area未満のものの画素を返します。
+
+    Returns:
+        tuple: (indices, components, count)。indicesは画素の (画像全体での) 1次元の位置、
+               componentsは各画素が属する成分の0からの番号、countは成分の数。
+    """
+    w = label_map.shape[1]
+    x0, y0, x1, y1 = box
+    if x1 <= x0 or y1 <= y0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), 0
+
+    mask = cv2.compare(label_map[y0:y1, x0:x1], label, cv2.CMP_EQ)
+    # 既定のアルゴリズムより高速なGranaの方法で連結成分を求めます（結果の成分は同じです）
+    _, components, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(
+        mask, 8, cv2.CV_32S, cv2.CCL_GRANA
+    )
+    small = stats[:, cv2.CC_STAT_AREA] < min_area
+    small[0] = False # 0は背景（このラベル以外の画素）
+    count = int(small.sum())
+    if count == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), 0
+
+    # 画像全体ではなく、このラベルの画素だけについて小さな成分かどうかを調べます
+    positions = np.flatnonzero(mask)
+    components = components.reshape(-1)[positions]
+    is_small = small[components]
+    positions, components = positions[is_small], components[is_small]
+    rank = np.cumsum(small) - 1
+    ys, xs = np.divmod(positions, x1 - x0)
+    return (ys + y0) * w + (xs + x0), rank[components], count
+
+
+def despeckle_label_map(label_map, num_labels, min_area, workers=1, metrics=NULL_METRICS):
+    """
+    画素数がmin_area未満の連結成分を、接している長さが最も長い隣の色に統合します。
+
+    輪郭を追跡する前に小さな領域を取り除くことで、ノイズの多い画像で大量の小さな輪郭を
+    追跡して捨てる手間を省きます。取り除いた領域は隣の色で埋めるため、穴は残りません。
+    小さな領域同士が連なっている場合は、大きな領域に接しているものから順に統合します。
+
+    Args:
+        label_map (np.ndarray): (高さ, 幅) のラベルマップ。
+        num_labels (int): ラベルの数。
+        min_area (float): 残す連結成分の最小の画素数。
+        workers (int): 色ごとの連結成分の計算を並列に実行するスレッド数。
+        metrics (Metrics): 指定すると色ごとの進み具合を通知します。
+
+    Returns:
+        np.ndarray: 小さな領域を統合したラベルマップ (変更がない場合は入力そのもの)。
+    """
+    h, w = label_map.shape
+    boxes = label_bounding_boxes(label_map, num_labels)
+    completed = itertools.count(1)
+
+    def small_components(label):
+        result = _small_component_pixels(label_map, label, boxes[label], min_area)
+        metrics.progress("despeckle", next(completed), num_labels)
+        return result
+
+    per_label = parallel_map(small_components, range(num_labels), workers)
+
+    # 全ラベルの小さな成分に通し番号を振ります
+    indices, components, offset = [], [], 0
+    for label_indices, label_components, count in per_label:
+        indices.append(label_indices)
+        components.append(label_components + offset)
+        offset += count
+    if offset == 0:
+        return label_map
+    indices = np.concatenate(indices)
+    components = np.concatenate(components)
+
+    label_map = label_map.copy()
+    flat_labels = label_map.reshape(-1)
+    is_small = np.zeros(h * w, dtype=bool)
+    is_small[indices] = True
+    for _ in range(DESPECKLE_MAX_ROUNDS):
+        ys, xs = np.divmod(indices, w)
+        # 小さな領域の画素と、4近傍にある小さな領域以外の画素の組で投票します
+        voters = []
+        votes = []
+        for dy, dx in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            valid = (ys + dy >= 0) & (ys + dy < h) & (xs + dx >= 0) & (xs + dx < w)
+            neighbors = indices[valid] + (dy * w + dx)
+            large = ~is_small[neighbors]
+            voters.append(components[valid][large])
+            votes.append(flat_labels[neighbors[large]])
+        voters = np.concatenate(voters).astype(np.int64)
+        votes = np.concatenate(votes).astype(np.int64)
+        if voters.size == 0:
+            break
+
+        # 成分ごとに最も票の多い色を選びます
+        pairs, pair_counts = np.unique(voters * num_labels + votes, return_counts=True)
+        pair_components = pairs // num_labels
+        order = np.lexsort((-pair_counts, pair_components))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = pair_components[order][1:] != pair_components[order][:-1]
+        winners = order[first]
+        new_labels = np.full(offset, -1, dtype=np.int64)
+        new_labels[pair_components[winners]] = pairs[winners] % num_labels
+
+        pixel_labels = new_labels[components]
+        resolved = pixel_labels >= 0
+        flat_labels[indices[resolved]] = pixel_labels[resolved]
+        is_small[indices[resolved]] = False
+        indices, components = indices[~resolved], components[~resolved]
+        if indices.size == 0:
+            break
+    return label_map
@@ -0,0 +1,180 @@
+import inspect
+import itertools
+import cv2
+import numpy as np
+from .common import preprocess_image
+from .convert import serialized_size, vectorize_image
+from .metrics import NULL_METRICS
+from .stage_cache import StageCache
+
+# SSIMの窓 (ガウス窓) と安定化のための定数 (Wang et al. 2004 と同じ値)
+SSIM_WINDOW = (11, 11)
+SSIM_SIGMA = 1.5
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# パラメータの探索で変える変換オプションと、指定しない場合に試す値。
+# パイプラインのステージの順に並べ、前のステージの結果を続けて再利用できるようにします
+TUNE_GRID = {
+    "median_blur_ksize": [0, 5],
+    "gaussian_blur_ksize": [0],
+    "num_colors": [8, 16, 32],
+    "dilate_iterations": [0, 1],
+    "epsilon_factor": [0.0005, 0.001, 0.002, 0.005],
+}
+# パレート最適を求める際の忠実度の指標
+FIDELITY_METRICS = ("ssim", "psnr")
+
+
+def rasterize_paths(vectorized, background_color=(255, 255, 255)):
+    """
+    vectorize_imageの結果をcv2.fillPolyで画素に戻します。
+
+    パスはSVGと同じく描画順 (面積の大きい順) に塗り、どのパスにも覆われない画素は
+    background_color (RGB) になります。
+
+    Returns:
+        np.ndarray: (高さ, 幅, 3) のBGR画像。
+    """
+    r, g, b = background_color
+    canvas = np.empty((vectorized["height"], vectorized["width"], 3), dtype=np.uint8)
+    canvas[:] = (b, g, r)
+    for path in vectorized["paths"]:
+        points = np.asarray(path["points"], dtype=np.int32).reshape((-1, 1, 2))
+        cv2.fillPoly(canvas, [points], tuple(int(c) for c in path["color"]))
+    return canvas
+
+
+def psnr(reference, image):
+    """2つの画像のPSNR (dB) を返します。同一の場合はinfになります。"""
+    diff = reference.astype(np.float32) - image.astype(np.float32)
+    mse = float(np.mean(diff * diff))
+    if mse == 0:
+        return float("inf")
+    return 10.0 * np.log10(255.0 * 255.0 / mse)
+
+
+def ssim(reference, image):
+    """2つの画像の平均SSIM (ガウス窓、チャンネルごとに求めた値の平均) を返します。"""
+    a = reference.astype(np.float32)
+    b = image.astype(np.float32)
+
+    def blur(x):
+        return cv2.GaussianBlur(x, SSIM_WINDOW, SSIM_SIGMA)
+
+    mu_a, mu_b = blur(a), blur(b)
+    mu_aa, mu_bb, mu_ab = mu_a * mu_a, mu_b * mu_b, mu_a * mu_b
+    var_a = blur(a * a) - mu_aa
+    var_b = blur(b * b) - mu_bb
+    cov = blur(a * b) - mu_ab
+    ssim_map = ((2 * mu_ab + SSIM_C1) * (2 * cov + SSIM_C2)) / (
+        (mu_aa + mu_bb + SSIM_C1) * (var_a + var_b + SSIM_C2)
+    )
+    return float(ssim_map.mean())
+
+
+def evaluate_fidelity(reference, vectorized, background_color=(255, 255, 255)):
+    """
+    変換結果を画素に戻し (rasterize_pathsを参照)、元の画像と比べた忠実度を返します。
+
+    Args:
+        reference (np.ndarray): 比較する画像。preprocess_imageで読み込んだ (透明度の処理と
+                                リサイズを行った) 画像で、変換結果と同じ大きさのBGR画像。
+                                ブラーの強さも評価できるよう、ブラーなどのフィルタは適用しません。
+        vectorized (dict): vectorize_imageの結果。
+        background_color (tuple): パスに覆われない画素の色 (RGB)。
+
+    Returns:
+        dict: "psnr" (dB) と "ssim"。
+    """
+    rendered = rasterize_paths(vectorized, background_color)
+    return {"psnr": psnr(reference, rendered), "ssim": ssim(reference, rendered)}
+
+
+def pareto_front(candidates, fidelity="ssim"):
+    """
+    SVGのサイズ ("bytes") と頂点数 ("vertices") が小さく、忠実度 (fidelity) が高いほど良いとして、
+    他のどの候補にも劣らない候補をSVGのサイズの小さい順に返します。
+    """
+
+    def objectives(candidate):
+        return (candidate["bytes"], candidate["vertices"], -candidate[fidelity])
+
+    front = []
+    for candidate in candidates:
+        own = objectives(candidate)
+        dominated = any(
+            other != own and all(o <= v for o, v in zip(other, own))
+            for other in map(objectives, candidates)
+        )
+        if not dominated:
+            front.append(candidate)
+    return sorted(front, key=lambda c: (c["bytes"], c["vertices"]))
+
+
+def tune_parameters(image, grid=None, fidelity="ssim", compact=False, metrics=None, **kwargs):
+    """
+    変換オプションの組み合わせを試し、SVGのサイズ・頂点数・忠実度のパレート最適な設定を求めます。
+
+    組み合わせはパイプラインのステージの順 (ブラー → 色数 → 膨張 → epsilon_factor) に
+    変えていき、StageCacheで前のステージの結果を共有するため、例えばepsilon_factorだけが
+    異なる組み合わせでは近似とSVGのサイズの見積もりだけを行います。
+
+    Args:
+        image (str | bytes | np.ndarray): 入力画像 (vectorize_imageを参照)。
+        grid (dict): 変換オプションの名前から試す値のリストへの辞書。TUNE_GRIDのキーを指定でき、
+                     指定しなかったオプションはTUNE_GRIDの値を使います。
+        fidelity (str): パレート最適を求める際の忠実度の指標 ("ssim" または "psnr")。
+        compact (bool): SVGのサイズをコンパクト形式で見積もるかどうか。
+        metrics (Metrics): 指定すると組み合わせごとの進み具合を通知します。
+        **kwargs: 全ての組み合わせで共通のvectorize_imageの変換オプション。
+
+    Returns:
+        tuple: (candidates, front)。candidatesは試した全ての組み合わせの結果のリストで、
+               各要素は "params" (試したオプション)、"bytes"、"vertices"、"paths"、
+               "psnr"、"ssim" を持つ辞書。frontはpareto_frontの結果。
+               画像を読み込めなかった場合はNone。
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+    if fidelity not in FIDELITY_METRICS:
+        raise ValueError(
+            f"不明な忠実度の指標 '{fidelity}'。{', '.join(FIDELITY_METRICS)} のいずれかを指定してください。"
+        )
+    grid = {**TUNE_GRID, **(grid or {})}
+    unknown = set(grid) - set(TUNE_GRID)
+    if unknown:
+        raise ValueError(f"探索できないオプション: {', '.join(sorted(unknown))}")
+    bound = inspect.signature(vectorize_image).bind(None, **kwargs)
+    bound.apply_defaults()
+    options = dict(bound.arguments)
+    del options["image"], options["metrics"]
+
+    # 読み込みとリサイズは1回だけ行い、比較の基準にも使います
+    reference = preprocess_image(
+        image,
+        options["background_fill_color"],
+        options["apply_resizing"],
+        options["max_side_length"],
+    )
+    if reference is None:
+        return None
+    options.update(apply_resizing=False, tile_size=0, stage_cache=StageCache())
+
+    names = list(TUNE_GRID)
+    combinations = list(itertools.product(*(grid[name] for name in names)))
+    candidates = []
+    for index, values in enumerate(combinations):
+        metrics.progress("tune", index, len(combinations))
+        params = dict(zip(names, values))
+        vectorized = vectorize_image(reference, metrics=metrics, **{**options, **params})
+        candidates.append(
+            {
+                "params": params,
+                "bytes": serialized_size(vectorized, compact=compact),
+                "vertices": sum(len(path["points"]) for path in vectorized["paths"]),
+                "paths": len(vectorized["paths"]),
+                **evaluate_fidelity(reference, vectorized, options["background_fill_color"]),
+            }
+        )
+    return candidates, pareto_front(candidates, fidelity)
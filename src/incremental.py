@@ -0,0 +1,496 @@
+import inspect
+import json
+import os
+import time
+import cv2
+import numpy as np
+from .common import approximate_contour, parallel_map
+from .convert import extract_stage, preprocess_stage, quantize_stage, vectorize_image
+from .extract import label_contours, resolve_min_area
+from .metrics import NULL_METRICS
+from .quantize import assign_to_palette
+from .svg_writer import write_compact_svg, write_svg
+
+# 前回の変換結果のファイル (.npz) の形式のバージョン。形式を変えた場合は上げます
+ARTIFACT_VERSION = 1
+
+
+def artifact_path_for(output_path):
+    """出力SVGファイルに対応する前回の変換結果のファイルのパス ({出力名}.npz) を返します。"""
+    base_name, _ = os.path.splitext(output_path)
+    return f"{base_name}.npz"
+
+
+def _artifact_options(options):
+    """前回の変換結果を再利用できるかの判定に使う、結果に影響する変換オプションのJSON文字列。"""
+    options = dict(options)
+    for name in ("image", "stage_cache", "workers", "metrics"):
+        options.pop(name, None)
+    if options["palette"] is not None:
+        options["palette"] = np.asarray(options["palette"]).tolist()
+    return json.dumps(options, sort_keys=True, default=str)
+
+
+def _pack(arrays, width):
+    """(N, width) の配列のリストを、連結した配列と各配列の開始位置の配列にまとめます。"""
+    lengths = [0 if a is None else len(a) for a in arrays]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    parts = [np.asarray(a, dtype=np.int32).reshape((-1, width)) for a in arrays if a is not None]
+    data = np.concatenate(parts) if parts else np.empty((0, width), dtype=np.int32)
+    return data, offsets
+
+
+def _unpack(data, offsets):
+    """_packでまとめた配列を元のリストに戻します (長さ0の配列はNoneになります)。"""
+    return [
+        data[start:end] if end > start else None
+        for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())
+    ]
+
+
+def save_artifact(path, options, image, label_map, colors, regions, points):
+    """
+    差分の変換に使う変換結果を.npzファイルに保存します。
+
+    Args:
+        path (str): 保存先のパス。
+        options (str): _artifact_optionsが返す変換オプション。
+        image (np.ndarray): フィルタ適用後の画像 (次回の画像と比較します)。
+        label_map (np.ndarray): ラベルマップ。
+        colors (np.ndarray): 各ラベルのBGR色。
+        regions (list): extract_stageと同じ形式の領域のリスト。
+        points (list): 各領域を近似した頂点の配列 (近似できなかった領域はNone)。
+    """
+    contour_data, contour_offsets = _pack([r["contour"] for r in regions], 2)
+    point_data, point_offsets = _pack(points, 2)
+    temp_path = f"{path}.tmp"
+    # 大きな画像では圧縮に変換そのものより時間がかかるため、圧縮せずに保存します
+    with open(temp_path, "wb") as f:
+        np.savez(
+            f,
+            version=np.array(ARTIFACT_VERSION),
+            options=np.array(options),
+            image=image,
+            label_map=label_map,
+            colors=np.asarray(colors, dtype=np.uint8),
+            region_labels=np.array([r["label"] for r in regions], dtype=np.int32),
+            region_areas=np.array([r["area"] for r in regions], dtype=np.float64),
+            contour_data=contour_data,
+            contour_offsets=contour_offsets,
+            point_data=point_data,
+            point_offsets=point_offsets,
+        )
+    # 書き込みの途中で中断されても、壊れたファイルが残らないようにします
+    os.replace(temp_path, path)
+
+
+def load_artifact(path):
+    """
+    save_artifactで保存した変換結果を読み込みます。
+
+    Returns:
+        dict: "options", "image", "label_map", "colors", "regions", "points" を持つ辞書。
+              ファイルがない場合や読み込めない場合、形式が異なる場合はNone。
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != ARTIFACT_VERSION:
+                return None
+            contours = _unpack(data["contour_data"], data["contour_offsets"])
+            regions = [
+                {"label": int(label), "area": float(area), "contour": contour.reshape((-1, 1, 2))}
+                for label, area, contour in zip(
+                    data["region_labels"].tolist(), data["region_areas"].tolist(), contours
+                )
+            ]
+            return {
+                "options": str(data["options"]),
+                "image": data["image"],
+                "label_map": data["label_map"],
+                "colors": data["colors"],
+                "regions": regions,
+                "points": _unpack(data["point_data"], data["point_offsets"]),
+            }
+    except (OSError, ValueError, KeyError) as e:
+        print(f"警告: 前回の変換結果 '{path}' を読み込めません: {e}")
+        return None
+
+
+def _approximate_regions(regions, epsilon_factor, workers=1, metrics=NULL_METRICS):
+    """各領域の輪郭をsimplify_stageと同じ方法で近似し、頂点の配列 (またはNone) のリストを返します。"""
+    with metrics.stage("simplify"):
+        return parallel_map(
+            lambda region: approximate_contour(region["contour"], epsilon_factor),
+            regions,
+            workers,
+        )
+
+
+def _build_paths(regions, points, colors):
+    """領域と近似した頂点から、simplify_stageと同じ描画順 (面積の大きい順) のパスのリストを作ります。"""
+    paths = [
+        {"area": region["area"], "points": p, "color": colors[region["label"]]}
+        for region, p in zip(regions, points)
+        if p is not None
+    ]
+    paths.sort(key=lambda p: p["area"], reverse=True)
+    return paths
+
+
+def _overlaps(a, b):
+    """2つの矩形 (x0, y0, x1, y1) が重なるか接している場合にTrueを返します。"""
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _merge_rects(rects):
+    """重なるか接している矩形を、両方を含む矩形にまとめます。"""
+    rects = [tuple(r) for r in rects]
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for rect in rects:
+            for i, other in enumerate(result):
+                if _overlaps(rect, other):
+                    result[i] = (
+                        min(rect[0], other[0]),
+                        min(rect[1], other[1]),
+                        max(rect[2], other[2]),
+                        max(rect[3], other[3]),
+                    )
+                    merged = True
+                    break
+            else:
+                result.append(rect)
+        rects = result
+    return rects
+
+
+def _contour_rect(contour):
+    """輪郭のバウンディングボックス (x0, y0, x1, y1) を返します (x1, y1は含みません)。"""
+    x, y, w, h = cv2.boundingRect(contour)
+    return (x, y, x + w, y + h)
+
+
+def _retrace_label(label_map, label, rects, old_regions, dilate_iterations):
+    """
+    1つのラベルについて、変化した範囲 (rects) に重なる輪郭だけを抽出し直します。
+
+    範囲の端で切れた輪郭が見つかった場合は、その輪郭を含むよう範囲を広げて
+    抽出し直すことを繰り返すため、得られる輪郭は画像全体で抽出した場合と同一になります。
+    範囲に重なる前回の輪郭も範囲に加え、置き換える対象とします。
+
+    Args:
+        label_map (np.ndarray): 変化を反映したラベルマップ。
+        label (int): ラベル。
+        rects (list): 変化した画素を含む矩形 (x0, y0, x1, y1) のリスト。
+        old_regions (list): このラベルの前回の (インデックス, 領域) のリスト。
+        dilate_iterations (int): 輪郭抽出前の膨張処理の繰り返し回数。
+
+    Returns:
+        tuple: (replaced, contours)。replacedは置き換える前回の領域のインデックスの集合、
+               contoursは抽出し直した輪郭のリスト。
+    """
+    h, w = label_map.shape
+    # extract_color_contoursと同じ余白。範囲の端からこれより内側の輪郭だけが正しく抽出されます
+    margin = max(dilate_iterations, 0) + 1
+    old_rects = {index: _contour_rect(region["contour"]) for index, region in old_regions}
+    replaced = set()
+    while True:
+        rects = _merge_rects(rects)
+        overlapping = [
+            index
+            for index, rect in old_rects.items()
+            if index not in replaced and any(_overlaps(rect, r) for r in rects)
+        ]
+        if overlapping:
+            replaced.update(overlapping)
+            rects += [old_rects[index] for index in overlapping]
+            continue
+
+        contours = []
+        expanded = []
+        for x0, y0, x1, y1 in rects:
+            for contour in label_contours(
+                label_map, label, (x0, y0, x1, y1), margin, dilate_iterations
+            ):
+                cx0, cy0, cx1, cy1 = _contour_rect(contour)
+                # 画像の端以外で範囲の外にはみ出す輪郭は、範囲の外まで続いています
+                inside = (
+                    (cx0 >= x0 or x0 - margin <= 0)
+                    and (cy0 >= y0 or y0 - margin <= 0)
+                    and (cx1 <= x1 or x1 + margin >= w)
+                    and (cy1 <= y1 or y1 + margin >= h)
+                )
+                if inside:
+                    contours.append(contour)
+                else:
+                    expanded.append((cx0, cy0, cx1, cy1))
+        if not expanded:
+            return replaced, contours
+        rects += expanded
+
+
+def _is_nested(contour, regions):
+    """輪郭が同じ色の別の領域の内側 (穴の中) にある場合にTrueを返します。"""
+    x0, y0, x1, y1 = _contour_rect(contour)
+    point = tuple(float(v) for v in contour[0, 0])
+    for region in regions:
+        rx0, ry0, rx1, ry1 = _contour_rect(region["contour"])
+        if (
+            rx0 <= x0
+            and ry0 <= y0
+            and x1 <= rx1
+            and y1 <= ry1
+            and cv2.pointPolygonTest(region["contour"], point, False) > 0
+        ):
+            return True
+    return False
+
+
+def _changed_rects(mask):
+    """マスクの画素を8近傍で連結した成分ごとのバウンディングボックスのリストを返します。"""
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=8)
+    return [
+        (int(x), int(y), int(x + bw), int(y + bh))
+        for x, y, bw, bh in stats[1:count, :4].tolist()
+    ]
+
+
+def update_regions(previous, img, palette_space, dilate_iterations, min_area, metrics=NULL_METRICS):
+    """
+    前回の変換結果と画像を比較し、変化した部分の領域だけを抽出し直します。
+
+    フィルタ適用後の画素が変わった画素だけを前回のパレットに割り当て直し、ラベルが
+    変わった画素の範囲に重なる輪郭だけを抽出し直して、前回の領域のリストに差し込みます。
+
+    Args:
+        previous (dict): load_artifactの結果。
+        img (np.ndarray): フィルタ適用後の画像 (前回と同じ大きさ)。
+        palette_space (str): 前回のパレットに割り当てる際に距離を測る色空間。
+        dilate_iterations (int): 輪郭抽出前の膨張処理の繰り返し回数。
+        min_area (float): これより面積の小さい領域を除きます。
+
+    Returns:
+        tuple: (label_map, regions, points, changed)。regionsは前回の領域のうち変化のない
+               ものと抽出し直したもの、pointsは前回の領域の近似した頂点 (抽出し直した領域は
+               None)、changedは画素が変わった割合。
+    """
+    label_map = previous["label_map"]
+    colors = previous["colors"]
+    with metrics.stage("compare"):
+        diff = cv2.absdiff(img, previous["image"])
+        changed_pixels = (diff[:, :, 0] | diff[:, :, 1] | diff[:, :, 2]) > 0
+        del diff
+        changed = np.count_nonzero(changed_pixels) / changed_pixels.size
+    if changed == 0:
+        return label_map, previous["regions"], previous["points"], changed
+
+    with metrics.stage("assign"):
+        labels, _ = assign_to_palette(img[changed_pixels], colors, color_space=palette_space)
+        label_map = label_map.copy()
+        label_map[changed_pixels] = labels.reshape(-1)
+        relabeled = changed_pixels & (label_map != previous["label_map"])
+
+    min_area = resolve_min_area(min_area, label_map.shape)
+    by_label = {}
+    for index, region in enumerate(previous["regions"]):
+        by_label.setdefault(region["label"], []).append((index, region))
+
+    replaced = set()
+    new_regions = []
+    with metrics.stage("extract"):
+        affected = np.union1d(previous["label_map"][relabeled], label_map[relabeled])
+        for label in affected.tolist():
+            mask = relabeled & ((previous["label_map"] == label) | (label_map == label))
+            label_replaced, contours = _retrace_label(
+                label_map, label, _changed_rects(mask), by_label.get(label, []), dilate_iterations
+            )
+            replaced |= label_replaced
+            kept = [r for i, r in by_label.get(label, []) if i not in label_replaced]
+            for contour in contours:
+                area = cv2.contourArea(contour)
+                # 外側輪郭だけを抽出するため、変化のない同じ色の領域の穴の中の輪郭は現れません
+                if area < min_area or _is_nested(contour, kept):
+                    continue
+                new_regions.append({"label": label, "area": area, "contour": contour})
+
+    regions = [r for i, r in enumerate(previous["regions"]) if i not in replaced]
+    points = [p for i, p in enumerate(previous["points"]) if i not in replaced]
+    metrics.count("regions_reused", len(regions))
+    metrics.count("regions_retraced", len(new_regions))
+    return (
+        label_map,
+        regions + new_regions,
+        points + [None] * len(new_regions),
+        changed,
+    )
+
+
+def vectorize_image_incremental(image, artifact_path, metrics=None, **kwargs):
+    """
+    前回の変換結果 (artifact_path) を使い、画像の変化した部分だけを変換し直します。
+
+    前回の変換結果のファイルには、フィルタ適用後の画像・ラベルマップ・パレット・
+    各領域の輪郭と近似した頂点を保存します。次回の変換では画素が変わった部分だけを
+    保存したパレットに割り当て直し、変化した範囲に重なる輪郭だけを抽出・近似し直して
+    前回のパスのリストに差し込みます (update_regionsを参照)。変化のないパスの頂点は
+    前回と同一なので、SVGの<path>要素もバイト単位で同じになります。
+
+    前回の変換結果がない場合や、変換オプション・画像の大きさが異なる場合は
+    全体を変換し、その結果を保存します。
+
+    Args:
+        image (str | bytes | np.ndarray): 入力画像 (vectorize_imageを参照)。
+        artifact_path (str): 前回の変換結果のファイル (.npz) のパス。変換後に更新します。
+        metrics (Metrics): vectorize_imageを参照。再利用した領域の数 "regions_reused" と
+                           抽出し直した領域の数 "regions_retraced" も記録します。
+        **kwargs: vectorize_imageの変換オプション。tile_sizeとdespeckleを指定した場合は
+                  差分の変換を行わず、通常の変換を行います。
+
+    Returns:
+        dict: vectorize_imageと同じ形式の辞書。画像を読み込めなかった場合はNone。
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+    bound = inspect.signature(vectorize_image).bind(None, **kwargs)
+    bound.apply_defaults()
+    options = bound.arguments
+    if options["tile_size"] > 0 or options["despeckle"]:
+        # どちらも画像全体のラベルマップを保持しない (または画像全体で統合する) ため使えません
+        print("警告: タイル分割やdespeckleを使う場合は差分の変換を行わず、全体を変換します。")
+        return vectorize_image(image, metrics=metrics, **kwargs)
+
+    img = preprocess_stage(
+        image,
+        options["background_fill_color"],
+        options["apply_resizing"],
+        options["max_side_length"],
+        options["gaussian_blur_ksize"],
+        options["median_blur_ksize"],
+        options["apply_sharpening"],
+        metrics,
+    )
+    if img is None:
+        return None
+
+    artifact_options = _artifact_options(options)
+    with metrics.stage("load_artifact"):
+        previous = load_artifact(artifact_path)
+    if previous is not None and (
+        previous["options"] != artifact_options or previous["image"].shape != img.shape
+    ):
+        print(f"前回の変換結果 '{artifact_path}' とは変換オプションか画像の大きさが異なるため、全体を変換します。")
+        previous = None
+
+    if previous is None:
+        label_map, colors = quantize_stage(
+            img,
+            options["num_colors"],
+            options["quantizer"],
+            options["quantizer_sample_size"],
+            options["random_seed"],
+            palette=options["palette"],
+            palette_space=options["palette_space"],
+            metrics=metrics,
+        )
+        regions = extract_stage(
+            label_map,
+            len(colors),
+            options["dilate_iterations"],
+            options["min_area"],
+            options["workers"],
+            metrics,
+        )
+        points = [None] * len(regions)
+        changed = 1.0
+    else:
+        colors = previous["colors"]
+        label_map, regions, points, changed = update_regions(
+            previous,
+            img,
+            # k-meansで求めたパレットはRGBで割り当てます (k-meansと同じ距離)
+            "rgb" if options["palette"] is None else options["palette_space"],
+            options["dilate_iterations"],
+            options["min_area"],
+            metrics,
+        )
+        retraced = sum(p is None for p in points)
+        print(
+            f"前回の変換結果から {changed:.2%} の画素が変わりました: "
+            f"{retraced} 個の領域を抽出し直し、{len(regions) - retraced} 個を再利用しました"
+        )
+
+    # 抽出し直した領域だけを近似します
+    missing = [i for i, p in enumerate(points) if p is None]
+    for i, p in zip(
+        missing,
+        _approximate_regions(
+            [regions[i] for i in missing], options["epsilon_factor"], options["workers"], metrics
+        ),
+    ):
+        points[i] = p
+    paths = _build_paths(regions, points, colors)
+    metrics.count("paths", len(paths))
+
+    if changed > 0:
+        with metrics.stage("save_artifact"):
+            save_artifact(artifact_path, artifact_options, img, label_map, colors, regions, points)
+    h, w = label_map.shape
+    return {"width": w, "height": h, "paths": paths, "palette": colors}
+
+
+def png_color_to_svg_incremental(
+    image_path,
+    output_path,
+    artifact_path=None,
+    add_stroke=False,
+    stroke_color=(0, 0, 0),
+    stroke_width=1.0,
+    compact=False,
+    metrics=None,
+    **kwargs,
+):
+    """
+    前回の変換結果を使って画像の変化した部分だけを変換し直し、SVGファイルに保存します
+    (vectorize_image_incrementalを参照)。
+
+    Args:
+        image_path (str): 入力画像へのパス。
+        output_path (str): 出力SVGファイルを保存するパス。
+        artifact_path (str): 前回の変換結果のファイルのパス。Noneの場合は
+                             artifact_path_forで出力SVGファイルの隣に置きます。
+        その他の引数はpng_color_to_svg_high_fidelityと同じです。
+
+    Returns:
+        bool: 変換に成功した場合はTrue、画像を読み込めなかった場合はFalse。
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+    if artifact_path is None:
+        artifact_path = artifact_path_for(output_path)
+
+    start = time.perf_counter()
+    vectorized = vectorize_image_incremental(image_path, artifact_path, metrics=metrics, **kwargs)
+    if vectorized is None:
+        return False
+
+    writer = write_compact_svg if compact else write_svg
+    with metrics.stage("serialize"):
+        with open(output_path, "w", encoding="utf-8") as f:
+            writer(
+                f,
+                vectorized["width"],
+                vectorized["height"],
+                vectorized["paths"],
+                stroke_color=stroke_color if add_stroke else None,
+                stroke_width=stroke_width,
+            )
+    print(
+        f"高精細SVGファイルが {output_path} に正常に作成されました "
+        f"({time.perf_counter() - start:.2f} 秒、前回の変換結果: {artifact_path})"
+    )
+    metrics.set("output_bytes", os.path.getsize(output_path))
+    return True
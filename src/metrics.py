@@ -0,0 +1,177 @@
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windowsではresourceモジュールが使えません
+    resource = None
+
+
+def reset_peak_memory():
+    """
+    プロセスのピークメモリの記録をリセットします (Linuxのみ)。
+
+    リセットできた場合はTrueを返し、以降のpeak_memory_bytesはリセット後のピークになります。
+    それ以外の環境ではFalseを返し、peak_memory_bytesはプロセスの起動からのピークのままです。
+    """
+    try:
+        # 5を書き込むとVmHWM (最大RSS) が現在のRSSにリセットされます
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def peak_memory_bytes():
+    """
+    プロセスのピークメモリ (最大RSS, バイト) を返します。取得できない環境ではNone。
+    Linuxではreset_peak_memoryでリセットした以降のピークを返します。
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # LinuxではKB、macOSではバイト単位で返されます
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class ConversionCancelled(Exception):
+    """Metrics.cancelによって変換が中断された場合に送出されます。"""
+
+
+class Metrics:
+    """
+    変換処理のステージごとの処理時間とカウンタを記録します。
+
+    時刻の取得と辞書の更新だけで記録するため、常に有効にしても処理時間にはほぼ影響しません。
+    複数のスレッドから同時に記録できます。
+
+    on_progressを指定すると、各ステージの開始時と、色やタイルごとの処理の完了時に
+    on_progress(ステージ名, 完了した数, 全体の数) を呼び出します。別のスレッドから
+    cancelを呼ぶと、次にこれらの時点に達したところでConversionCancelledを送出して
+    変換を中断します。
+
+    ピークメモリ ("peak_memory_bytes") は、通常はプロセスの起動からの最大RSSで、
+    "peak_memory_scope" は "process" です。1つの変換がプロセスを占有する場合は
+    measure_peak_memoryを呼ぶと、その時点からの最大RSSになります。
+    """
+
+    def __init__(self, on_progress=None):
+        self.stages = {}
+        self.counters = {}
+        self.colors = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._on_progress = on_progress
+        self._cancelled = threading.Event()
+        self._peak_memory_scope = "process"
+
+    def measure_peak_memory(self):
+        """
+        プロセスのピークメモリの記録をリセットし、"peak_memory_bytes" をこの変換の
+        ピークにします (Linuxのみ。それ以外の環境では何もしません)。
+
+        プロセス全体の記録をリセットするため、同じプロセスで他の変換を同時に実行しない場合
+        (コマンドラインやプロセスプールのワーカー) にだけ呼んでください。
+        """
+        if reset_peak_memory():
+            self._peak_memory_scope = "conversion"
+
+    def cancel(self):
+        """変換の中断を要求します。"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def progress(self, name, done=0, total=0):
+        """
+        ステージnameの進み具合 (total件中done件) を通知します。
+        中断が要求されている場合はConversionCancelledを送出します。
+        """
+        if self._cancelled.is_set():
+            raise ConversionCancelled(f"{name} の処理中に変換が中断されました")
+        if self._on_progress is not None:
+            self._on_progress(name, done, total)
+
+    @contextmanager
+    def stage(self, name):
+        """withブロックの処理時間をステージnameの時間に加算します。"""
+        self.progress(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        """ステージnameの時間 (秒) を加算します。"""
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        """カウンタnameに値を加算します。"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        """カウンタnameに値を設定します。"""
+        with self._lock:
+            self.counters[name] = value
+
+    def add_color(self, label, seconds, contours):
+        """色 (ラベル) ごとの輪郭抽出の時間と輪郭数を加算します。"""
+        with self._lock:
+            entry = self.colors.setdefault(label, {"seconds": 0.0, "contours": 0})
+            entry["seconds"] += seconds
+            entry["contours"] += contours
+
+    def to_dict(self):
+        """記録した内容をJSONに変換できる辞書で返します。"""
+        with self._lock:
+            return {
+                "total_seconds": time.perf_counter() - self._start,
+                "stages": dict(self.stages),
+                "counters": dict(self.counters),
+                "colors": [
+                    {"label": label, **entry} for label, entry in sorted(self.colors.items())
+                ],
+                "peak_memory_bytes": peak_memory_bytes(),
+                "peak_memory_scope": self._peak_memory_scope,
+            }
+
+
+class _NullMetrics:
+    """記録しない場合に使う、何もしないMetrics。"""
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def progress(self, name, done=0, total=0):
+        pass
+
+    def add_time(self, name, seconds):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def set(self, name, value):
+        pass
+
+    def add_color(self, label, seconds, contours):
+        pass
+
+
+NULL_METRICS = _NullMetrics()
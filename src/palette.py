@@ -0,0 +1,119 @@
+import inspect
+import json
+import numpy as np
+from .convert import preprocess_stage, vectorize_image
+from .extract import build_label_map
+from .metrics import NULL_METRICS
+from .quantize import quantize_colors
+
+
+def _parse_color(value):
+    """'#rrggbb'、'#rgb' または [r, g, b] の色をBGRのタプルに変換します。"""
+    if isinstance(value, str):
+        text = value.strip().lstrip("#")
+        if len(text) == 3:
+            text = "".join(c * 2 for c in text)
+        if len(text) != 6:
+            raise ValueError(f"無効な色 '{value}'")
+        r, g, b = (int(text[i : i + 2], 16) for i in (0, 2, 4))
+    else:
+        r, g, b = (int(v) for v in value)
+    if not all(0 <= v <= 255 for v in (r, g, b)):
+        raise ValueError(f"無効な色 '{value}'")
+    return (b, g, r)
+
+
+def load_palette(path):
+    """
+    JSONのパレットファイルを読み込み、BGR色の (k, 3) のuint8配列を返します。
+
+    ファイルは {"colors": [...]} または色のリストで、各色は "#rrggbb"、"#rgb"、
+    [r, g, b] のいずれかで指定します。読み込めなかった場合はエラーを表示してNoneを返します。
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        colors = data["colors"] if isinstance(data, dict) else data
+        palette = np.array([_parse_color(c) for c in colors], dtype=np.uint8).reshape((-1, 3))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"エラー: パレットファイル '{path}' を読み込めません: {e}")
+        return None
+    if len(palette) == 0:
+        print(f"エラー: パレットファイル '{path}' に色がありません。")
+        return None
+    return palette
+
+
+def save_palette(path, colors):
+    """BGR色の (k, 3) 配列を、load_paletteで読み込めるJSONのパレットファイルに保存します。"""
+    data = {"colors": ["#%02x%02x%02x" % (r, g, b) for b, g, r in np.asarray(colors).tolist()]}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    print(f"パレット ({len(colors)} 色) を {path} に保存しました")
+
+
+def fit_palette(images, metrics=None, **kwargs):
+    """
+    1枚または複数の画像から抽出した画素で、共通のパレットを求めます。
+
+    各画像をvectorize_imageと同じ方法で前処理し、quantizer_sample_sizeの画素を
+    画像の枚数で等分して抽出します (0以下の場合は全画素)。求めたパレットを
+    paletteに指定すると、以降の変換ではk-meansを行わずに全ての画像で同じ色を使えます。
+
+    Args:
+        images (list): 入力画像 (vectorize_imageを参照) のリスト。
+        metrics (Metrics): 指定するとk-meansの時間などを記録します。
+        **kwargs: vectorize_imageの変換オプション (num_colors, quantizerなど)。
+
+    Returns:
+        np.ndarray: 重複のないBGR色 (k, 3) のuint8配列。画像を1枚も読み込めなかった場合はNone。
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+    bound = inspect.signature(vectorize_image).bind(None, **kwargs)
+    bound.apply_defaults()
+    options = bound.arguments
+
+    images = list(images)
+    rng = np.random.default_rng(options["random_seed"])
+    sample_size = options["quantizer_sample_size"]
+    per_image = max(sample_size // max(len(images), 1), 1)
+    samples = []
+    for image in images:
+        img = preprocess_stage(
+            image,
+            options["background_fill_color"],
+            options["apply_resizing"],
+            options["max_side_length"],
+            options["gaussian_blur_ksize"],
+            options["median_blur_ksize"],
+            options["apply_sharpening"],
+            metrics,
+        )
+        if img is None:
+            print(f"警告: '{image}' を読み込めないため、パレットの推定から除きます。")
+            continue
+        pixels = img.reshape((-1, 3))
+        count = len(pixels) if sample_size <= 0 else min(per_image, len(pixels))
+        samples.append(pixels[np.sort(rng.choice(len(pixels), size=count, replace=False))])
+    if not samples:
+        print("エラー: パレットを推定する画像を読み込めませんでした。")
+        return None
+    loaded = len(samples)
+    samples = np.concatenate(samples)
+
+    _, centers, mse = quantize_colors(
+        samples.reshape((-1, 1, 3)),
+        options["num_colors"],
+        quantizer=options["quantizer"],
+        sample_size=len(samples),
+        random_seed=options["random_seed"],
+        metrics=metrics,
+    )
+    print(
+        f"パレットを {len(samples)} 画素 ({loaded} 枚の画像) から推定しました "
+        f"({options['quantizer']}): 平均二乗誤差 {mse:.2f}"
+    )
+    # uint8に丸めて同じ色になった中心をまとめます
+    _, colors = build_label_map(np.arange(len(centers)), centers, (len(centers),))
+    return colors
@@ -0,0 +1,288 @@
+import cv2
+import numpy as np
+from .metrics import NULL_METRICS
+
+QUANTIZERS = ("full", "sample", "minibatch", "histogram")
+# 指定したパレットに画素を割り当てる際に距離を測る色空間
+PALETTE_SPACES = ("rgb", "lab")
+
+# k-meansの終了条件（最大反復回数, 中心の移動量の閾値）
+KMEANS_MAX_ITER = 100
+KMEANS_EPS = 1.0
+KMEANS_ATTEMPTS = 10
+
+# ミニバッチk-meansのバッチサイズと、収束とみなす中心の移動量
+MINIBATCH_SIZE = 1024
+MINIBATCH_EPS = 0.01
+
+# 色数が少ない画像かどうかを事前に判定する際に調べる画素数
+EXACT_PALETTE_PROBE_SIZE = 4096
+
+# 最近傍の中心を求める際に一度に処理する画素数（一時メモリを抑えるため）
+ASSIGN_CHUNK_SIZE = 1 << 18
+
+
+def bgr_to_lab(pixels):
+    """(N, 3) のBGR画素 (0-255) を、CIE L*a*b* (L*は0-100) のfloat32の配列に変換します。"""
+    bgr = np.asarray(pixels, dtype=np.float32).reshape((-1, 1, 3)) * np.float32(1 / 255)
+    return cv2.cvtColor(bgr, cv2.COLOR_BGR2Lab).reshape((-1, 3))
+
+
+def assign_to_palette(pixels, centers, weights=None, color_space="rgb"):
+    """
+    各画素を最も近い色の中心に割り当てます。
+
+    Args:
+        pixels (np.ndarray): (N, 3) の画素配列。
+        centers (np.ndarray): (k, 3) の色の中心。
+        weights (np.ndarray): 各画素の重み (N,)。二乗誤差の合計に使います。
+        color_space (str): 距離を測る色空間。"lab"の場合は画素と中心をCIE L*a*b*に
+                           変換して比較し、見た目に近い色に割り当てます (画素はBGRとして扱います)。
+
+    Returns:
+        tuple: (labels, sse)。labelsは (N,) のint32配列、
+               sseは割り当て後の (color_spaceでの) 二乗誤差の合計。
+    """
+    if color_space not in PALETTE_SPACES:
+        raise ValueError(
+            f"不明な色空間 '{color_space}'。{', '.join(PALETTE_SPACES)} のいずれかを指定してください。"
+        )
+    lab = color_space == "lab"
+    centers = bgr_to_lab(centers) if lab else np.asarray(centers, dtype=np.float32)
+    center_norms = (centers * centers).sum(axis=1)
+    labels = np.empty(len(pixels), dtype=np.int32)
+    sse = 0.0
+
+    for start in range(0, len(pixels), ASSIGN_CHUNK_SIZE):
+        chunk = pixels[start : start + ASSIGN_CHUNK_SIZE]
+        # 変換はチャンクごとに行い、画像全体の変換後の配列を作らないようにします
+        chunk = bgr_to_lab(chunk) if lab else chunk.astype(np.float32)
+        # |x - c|^2 = |x|^2 - 2x・c + |c|^2 を行列積でまとめて計算します
+        dist = center_norms - 2.0 * (chunk @ centers.T)
+        chunk_labels = dist.argmin(axis=1)
+        min_dist = dist[np.arange(len(chunk)), chunk_labels]
+        min_dist += (chunk * chunk).sum(axis=1)
+        labels[start : start + len(chunk)] = chunk_labels
+        np.maximum(min_dist, 0, out=min_dist)
+        if weights is not None:
+            min_dist *= weights[start : start + len(chunk)]
+        sse += float(min_dist.sum())
+
+    return labels, sse
+
+
+def _kmeans(pixels, num_colors, random_seed):
+    """OpenCVのk-meansを実行し、(compactness, labels, centers) を返します。"""
+    if random_seed is not None:
+        cv2.setRNGSeed(random_seed)
+    criteria = (
+        cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER,
+        KMEANS_MAX_ITER,
+        KMEANS_EPS,
+    )
+    return cv2.kmeans(
+        np.float32(pixels),
+        num_colors,
+        None,
+        criteria,
+        KMEANS_ATTEMPTS,
+        cv2.KMEANS_RANDOM_CENTERS,
+    )
+
+
+def _sample_pixels(pixels, sample_size, rng):
+    """画素から最大sample_size個を重複なしで無作為に抽出します。"""
+    if sample_size <= 0 or len(pixels) <= sample_size:
+        return pixels
+    index = rng.choice(len(pixels), size=sample_size, replace=False)
+    return pixels[np.sort(index)]
+
+
+def _kmeans_plus_plus(samples, num_colors, rng, weights=None):
+    """k-means++法で初期の中心を選びます（weightsを指定すると重み付きで選びます）。"""
+    weights = np.ones(len(samples)) if weights is None else weights
+    centers = np.empty((num_colors, samples.shape[1]), dtype=np.float32)
+    centers[0] = samples[rng.choice(len(samples), p=weights / weights.sum())]
+    min_dist = ((samples - centers[0]) ** 2).sum(axis=1, dtype=np.float64)
+    for i in range(1, num_colors):
+        prob = min_dist * weights
+        total = prob.sum()
+        if total > 0:
+            index = rng.choice(len(samples), p=prob / total)
+        else:
+            index = rng.integers(len(samples))
+        centers[i] = samples[index]
+        np.minimum(min_dist, ((samples - centers[i]) ** 2).sum(axis=1), out=min_dist)
+    return centers
+
+
+def _minibatch_kmeans(samples, num_colors, rng, batch_size=MINIBATCH_SIZE, metrics=NULL_METRICS):
+    """
+    ミニバッチk-means（各中心を割り当てられた点の移動平均で更新）で色の中心を求めます。
+    """
+    samples = samples.astype(np.float32)
+    centers = _kmeans_plus_plus(samples, num_colors, rng)
+    counts = np.zeros(num_colors, dtype=np.float64)
+
+    for iteration in range(1, KMEANS_MAX_ITER + 1):
+        metrics.progress("kmeans", iteration - 1, KMEANS_MAX_ITER)
+        batch = samples[rng.integers(0, len(samples), size=batch_size)]
+        batch_labels, _ = assign_to_palette(batch, centers)
+
+        batch_counts = np.bincount(batch_labels, minlength=num_colors)
+        batch_sums = np.zeros_like(centers, dtype=np.float64)
+        np.add.at(batch_sums, batch_labels, batch)
+
+        updated = batch_counts > 0
+        new_counts = counts[updated] + batch_counts[updated]
+        new_centers = (
+            centers[updated] * counts[updated, None] + batch_sums[updated]
+        ) / new_counts[:, None]
+        shift = np.abs(new_centers - centers[updated]).max(initial=0.0)
+
+        centers[updated] = new_centers
+        counts[updated] = new_counts
+        if shift < MINIBATCH_EPS:
+            break
+
+    metrics.set("kmeans_iterations", iteration)
+    return centers
+
+
+def _weighted_kmeans(points, weights, num_colors, rng, metrics=NULL_METRICS):
+    """
+    重み付きの点（色とその画素数）に対してk-means（Lloyd法）を実行します。
+    """
+    points = points.astype(np.float32)
+    weights = weights.astype(np.float64)
+    centers = _kmeans_plus_plus(points, num_colors, rng, weights)
+
+    for iteration in range(1, KMEANS_MAX_ITER + 1):
+        metrics.progress("kmeans", iteration - 1, KMEANS_MAX_ITER)
+        labels, _ = assign_to_palette(points, centers)
+        totals = np.bincount(labels, weights=weights, minlength=num_colors)
+        updated = totals > 0
+        new_centers = np.stack(
+            [
+                np.bincount(labels, weights=weights * points[:, c], minlength=num_colors)
+                for c in range(points.shape[1])
+            ],
+            axis=1,
+        )[updated] / totals[updated, None]
+        shift = np.abs(new_centers - centers[updated]).max(initial=0.0)
+        centers[updated] = new_centers
+        if shift < KMEANS_EPS:
+            break
+
+    metrics.set("kmeans_iterations", iteration)
+    return centers
+
+
+def pack_colors(pixels):
+    """(N, 3) のuint8画素を24ビットの整数 (b << 16 | g << 8 | r) にまとめます。"""
+    pixels = pixels.astype(np.uint32)
+    return (pixels[:, 0] << 16) | (pixels[:, 1] << 8) | pixels[:, 2]
+
+
+def unpack_colors(packed):
+    """pack_colorsでまとめた整数を (N, 3) のuint8画素に戻します。"""
+    return np.stack(
+        [(packed >> 16) & 0xFF, (packed >> 8) & 0xFF, packed & 0xFF], axis=1
+    ).astype(np.uint8)
+
+
+def color_histogram(pixels):
+    """
+    画像に含まれる色とその画素数を求めます。
+
+    Returns:
+        tuple: (colors, counts, inverse)。colorsは一意な色 (U, 3)、
+               countsは各色の画素数、inverseは各画素が何番目の色かを表す配列。
+    """
+    packed, inverse, counts = np.unique(
+        pack_colors(pixels), return_inverse=True, return_counts=True
+    )
+    return unpack_colors(packed), counts, inverse.ravel().astype(np.int32)
+
+
+def _may_have_few_colors(pixels, num_colors):
+    """
+    一部の画素だけを調べ、色数がnum_colors以下である可能性があるかを判定します。
+    写真のように色数が多い画像で、全画素のヒストグラムを作る手間を省くためのものです。
+    """
+    step = max(len(pixels) // EXACT_PALETTE_PROBE_SIZE, 1)
+    return len(np.unique(pack_colors(pixels[::step]))) <= num_colors
+
+
+def quantize_colors(
+    img, num_colors, quantizer="full", sample_size=100000, random_seed=None, metrics=NULL_METRICS
+):
+    """
+    画像の色をnum_colors色に量子化します。
+
+    Args:
+        img (np.ndarray): (高さ, 幅, 3) のBGR画像。
+        num_colors (int): 量子化する色の数。
+        quantizer (str): 量子化の方法。
+                         "full"は全画素でk-meansを実行します（従来の方法）。
+                         "sample"は抽出した画素でk-meansを実行し、
+                         "minibatch"は抽出した画素でミニバッチk-meansを実行します。
+                         どちらも最後に全画素を最も近い色に割り当てます。
+                         "histogram"は一意な色を画素数で重み付けしてk-meansを実行します。
+                         "full"より大幅に速く誤差はほぼ同じですが、これまでと同じ出力に
+                         なるよう、デフォルトは"full"のままにしています。
+                         いずれの方法でも、画像の色数がnum_colors以下であれば
+                         k-meansを省略し、画像の色をそのまま使います。
+        sample_size (int): "sample"/"minibatch"でパレットの推定に使う最大画素数。
+        random_seed (int): 乱数シード。指定すると結果が再現可能になります。
+        metrics (Metrics): 指定するとk-means ("kmeans") と画素の割り当て ("assign") の時間、
+                           k-meansの反復回数を記録します。OpenCVのk-means ("full"/"sample") は
+                           反復回数を返さないため、試行回数 (kmeans_attempts) を記録します。
+
+    Returns:
+        tuple: (labels, centers, mse)。labelsは (N,) のラベル配列、
+               centersはuint8の色の中心 (k, 3)、
+               mseは1画素あたりの平均二乗誤差。
+    """
+    if quantizer not in QUANTIZERS:
+        raise ValueError(
+            f"不明な量子化方法 '{quantizer}'。{', '.join(QUANTIZERS)} のいずれかを指定してください。"
+        )
+
+    pixels = img.reshape((-1, 3))
+
+    if quantizer == "histogram" or _may_have_few_colors(pixels, num_colors):
+        with metrics.stage("color_histogram"):
+            colors, counts, inverse = color_histogram(pixels)
+        metrics.set("unique_colors", len(colors))
+        if len(colors) <= num_colors:
+            # 色数がパレットサイズ以下なので、元の色をそのまま使います
+            return inverse, colors, 0.0
+        if quantizer == "histogram":
+            rng = np.random.default_rng(random_seed)
+            with metrics.stage("kmeans"):
+                centers = _weighted_kmeans(colors, counts, num_colors, rng, metrics)
+            with metrics.stage("assign"):
+                color_labels, sse = assign_to_palette(colors, centers, counts)
+                labels = color_labels[inverse]
+            return labels, np.uint8(centers), sse / len(pixels)
+
+    if quantizer == "full":
+        metrics.set("kmeans_attempts", KMEANS_ATTEMPTS)
+        with metrics.stage("kmeans"):
+            compactness, labels, centers = _kmeans(pixels, num_colors, random_seed)
+        return labels.ravel(), np.uint8(centers), compactness / len(pixels)
+
+    rng = np.random.default_rng(random_seed)
+    samples = _sample_pixels(pixels, sample_size, rng)
+
+    with metrics.stage("kmeans"):
+        if quantizer == "sample":
+            metrics.set("kmeans_attempts", KMEANS_ATTEMPTS)
+            _, _, centers = _kmeans(samples, num_colors, random_seed)
+        else:
+            centers = _minibatch_kmeans(samples, num_colors, rng, metrics=metrics)
+
+    with metrics.stage("assign"):
+        labels, sse = assign_to_palette(pixels, centers)
+    return labels, np.uint8(centers), sse / len(pixels)
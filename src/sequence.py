@@ -0,0 +1,272 @@
+import inspect
+import io
+import os
+import time
+import cv2
+import numpy as np
+from .convert import (
+    despeckle_stage,
+    extract_stage,
+    preprocess_stage,
+    quantize_stage,
+    simplify_stage,
+    vectorize_image,
+)
+from .metrics import NULL_METRICS
+from .svg_writer import write_animated_svg, write_compact_svg, write_svg
+
+# 動画・アニメーションとして扱う入力ファイルの拡張子
+SEQUENCE_EXTENSIONS = (".gif", ".mp4", ".mov", ".avi", ".webm", ".mkv", ".m4v")
+# フレームレートを取得できない場合に使うフレームレート (fps)
+DEFAULT_FPS = 10.0
+# 直前に輪郭を抽出したフレームから、ラベルが変わった画素の割合がこれ以下なら輪郭を再利用します
+DEFAULT_CHANGE_THRESHOLD = 0.001
+
+
+def is_sequence_path(path):
+    """パスの拡張子から、GIFや動画 (フレームの連続) として変換する入力かどうかを返します。"""
+    return path.lower().endswith(SEQUENCE_EXTENSIONS)
+
+
+def read_frames(path):
+    """
+    cv2.VideoCaptureでGIFや動画を開き、(フレームのイテレータ, フレームレート) を返します。
+    フレームはBGR画像で、1枚ずつ読み込むため動画全体をメモリに載せません。
+    開けなかった場合は (None, 0) を返します。
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        return None, 0
+    fps = capture.get(cv2.CAP_PROP_FPS)
+
+    def frames():
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    return
+                yield frame
+        finally:
+            capture.release()
+
+    return frames(), fps if fps > 0 else DEFAULT_FPS
+
+
+def _resize_frame(frame, max_side_length):
+    """フレームを最大辺がmax_side_lengthになるようリサイズします (preprocess_imageと同じ方法)。"""
+    h, w = frame.shape[:2]
+    if max(h, w) == max_side_length:
+        return frame
+    scaling_factor = max_side_length / max(h, w)
+    interpolation = cv2.INTER_AREA if scaling_factor < 1 else cv2.INTER_LINEAR
+    return cv2.resize(
+        frame, (int(w * scaling_factor), int(h * scaling_factor)), interpolation=interpolation
+    )
+
+
+def vectorize_frames(
+    frames, change_threshold=DEFAULT_CHANGE_THRESHOLD, metrics=None, **kwargs
+):
+    """
+    連続したフレームを順にvectorize_imageと同じ形式に変換します。
+
+    フレームごとにk-meansを行うと時間がかかるうえ、フレームごとにパレットが変わって
+    色がちらつきます。ここでは最初のフレームで求めたパレット (paletteを指定した場合は
+    その色) を全てのフレームで使い、各画素を最も近い色に割り当てるだけにします。
+    パレットが共通なのでラベルマップをフレーム間で比較でき、直前に輪郭を抽出した
+    フレームからラベルが変わった画素の割合がchange_threshold以下のフレームでは、
+    輪郭の抽出と近似を省いて直前の結果を再利用します。
+
+    Args:
+        frames (iterable): BGR (またはBGRA) のフレームのイテレータ。
+        change_threshold (float): 輪郭を再利用する、ラベルが変わった画素の割合の上限。
+                                  負の値を指定すると再利用しません。
+        metrics (Metrics): vectorize_imageを参照。フレーム数 "frames" と
+                           再利用したフレーム数 "frames_reused" も記録します。
+        **kwargs: vectorize_imageの変換オプション (tile_sizeとstage_cacheは使いません)。
+
+    Yields:
+        tuple: (vectorized, reused)。vectorizedはvectorize_imageと同じ形式の辞書で、
+               reusedは直前のフレームの結果を再利用した場合にTrue。
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+    bound = inspect.signature(vectorize_image).bind(None, **kwargs)
+    bound.apply_defaults()
+    options = bound.arguments
+    if options["tile_size"] > 0:
+        print("警告: 動画・GIFの変換ではタイル分割は使えません。フレーム全体を処理します。")
+
+    colors = options["palette"]
+    reference = None
+    previous = None
+    for index, frame in enumerate(frames):
+        metrics.progress("frames", index)
+        metrics.count("frames")
+        if options["apply_resizing"] and options["max_side_length"] > 0:
+            resized = _resize_frame(frame, options["max_side_length"])
+            if index == 0 and resized is not frame:
+                print(
+                    f"フレームを {frame.shape[1]}x{frame.shape[0]} から "
+                    f"{resized.shape[1]}x{resized.shape[0]} にリサイズしました。"
+                )
+            frame = resized
+        img = preprocess_stage(
+            frame,
+            options["background_fill_color"],
+            False,
+            0,
+            options["gaussian_blur_ksize"],
+            options["median_blur_ksize"],
+            options["apply_sharpening"],
+            metrics,
+        )
+
+        # 最初のフレームでパレットを求め、以降のフレームでは同じ色に割り当てます
+        label_map, colors = quantize_stage(
+            img,
+            options["num_colors"],
+            options["quantizer"],
+            options["quantizer_sample_size"],
+            options["random_seed"],
+            palette=colors,
+            # 最初のフレームで求めたパレットはRGBで割り当てます (k-meansと同じ距離)
+            palette_space="rgb" if options["palette"] is None else options["palette_space"],
+            metrics=metrics,
+        )
+        if options["despeckle"]:
+            label_map = despeckle_stage(
+                label_map, len(colors), options["min_area"], options["workers"], metrics
+            )
+
+        if reference is not None and reference.shape == label_map.shape:
+            with metrics.stage("compare"):
+                changed = np.count_nonzero(label_map != reference) / label_map.size
+            if changed <= change_threshold:
+                metrics.count("frames_reused")
+                yield previous, True
+                continue
+
+        regions = extract_stage(
+            label_map,
+            len(colors),
+            options["dilate_iterations"],
+            options["min_area"],
+            options["workers"],
+            metrics,
+        )
+        paths = simplify_stage(
+            regions, colors, options["epsilon_factor"], options["workers"], metrics
+        )
+        h, w = label_map.shape
+        reference = label_map
+        previous = {"width": w, "height": h, "paths": paths, "palette": colors}
+        yield previous, False
+
+
+def sequence_to_svg(
+    input_path,
+    output_path,
+    animate=False,
+    change_threshold=DEFAULT_CHANGE_THRESHOLD,
+    add_stroke=False,
+    stroke_color=(0, 0, 0),
+    stroke_width=1.0,
+    compact=False,
+    metrics=None,
+    **kwargs,
+):
+    """
+    GIFや動画の各フレームをSVGに変換します (vectorize_framesを参照)。
+
+    Args:
+        input_path (str): 入力のGIFまたは動画ファイルへのパス。
+        output_path (str): animateがTrueの場合は出力SVGファイルへのパス。Falseの場合は
+                           フレームごとに {出力名}_{番号}.svg (番号は0000から) に書き込みます。
+        animate (bool): 全フレームをSMILアニメーションで切り替える1つのSVGに書き込むかどうか。
+                        変化のない連続したフレームは1つの<g>要素にまとめます。
+        change_threshold (float): vectorize_framesを参照。
+        metrics (Metrics): vectorize_framesを参照。変換のフレームレートを
+                           "frames_per_second" に記録します。
+        その他の引数はpng_color_to_svg_high_fidelityと同じです。
+
+    Returns:
+        bool: 変換に成功した場合はTrue、入力を読み込めなかった場合はFalse。
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+
+    frames, fps = read_frames(input_path)
+    if frames is None:
+        print(f"エラー: 動画ファイル '{input_path}' を開けません。")
+        return False
+
+    stroke_color = stroke_color if add_stroke else None
+    writer = write_compact_svg if compact else write_svg
+    base_name, _ = os.path.splitext(output_path)
+    animation = []
+    count = 0
+    reused_count = 0
+    svg_content = None
+    start = time.perf_counter()
+    for vectorized, reused in vectorize_frames(
+        frames, change_threshold, metrics=metrics, **kwargs
+    ):
+        if reused:
+            reused_count += 1
+        if animate:
+            if reused:
+                animation[-1]["count"] += 1
+            else:
+                animation.append({"paths": vectorized["paths"], "count": 1})
+        else:
+            # 再利用したフレームは直前のSVGをそのまま書き込みます
+            if not reused:
+                buffer = io.StringIO()
+                with metrics.stage("serialize"):
+                    writer(
+                        buffer,
+                        vectorized["width"],
+                        vectorized["height"],
+                        vectorized["paths"],
+                        stroke_color=stroke_color,
+                        stroke_width=stroke_width,
+                    )
+                svg_content = buffer.getvalue()
+            with open(f"{base_name}_{count:04d}.svg", "w", encoding="utf-8") as f:
+                f.write(svg_content)
+        width, height = vectorized["width"], vectorized["height"]
+        count += 1
+
+    if count == 0:
+        print(f"エラー: '{input_path}' からフレームを読み込めませんでした。")
+        return False
+
+    if animate:
+        with metrics.stage("serialize"):
+            with open(output_path, "w", encoding="utf-8") as f:
+                write_animated_svg(
+                    f,
+                    width,
+                    height,
+                    animation,
+                    1.0 / fps,
+                    stroke_color=stroke_color,
+                    stroke_width=stroke_width,
+                    compact=compact,
+                )
+        print(f"アニメーションSVGファイルが {output_path} に正常に作成されました")
+        metrics.set("output_bytes", os.path.getsize(output_path))
+    else:
+        print(
+            f"フレームごとのSVGファイルが {base_name}_0000.svg から "
+            f"{base_name}_{count - 1:04d}.svg に正常に作成されました"
+        )
+
+    elapsed = time.perf_counter() - start
+    metrics.set("frames_per_second", count / elapsed)
+    print(
+        f"{count} フレームを {elapsed:.2f} 秒で変換しました "
+        f"({count / elapsed:.1f} fps、輪郭を再利用したフレーム {reused_count})"
+    )
+    return True
@@ -0,0 +1,465 @@
+import http.client
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import socketserver
+import stat
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# サーバーのデフォルトのアドレス（環境変数 TO_SVG_SERVER で変更できます）
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+# 処理待ちにできるリクエストの最大数。超えた分は503で断ります
+DEFAULT_QUEUE_SIZE = 64
+# 1リクエストのタイムアウトのデフォルト (秒)。待ち時間を含みます
+DEFAULT_TIMEOUT = 60.0
+# 受け付ける画像データの最大サイズ (バイト)
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+
+def parse_address(address):
+    """
+    アドレスの文字列を解析し、(種類, アドレス) を返します。
+
+    'unix:/path/to.sock' や '/' を含む文字列はUnixソケットのパス、
+    'host:port' や 'port' はTCPのアドレスとして扱います。
+    """
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    if os.sep in address or "/" in address:
+        return "unix", address
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+def _warm_up():
+    """ワーカーの起動時に重いモジュールを読み込んでおきます。"""
+    from . import convert  # noqa: F401
+
+
+def _worker_main(conn, parent_conn, convert_func):
+    """
+    ワーカープロセスの処理。(画像データ, オプション) を受け取ってconvert_funcで変換し、
+    結果を送り返すことを繰り返します。
+    """
+    # 親プロセス側の端を閉じておかないと、親が終了してもrecvがEOFErrorにならず待ち続けます
+    parent_conn.close()
+    _warm_up()
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        image_data, options = job
+        try:
+            svg, error = convert_func(image_data, options)
+            conn.send(("ok", svg) if svg is not None else ("failed", error))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class _Job:
+    """キューに入れる変換リクエスト。"""
+
+    def __init__(self, image_data, options, timeout):
+        self.image_data = image_data
+        self.options = options
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+        self.result = None
+        self.done = threading.Event()
+
+    def finish(self, status, payload):
+        self.result = (status, payload)
+        self.done.set()
+
+
+class ConversionServer:
+    """
+    画像の変換を常駐するワーカープロセスで実行するサーバー。
+
+    ワーカーは起動時にOpenCVなどを読み込み、終了するまで再利用されるため、
+    1回の変換ごとにPythonの起動とモジュールの読み込みを行う必要がありません。
+
+    - ワーカープロセスの数は固定で、各ワーカーを1つのスレッドが担当します。
+    - 処理待ちのリクエストはqueue_sizeまでで、超えた場合はすぐに断ります (503)。
+    - 待ち時間を含めてtimeout秒以内に終わらない変換はワーカーを終了させて打ち切り (504)、
+      新しいワーカーを起動します。
+
+    Args:
+        convert_func: (画像データ, オプションの辞書) を受け取り、(SVG文字列, エラーメッセージ)
+                      を返す関数。ワーカープロセスに渡すため、モジュールの最上位で
+                      定義された関数である必要があります。
+        workers (int): ワーカープロセスの数。0以下の場合はCPU数を使います。
+        queue_size (int): 処理待ちにできるリクエストの最大数。
+        timeout (float): 1リクエストのタイムアウトの上限 (秒)。
+    """
+
+    def __init__(self, convert_func, workers=0, queue_size=DEFAULT_QUEUE_SIZE, timeout=DEFAULT_TIMEOUT):
+        self.convert_func = convert_func
+        self.workers = workers if workers > 0 else os.cpu_count() or 1
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=max(queue_size, 0) or 1)
+        self._lock = threading.Lock()
+        self._stats = {"processed": 0, "failed": 0, "rejected": 0, "timeouts": 0, "restarts": 0}
+        self._threads = []
+        # forkではワーカーが待ち受け中のソケットなどを引き継ぎ、サーバーの終了後も
+        # ポートを使い続けるため、親プロセスの状態を引き継がない方法で起動します
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in methods else "spawn"
+        )
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _start_worker(self):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main, args=(child_conn, parent_conn, self.convert_func), daemon=True
+        )
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def _stop_worker(self, process, conn, kill=False):
+        if kill:
+            process.kill()
+        else:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        process.join()
+        conn.close()
+
+    def _dispatch(self):
+        """1つのワーカープロセスを担当し、キューのリクエストを順に処理します。"""
+        process, conn = self._start_worker()
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            remaining = job.deadline - time.monotonic()
+            if remaining <= 0:
+                self._count("timeouts")
+                job.finish("timeout", "処理待ちの間にタイムアウトしました")
+                continue
+
+            try:
+                conn.send((job.image_data, job.options))
+                result = conn.recv() if conn.poll(remaining) else None
+            except (EOFError, OSError):
+                result = ("error", "ワーカープロセスが異常終了しました")
+                self._stop_worker(process, conn, kill=True)
+                self._count("restarts")
+                process, conn = self._start_worker()
+            if result is None:
+                # 実行中の変換は中断できないため、ワーカーごと終了させて起動し直します
+                self._stop_worker(process, conn, kill=True)
+                self._count("timeouts")
+                self._count("restarts")
+                job.finish("timeout", f"{job.timeout:g} 秒以内に変換が終わりませんでした")
+                process, conn = self._start_worker()
+                continue
+            self._count("processed" if result[0] == "ok" else "failed")
+            job.finish(*result)
+        self._stop_worker(process, conn)
+
+    def start(self):
+        """ワーカープロセスと、それを担当するスレッドを起動します。"""
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._dispatch, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """処理中の変換が終わるのを待ってから、ワーカープロセスを終了します。"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, image_data, options, timeout=None):
+        """
+        変換を実行し、結果を待ちます。
+
+        Returns:
+            tuple: (状態, 内容)。状態は "ok" (内容はSVG文字列)、"failed" (変換できなかった)、
+                   "busy" (キューが一杯)、"timeout"、"error" のいずれか。
+        """
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        job = _Job(image_data, options, timeout)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._count("rejected")
+            return "busy", "処理待ちのリクエストが多すぎます"
+        # 処理待ちの時間もタイムアウトに含めるため、投入した時点からの期限まで待ちます。
+        # 期限を過ぎたジョブは、処理待ちならキューから取り出した時点で捨てられ、
+        # 実行中ならワーカーごと打ち切られます
+        if not job.done.wait(max(job.deadline - time.monotonic(), 0)):
+            return "timeout", f"{timeout:g} 秒以内に変換が終わりませんでした"
+        return job.result
+
+    def stats(self):
+        """サーバーの状態 (ワーカー数, 処理待ちの数, 処理した数など) を返します。"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queued": self._queue.qsize(),
+                "queue_size": self._queue.maxsize,
+                **self._stats,
+            }
+
+
+# submitの状態に対応するHTTPのステータスコード
+_HTTP_STATUS = {"ok": 200, "failed": 422, "busy": 503, "timeout": 504, "error": 500}
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /convert: 本文の画像データを変換し、SVGを返します。変換オプションは
+                   X-Options ヘッダにJSONで、タイムアウト (秒) は X-Timeout ヘッダで指定します。
+    GET /health: サーバーの状態をJSONで返します。
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # 大量の小さなリクエストを処理するため、リクエストごとのログは出力しません
+        pass
+
+    def _reply(self, status, body, content_type="text/plain; charset=utf-8", headers=None):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._reply(404, "見つかりません")
+            return
+        self._reply(200, json.dumps(self.server.conversion.stats()), "application/json")
+
+    def do_POST(self):
+        if self.path != "/convert":
+            self._reply(404, "見つかりません")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self._reply(411, "Content-Lengthが必要です")
+            return
+        if length < 0:
+            self._reply(400, "無効なリクエストです: Content-Lengthが負の値です")
+            return
+        if length > MAX_REQUEST_BYTES:
+            self.close_connection = True
+            self._reply(413, f"画像データが大きすぎます (最大 {MAX_REQUEST_BYTES} バイト)")
+            return
+        image_data = self.rfile.read(length)
+        try:
+            options = json.loads(self.headers.get("X-Options") or "{}")
+            timeout = self.headers.get("X-Timeout")
+            timeout = float(timeout) if timeout else None
+        except ValueError as e:
+            self._reply(400, f"無効なリクエストです: {e}")
+            return
+        if not isinstance(options, dict):
+            self._reply(400, "X-Optionsはオブジェクトである必要があります")
+            return
+        if self.server.validate_options is not None:
+            options, error = self.server.validate_options(options)
+            if options is None:
+                self._reply(400, f"無効なリクエストです: {error}")
+                return
+
+        status, payload = self.server.conversion.submit(image_data, options, timeout)
+        if status == "ok":
+            self._reply(200, payload, "image/svg+xml; charset=utf-8")
+        else:
+            headers = {"Retry-After": "1"} if status == "busy" else None
+            self._reply(_HTTP_STATUS[status], payload or "変換に失敗しました", headers=headers)
+
+
+class _TCPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # BaseHTTPRequestHandlerがクライアントのアドレスを (ホスト, ポート) として扱えるようにします
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+
+def _remove_stale_socket(path):
+    """
+    前回の起動で残ったUnixソケットを削除します。
+    ソケット以外のファイルを誤って削除しないよう、その場合はFileExistsErrorを送出します。
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"'{path}' は既に存在し、Unixソケットではありません")
+    os.remove(path)
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    """SIGTERMを受け取った場合に、Ctrl+Cと同じくKeyboardInterruptを送出します。"""
+    raise KeyboardInterrupt
+
+
+def serve(
+    convert_func,
+    address=DEFAULT_ADDRESS,
+    workers=0,
+    queue_size=DEFAULT_QUEUE_SIZE,
+    timeout=DEFAULT_TIMEOUT,
+    validate_options=None,
+):
+    """
+    変換サーバーを起動し、Ctrl+C (SIGINT) またはSIGTERMで止めるまでリクエストを処理します。
+    引数はConversionServerと同じです。addressはparse_addressの形式で指定します。
+    validate_optionsを指定すると、X-Optionsの変換オプションをワーカーに渡す前にこの関数で
+    検証・変換します。関数は (変換オプション, エラーメッセージ) を返し、変換オプションが
+    Noneの場合はリクエストを400で断ります。
+    Unixソケットのパスにソケット以外のファイルが存在する場合はFileExistsErrorを送出します。
+    """
+    kind, bind_address = parse_address(address)
+    if kind == "unix":
+        _remove_stale_socket(bind_address)
+    conversion = ConversionServer(convert_func, workers, queue_size, timeout)
+    if kind == "unix":
+        httpd = _UnixServer(bind_address, _RequestHandler)
+    else:
+        httpd = _TCPServer(bind_address, _RequestHandler)
+    httpd.conversion = conversion
+    httpd.validate_options = validate_options
+
+    conversion.start()
+    # systemdやdocker stop、killが送るSIGTERMでも、Ctrl+Cと同じく後始末をしてから終了します
+    previous_handler = signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    print(
+        f"変換サーバーを {address} で起動しました "
+        f"(ワーカー {conversion.workers}, キュー {queue_size}, タイムアウト {timeout} 秒)"
+    )
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("変換サーバーを停止しています...")
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+        httpd.server_close()
+        conversion.stop()
+        if kind == "unix":
+            try:
+                _remove_stale_socket(bind_address)
+            except FileExistsError:
+                # 停止中に別のファイルに置き換えられた場合は残します
+                pass
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """Unixソケットで接続するHTTPConnection。"""
+
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class ConversionClient:
+    """
+    変換サーバーのクライアント。接続を使い回すため、同じスレッドから続けて変換できます。
+    複数のスレッドから使う場合は、スレッドごとにインスタンスを作成してください。
+    """
+
+    def __init__(self, address=None, timeout=DEFAULT_TIMEOUT, retries=10):
+        self.address = address or os.environ.get("TO_SVG_SERVER", DEFAULT_ADDRESS)
+        self.timeout = timeout
+        self.retries = retries
+        self._connection = None
+
+    def _connect(self):
+        kind, address = parse_address(self.address)
+        # サーバー側のタイムアウトで打ち切られた応答を受け取れるよう、少し長めに待ちます
+        timeout = self.timeout + 5
+        if kind == "unix":
+            return _UnixHTTPConnection(address, timeout=timeout)
+        return http.client.HTTPConnection(*address, timeout=timeout)
+
+    def _request(self, method, path, body=None, headers=None):
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = self._connect()
+            try:
+                self._connection.request(method, path, body=body, headers=headers or {})
+                response = self._connection.getresponse()
+                return response.status, dict(response.getheaders()), response.read().decode("utf-8")
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # サーバーが閉じた接続を使い回した場合は、1回だけ接続し直します
+                self.close()
+                if attempt == 1:
+                    raise
+
+    def convert(self, image_data, options):
+        """
+        画像データをサーバーで変換します。サーバーが混雑している場合は待ってから再送します。
+
+        Returns:
+            tuple: (SVG文字列, エラーメッセージ)。成功した場合はエラーメッセージがNone、
+                   失敗した場合はSVG文字列がNone。
+        """
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "X-Options": json.dumps(options),
+            "X-Timeout": str(self.timeout),
+        }
+        try:
+            for attempt in range(self.retries + 1):
+                status, response_headers, body = self._request("POST", "/convert", image_data, headers)
+                if status != 503 or attempt == self.retries:
+                    break
+                time.sleep(float(response_headers.get("Retry-After", 1)) * (attempt + 1) / 2)
+        except OSError as e:
+            self.close()
+            return None, f"変換サーバー {self.address} に接続できません: {e}"
+        if status == 200:
+            return body, None
+        return None, f"{body} (HTTP {status})"
+
+    def health(self):
+        """サーバーの状態の辞書を返します。接続できない場合はNone。"""
+        try:
+            status, _, body = self._request("GET", "/health")
+        except OSError:
+            self.close()
+            return None
+        return json.loads(body) if status == 200 else None
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,58 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+class StageCache:
+    """
+    変換パイプラインの各ステージの結果を保持する、プロセス内のLRUキャッシュ。
+
+    各ステージの結果は、前のステージのキーとそのステージが使うパラメータだけから
+    作られるキーで保存されます。例えばepsilon_factorだけを変更した場合は、
+    前処理・量子化・輪郭抽出の結果が再利用され、近似とSVGの生成だけが再実行されます。
+    """
+
+    def __init__(self, max_entries=2):
+        """
+        Args:
+            max_entries (int): ステージごとに保持する結果の数。
+                               画像やラベルマップを保持するため、小さな値にしてください。
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(parent_key, stage, params):
+        """前のステージのキーとステージのパラメータから、そのステージのキーを作成します。"""
+        payload = json.dumps([parent_key, stage, params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_or_compute(self, stage, key, compute):
+        """
+        キーに対応するステージの結果を返します。キャッシュにない場合はcomputeを呼び出して保存します。
+        """
+        with self._lock:
+            entries = self._stages.setdefault(stage, OrderedDict())
+            if key in entries:
+                entries.move_to_end(key)
+                self.hits += 1
+                return entries[key]
+
+        value = compute()
+
+        with self._lock:
+            self.misses += 1
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        """保持しているすべての結果を破棄します。"""
+        with self._lock:
+            self._stages.clear()
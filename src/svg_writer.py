@@ -0,0 +1,299 @@
+import numpy as np
+from .common import points_to_svg_path
+
+SVG_HEADER = (
+    '<?xml version="1.0" encoding="utf-8" ?>\n'
+    '<svg baseProfile="full" height="{height}" version="1.1" width="{width}" '
+    'xmlns="http://www.w3.org/2000/svg" '
+    'xmlns:ev="http://www.w3.org/2001/xml-events" '
+    'xmlns:xlink="http://www.w3.org/1999/xlink"><defs />'
+)
+SVG_FOOTER = "</svg>"
+
+COMPACT_SVG_HEADER = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}"{attrs}>'
+)
+
+# 同じ色のパスをまとめる際に、描画順の重なりを確認する要素数の上限
+COMPACT_MERGE_LOOKBACK = 2048
+
+
+def rgb_string(r, g, b):
+    """RGB値をSVGの色文字列 (rgb(r,g,b)) に変換します。"""
+    return "rgb(%d,%d,%d)" % (int(r) & 255, int(g) & 255, int(b) & 255)
+
+
+def hex_color(r, g, b):
+    """RGB値を最も短い16進数の色文字列 (#rgb または #rrggbb) に変換します。"""
+    text = "%02x%02x%02x" % (int(r) & 255, int(g) & 255, int(b) & 255)
+    if text[0] == text[1] and text[2] == text[3] and text[4] == text[5]:
+        return "#" + text[0] + text[2] + text[4]
+    return "#" + text
+
+
+def _append_number(parts, value):
+    """区切り文字が必要な場合だけ空白を入れて数値を追加します。"""
+    if value >= 0 and parts and parts[-1][-1].isdigit():
+        parts.append(" ")
+    parts.append(str(value))
+
+
+def points_to_compact_path(points, start=None):
+    """
+    頂点の (N, 2) 配列を、相対座標を使った短いSVGパス文字列に変換します。
+
+    水平・垂直の移動にはh/vを使い、それ以外は暗黙のl（相対lineto）で表します。
+
+    Args:
+        points (np.ndarray): 頂点の (N, 2) 配列。
+        start (tuple): 直前のサブパスの始点。指定すると始点を相対座標 (m) で表します。
+
+    Returns:
+        str: SVGパス文字列。
+    """
+    points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+    x0, y0 = int(points[0][0]), int(points[0][1])
+    if start is None:
+        parts = ["M", str(x0)]
+        _append_number(parts, y0)
+    else:
+        parts = ["m", str(x0 - start[0])]
+        _append_number(parts, y0 - start[1])
+
+    # mの後に続く座標は暗黙の相対linetoとして扱われますが、Mの後に続く座標は
+    # 絶対座標のlinetoとして扱われるため、最初の移動に明示的にlを付けます
+    mode = "l" if start is not None else "M"
+    for dx, dy in np.diff(points, axis=0).tolist():
+        if dx == 0 and dy == 0:
+            continue
+        if dy == 0:
+            parts.append("h")
+            parts.append(str(dx))
+            mode = "h"
+        elif dx == 0:
+            parts.append("v")
+            parts.append(str(dy))
+            mode = "v"
+        else:
+            if mode != "l":
+                parts.append("l")
+                mode = "l"
+            _append_number(parts, dx)
+            _append_number(parts, dy)
+    parts.append("z")
+    return "".join(parts)
+
+
+def _bounding_box(points):
+    """頂点の (N, 2) 配列のバウンディングボックス (x0, y0, x1, y1) を返します。"""
+    points = np.asarray(points).reshape(-1, 2)
+    x0, y0 = points.min(axis=0)
+    x1, y1 = points.max(axis=0)
+    return (x0, y0, x1, y1)
+
+
+def group_paths_by_color(paths, padding=0):
+    """
+    描画結果を変えずに、同じ色のパスを1つの<path>要素にまとめます。
+
+    パスPを、それより前にある同じ色の要素Gにまとめると、PはGの位置で描画されます。
+    GとPの間に描画される要素がPと重ならない場合に限りまとめることで、
+    面積順の重なり方を保ちます（重なりはバウンディングボックスで保守的に判定します）。
+
+    Args:
+        paths (iterable): 描画順に並んだパス ("points" と "color" を持つ辞書)。
+        padding (float): バウンディングボックスを各方向に広げる量。ストロークを描画する場合は
+                         パスが塗りの外側にも描かれるため、ストロークの太さの半分を指定します。
+
+    Returns:
+        list: 描画順に並んだ要素のリスト。各要素は "color" と、
+              サブパスの頂点配列のリスト "subpaths" を持つ辞書。
+    """
+    groups = []
+    boxes = []
+    last_group_of_color = {}
+
+    for item in paths:
+        color = tuple(int(c) for c in item["color"])
+        points = item["points"]
+        x0, y0, x1, y1 = _bounding_box(points)
+        box = (x0 - padding, y0 - padding, x1 + padding, y1 + padding)
+
+        index = last_group_of_color.get(color)
+        if index is not None and len(groups) - index <= COMPACT_MERGE_LOOKBACK:
+            later = np.asarray(boxes[index + 1 :]).reshape(-1, 4)
+            overlaps = (
+                (later[:, 0] <= box[2])
+                & (later[:, 2] >= box[0])
+                & (later[:, 1] <= box[3])
+                & (later[:, 3] >= box[1])
+            )
+            if not overlaps.any():
+                groups[index]["subpaths"].append(points)
+                gx0, gy0, gx1, gy1 = boxes[index]
+                boxes[index] = (
+                    min(gx0, box[0]),
+                    min(gy0, box[1]),
+                    max(gx1, box[2]),
+                    max(gy1, box[3]),
+                )
+                continue
+
+        last_group_of_color[color] = len(groups)
+        groups.append({"color": color, "subpaths": [points]})
+        boxes.append(box)
+
+    return groups
+
+
+def _oriented(points):
+    """
+    サブパスの向きを揃えます。1つの<path>に複数のサブパスをまとめたとき、
+    非ゼロ規則で重なった部分が抜けないようにするためです。
+    """
+    points = np.asarray(points).reshape(-1, 2)
+    x = points[:, 0].astype(np.int64)
+    y = points[:, 1].astype(np.int64)
+    signed_area = np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))
+    return points[::-1] if signed_area < 0 else points
+
+
+def write_compact_svg(stream, width, height, paths, stroke_color=None, stroke_width=1.0):
+    """
+    パスをサイズの小さいSVGとして書き込みます。
+
+    同じ色のサブパスを1つの<path>にまとめ、相対座標と最短のコマンドを使い、
+    不要な空白や属性を省きます。引数はwrite_svgと同じです。
+    """
+    attrs = ""
+    if stroke_color is not None:
+        # ストロークはルート要素に指定し、全パスに継承させます
+        attrs = f' stroke="{hex_color(*stroke_color)}" stroke-width="{stroke_width}"'
+
+    stream.write(COMPACT_SVG_HEADER.format(width=width, height=height, attrs=attrs))
+    _write_compact_paths(stream, paths, stroke_color, stroke_width)
+    stream.write(SVG_FOOTER)
+
+
+def _write_compact_paths(stream, paths, stroke_color=None, stroke_width=1.0):
+    """write_compact_svgの<path>要素だけを書き込みます。"""
+    padding = stroke_width / 2 if stroke_color is not None else 0
+    for group in group_paths_by_color(paths, padding):
+        b, g, r = group["color"]
+        subpath_data = []
+        start = None
+        # 向きを揃える必要があるのは複数のサブパスをまとめた場合だけなので、
+        # 1つだけの場合は元の向きのまま書き込みます (閉じたサブパスのストロークは
+        # 向きによらず同じ形に描かれます)
+        merged = len(group["subpaths"]) > 1
+        for points in group["subpaths"]:
+            points = _oriented(points) if merged else np.asarray(points).reshape(-1, 2)
+            subpath_data.append(points_to_compact_path(points, start))
+            start = (int(points[0][0]), int(points[0][1]))
+        stream.write(f'<path fill="{hex_color(r, g, b)}" d="{"".join(subpath_data)}"/>')
+
+
+def write_svg(stream, width, height, paths, stroke_color=None, stroke_width=1.0):
+    """
+    パスをSVGとしてファイルライクオブジェクトに逐次書き込みます。
+
+    svgwriteのようにDOMを構築せず、各パスの文字列をその場で生成して書き込むため、
+    頂点数が多い画像でもメモリ使用量を抑えられます。出力はsvgwriteで
+    生成していたSVGとバイト単位で同一です。
+
+    Args:
+        stream: 書き込み先のテキストファイルライクオブジェクト (ファイル、sys.stdoutなど)。
+        width (int): SVGの幅。
+        height (int): SVGの高さ。
+        paths (iterable): 描画順に並んだパス。各要素は "points" (頂点の (N, 2) 配列) と
+                          "color" (BGRの塗りつぶし色) を持つ辞書。
+        stroke_color (tuple): ストロークの色を表すRGBタプル。Noneの場合はストロークなし。
+        stroke_width (float): ストロークの太さ。
+    """
+    stream.write(SVG_HEADER.format(width=width, height=height))
+    _write_paths(stream, paths, stroke_color, stroke_width)
+    stream.write(SVG_FOOTER)
+
+
+def _write_paths(stream, paths, stroke_color=None, stroke_width=1.0):
+    """write_svgの<path>要素だけを書き込みます。"""
+    stroke_attrs = ""
+    if stroke_color is not None:
+        stroke_attrs = f' stroke="{rgb_string(*stroke_color)}" stroke-width="{stroke_width}"'
+
+    for item in paths:
+        b, g, r = item["color"]
+        stream.write(
+            f'<path d="{points_to_svg_path(item["points"])}" '
+            f'fill="{rgb_string(r, g, b)}"{stroke_attrs} />'
+        )
+
+
+def write_animated_svg(
+    stream,
+    width,
+    height,
+    frames,
+    frame_duration,
+    stroke_color=None,
+    stroke_width=1.0,
+    compact=False,
+):
+    """
+    連続したフレームを、SMILアニメーションで切り替える1つのSVGとして書き込みます。
+
+    各フレームを<g>要素にまとめ、表示する時間だけvisibilityをvisibleにします。
+    アニメーションは繰り返し再生されます。
+
+    Args:
+        stream: 書き込み先のテキストファイルライクオブジェクト。
+        width (int): SVGの幅。
+        height (int): SVGの高さ。
+        frames (list): 表示順に並んだフレーム。各要素は "paths" (write_svgを参照) と、
+                       表示するフレーム数 "count" を持つ辞書。変化のない連続したフレームは
+                       countを増やして1つの要素にまとめます。
+        frame_duration (float): 1フレームの表示時間 (秒)。
+        stroke_color (tuple): ストロークの色を表すRGBタプル。Noneの場合はストロークなし。
+        stroke_width (float): ストロークの太さ。
+        compact (bool): write_compact_svgの形式で<path>要素を書き込むかどうか。
+    """
+    if compact:
+        attrs = ""
+        if stroke_color is not None:
+            attrs = f' stroke="{hex_color(*stroke_color)}" stroke-width="{stroke_width}"'
+        stream.write(COMPACT_SVG_HEADER.format(width=width, height=height, attrs=attrs))
+    else:
+        stream.write(SVG_HEADER.format(width=width, height=height))
+
+    total = sum(frame["count"] for frame in frames)
+    duration = "%gs" % (total * frame_duration)
+    start = 0
+    for frame in frames:
+        end = start + frame["count"]
+        # 表示している区間だけvisibleにします (calcMode="discrete" で切り替えます)
+        values, key_times = [], []
+        if start > 0:
+            values.append("hidden")
+            key_times.append(0)
+        values.append("visible")
+        key_times.append(start / total)
+        if end < total:
+            values.append("hidden")
+            key_times.append(end / total)
+
+        if len(values) == 1:
+            stream.write("<g>")
+        else:
+            stream.write(
+                '<g visibility="hidden"><animate attributeName="visibility" '
+                f'values="{";".join(values)}" '
+                f'keyTimes="{";".join("%.6g" % t for t in key_times)}" '
+                f'dur="{duration}" calcMode="discrete" repeatCount="indefinite"/>'
+            )
+        if compact:
+            _write_compact_paths(stream, frame["paths"], stroke_color, stroke_width)
+        else:
+            _write_paths(stream, frame["paths"], stroke_color, stroke_width)
+        stream.write("</g>")
+        start = end
+    stream.write(SVG_FOOTER)
@@ -0,0 +1,310 @@
+import time
+import cv2
+import numpy as np
+from .common import filter_image, filter_margin
+from .extract import MIN_CONTOUR_AREA, build_label_map, extract_color_contours, resolve_min_area
+from .metrics import NULL_METRICS
+from .quantize import assign_to_palette, quantize_colors
+
+# タイル分割で処理する場合のデフォルトのタイルの一辺の長さ (px)
+DEFAULT_TILE_SIZE = 2048
+
+
+def iter_tiles(width, height, tile_size):
+    """画像をtile_size四方のタイルに分割し、各タイルの (x0, y0, x1, y1) を返します。"""
+    for y0 in range(0, height, tile_size):
+        for x0 in range(0, width, tile_size):
+            yield (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+
+
+def _expand_box(box, margin, width, height):
+    """矩形を四方にmarginだけ広げ、画像の範囲内に収めます。"""
+    x0, y0, x1, y1 = box
+    return (
+        max(x0 - margin, 0),
+        max(y0 - margin, 0),
+        min(x1 + margin, width),
+        min(y1 + margin, height),
+    )
+
+
+def filtered_window(img, box, filters, metrics=NULL_METRICS):
+    """
+    画像の矩形範囲にフィルタ (filter_imageの引数の辞書) を適用して返します。
+    フィルタに必要な余白を付けて切り出すため、画像全体に適用した場合と同じ結果になります。
+    """
+    h, w = img.shape[:2]
+    x0, y0, x1, y1 = box
+    px0, py0, px1, py1 = _expand_box(box, filter_margin(**filters), w, h)
+    window = filter_image(img[py0:py1, px0:px1], **filters, metrics=metrics)
+    return window[y0 - py0 : y1 - py0, x0 - px0 : x1 - px0]
+
+
+def fit_global_palette(
+    img,
+    tile_size,
+    filters,
+    num_colors,
+    quantizer,
+    sample_size,
+    random_seed,
+    metrics=NULL_METRICS,
+):
+    """
+    各タイルから画素数に比例した数の画素を抽出し、画像全体で共通のパレットを求めます。
+
+    Returns:
+        np.ndarray: 重複のないuint8の色 (k, 3)。
+    """
+    h, w = img.shape[:2]
+    sample_size = sample_size if sample_size > 0 else h * w
+    rng = np.random.default_rng(random_seed)
+    samples = []
+    for box in iter_tiles(w, h, tile_size):
+        x0, y0, x1, y1 = box
+        area = (x1 - x0) * (y1 - y0)
+        count = min(int(round(sample_size * area / (h * w))), area)
+        if count == 0:
+            continue
+        pixels = filtered_window(img, box, filters, metrics).reshape((-1, 3))
+        samples.append(pixels[np.sort(rng.choice(area, size=count, replace=False))])
+    samples = np.concatenate(samples)
+
+    _, centers, mse = quantize_colors(
+        samples.reshape((-1, 1, 3)),
+        num_colors,
+        quantizer=quantizer,
+        sample_size=len(samples),
+        random_seed=random_seed,
+        metrics=metrics,
+    )
+    print(f"色の量子化 ({quantizer}, {len(samples)} 画素から推定): 平均二乗誤差 {mse:.2f}")
+    metrics.set("quantize_mse", float(mse))
+
+    # uint8に丸めて同じ色になった中心をまとめます
+    _, colors = build_label_map(np.arange(len(centers)), centers, (len(centers),))
+    return colors
+
+
+def split_contour(points, core):
+    """
+    タイルの周辺部を含めて抽出した輪郭を、タイルの内側 (core) にある部分に分割します。
+
+    Args:
+        points (np.ndarray): 画像全体の座標系での輪郭の頂点 (N, 2)。
+        core (tuple): タイルの範囲 (x0, y0, x1, y1)。
+
+    Returns:
+        tuple: (closed, chains)。輪郭全体がタイルの内側にある場合はclosedがTrueになります。
+               chainsは (始点のキー, 終点のキー, 頂点の配列) のリスト。始点のキーは
+               直前の頂点と最初の頂点、終点のキーは最後の頂点と直後の頂点の座標です。
+    """
+    x0, y0, x1, y1 = core
+    inside = (
+        (points[:, 0] >= x0) & (points[:, 0] < x1) & (points[:, 1] >= y0) & (points[:, 1] < y1)
+    )
+    if inside.all():
+        return True, []
+    if not inside.any():
+        return False, []
+
+    # 外側の頂点から始まるように並べ替え、内側の頂点が連続する区間を取り出します
+    shift = int(np.argmin(inside))
+    points = np.roll(points, -shift, axis=0)
+    inside = np.roll(inside, -shift)
+    n = len(points)
+    starts = np.flatnonzero(inside[1:] & ~inside[:-1]) + 1
+    ends = np.flatnonzero(inside[:-1] & ~inside[1:]) + 1
+    if inside[-1]:
+        ends = np.append(ends, n)
+
+    chains = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        before = points[start - 1]
+        after = points[end % n]
+        start_key = (int(before[0]), int(before[1]), int(points[start][0]), int(points[start][1]))
+        end_key = (int(points[end - 1][0]), int(points[end - 1][1]), int(after[0]), int(after[1]))
+        chains.append((start_key, end_key, points[start:end]))
+    return False, chains
+
+
+def stitch_chains(chains):
+    """
+    タイルの境界で分割された輪郭の断片をつなぎ、閉じた輪郭を作ります。
+
+    断片の終点のキー (最後の頂点とその次の頂点) が、隣のタイルの断片の始点のキー
+    (直前の頂点と最初の頂点) と一致する場合につなぎます。閉じなかった断片
+    (一部のタイルでしか外側輪郭として現れない穴の境界) は捨てます。
+
+    Args:
+        chains (list): split_contourが返す (始点のキー, 終点のキー, 頂点の配列) のリスト。
+
+    Returns:
+        list: 閉じた輪郭 (頂点の (N, 2) 配列) のリスト。
+    """
+    by_start = {start_key: i for i, (start_key, _, _) in enumerate(chains)}
+    used = [False] * len(chains)
+    loops = []
+
+    for first in range(len(chains)):
+        if used[first]:
+            continue
+        parts = []
+        current = first
+        while current is not None and not used[current]:
+            used[current] = True
+            parts.append(chains[current][2])
+            current = by_start.get(chains[current][1])
+        if current == first:
+            loops.append(np.concatenate(parts))
+    return loops
+
+
+def drop_nested_regions(regions):
+    """
+    同じ色の別の輪郭の内側（穴の中）にある輪郭を除きます。
+
+    画像全体で外側輪郭だけを抽出した場合、穴の中にある同じ色の領域は現れません。
+    タイルに分割すると、囲んでいる領域がタイルの境界で切れている場合に
+    これらが外側輪郭として現れるため、画像全体で処理した場合に合わせて除きます。
+    """
+    by_label = {}
+    for region in regions:
+        by_label.setdefault(region["label"], []).append(region)
+
+    kept = []
+    for same_color in by_label.values():
+        same_color.sort(key=lambda r: r["area"], reverse=True)
+        boxes = np.array([cv2.boundingRect(r["contour"]) for r in same_color]).reshape(-1, 4)
+        x0, y0 = boxes[:, 0], boxes[:, 1]
+        x1, y1 = x0 + boxes[:, 2], y0 + boxes[:, 3]
+        for i, region in enumerate(same_color):
+            # バウンディングボックスが包含する、より大きな領域だけをまとめて絞り込みます
+            candidates = np.flatnonzero(
+                (x0[:i] <= x0[i]) & (y0[:i] <= y0[i]) & (x1[:i] >= x1[i]) & (y1[:i] >= y1[i])
+            )
+            point = tuple(float(v) for v in region["contour"][0, 0])
+            nested = any(
+                cv2.pointPolygonTest(same_color[j]["contour"], point, False) > 0
+                for j in candidates.tolist()
+            )
+            if not nested:
+                kept.append(region)
+    return kept
+
+
+def extract_regions_tiled(
+    img,
+    tile_size,
+    num_colors,
+    quantizer,
+    quantizer_sample_size,
+    random_seed,
+    dilate_iterations,
+    min_area=MIN_CONTOUR_AREA,
+    gaussian_blur_ksize=0,
+    median_blur_ksize=0,
+    apply_sharpening=False,
+    palette=None,
+    palette_space="rgb",
+    workers=1,
+    metrics=NULL_METRICS,
+):
+    """
+    画像をタイルに分割して色の量子化と輪郭抽出を行い、タイルの境界をまたぐ輪郭をつなぎます。
+
+    1. 各タイルから抽出した画素で、画像全体で共通のパレットを求めます。
+    2. タイルごとに、周囲に余白を付けた範囲をフィルタ・量子化し、各色の輪郭を抽出します。
+    3. タイルの境界をまたぐ輪郭の断片をつなぎ、継ぎ目のない輪郭にします。
+    4. 画像全体で処理した場合には現れない、同じ色の領域の穴の中の輪郭を除きます。
+
+    量子化画像やラベルマップ、マスクはタイルごとに作るため、前処理後の画像以外の
+    メモリ使用量は画像サイズではなくタイルサイズで決まります。
+
+    Args:
+        img (np.ndarray): フィルタ適用前のBGR画像。
+        tile_size (int): タイルの一辺の長さ (px)。
+        palette (np.ndarray): 指定するとパレットを求めずに、この色 (k, 3) を使います。
+        palette_space (str): paletteの色に割り当てる際に距離を測る色空間 ("rgb", "lab")。
+        その他の引数はvectorize_imageと同じです。
+
+    Returns:
+        tuple: (regions, colors)。regionsはextract_stageと同じ形式の領域のリスト、
+               colorsは各ラベルに対応するBGR色。
+    """
+    h, w = img.shape[:2]
+    min_area = resolve_min_area(min_area, (h, w))
+    filters = {
+        "gaussian_blur_ksize": gaussian_blur_ksize,
+        "median_blur_ksize": median_blur_ksize,
+        "apply_sharpening": apply_sharpening,
+    }
+    if palette is None:
+        colors = fit_global_palette(
+            img,
+            tile_size,
+            filters,
+            num_colors,
+            quantizer,
+            quantizer_sample_size,
+            random_seed,
+            metrics,
+        )
+    else:
+        # uint8に丸めて同じ色になるものをまとめます
+        palette = np.asarray(palette, dtype=np.uint8)
+        _, colors = build_label_map(np.arange(len(palette)), palette, (len(palette),))
+    num_labels = len(colors)
+    dtype = np.uint8 if num_labels <= 256 else np.uint16
+
+    # 膨張処理と輪郭の追跡がタイルの内側で画像全体の場合と一致するよう余白を取ります
+    margin = max(dilate_iterations, 0) + 3
+
+    regions = []
+    found = 0
+    chains_by_label = [[] for _ in range(num_labels)]
+    tiles = list(iter_tiles(w, h, tile_size))
+    for index, core in enumerate(tiles):
+        metrics.progress("tiles", index, len(tiles))
+        metrics.count("tiles")
+        box = _expand_box(core, margin, w, h)
+        window = filtered_window(img, box, filters, metrics)
+        with metrics.stage("assign"):
+            labels, _ = assign_to_palette(
+                window.reshape((-1, 3)),
+                colors,
+                color_space="rgb" if palette is None else palette_space,
+            )
+            label_map = labels.astype(dtype).reshape(window.shape[:2])
+        del labels, window
+
+        extract_start = time.perf_counter()
+        for label, contours in extract_color_contours(
+            label_map, num_labels, dilate_iterations, workers, metrics
+        ):
+            for contour in contours:
+                contour = contour + np.array(box[:2], dtype=contour.dtype)
+                closed, chains = split_contour(contour.reshape((-1, 2)), core)
+                if closed:
+                    found += 1
+                    area = cv2.contourArea(contour)
+                    if area >= min_area:
+                        regions.append({"label": label, "area": area, "contour": contour})
+                chains_by_label[label].extend(chains)
+        metrics.add_time("extract", time.perf_counter() - extract_start)
+
+    with metrics.stage("stitch"):
+        for label, chains in enumerate(chains_by_label):
+            for loop in stitch_chains(chains):
+                found += 1
+                contour = loop.reshape((-1, 1, 2)).astype(np.int32)
+                # 外側輪郭は負の向きになります。正の向きの輪郭は穴の境界なので除きます
+                signed_area = cv2.contourArea(contour, oriented=True)
+                if signed_area > 0 or -signed_area < min_area:
+                    continue
+                regions.append({"label": label, "area": -signed_area, "contour": contour})
+        regions = drop_nested_regions(regions)
+
+    metrics.count("contours_found", found)
+    metrics.count("contours_kept", len(regions))
+    return regions, colors
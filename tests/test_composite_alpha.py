@@ -0,0 +1,54 @@
+import numpy as np
+import src.common as common
+from src.common import composite_alpha
+
+
+def blend_float(img, background_fill_color):
+    """浮動小数点で計算したアルファ合成の正確な値 (BGR)。"""
+    r, g, b = background_fill_color
+    fg = img[:, :, :3].astype(np.float64)
+    a = img[:, :, 3:].astype(np.float64) / 255.0
+    return fg * a + np.array((b, g, r), dtype=np.float64) * (1.0 - a)
+
+
+def test_all_values_within_one_of_float():
+    # 前景と透明度の全ての組み合わせを1枚の画像にし、背景の全ての値について比べます
+    fg = np.repeat(np.arange(256, dtype=np.uint8), 256).reshape(256, 256)
+    alpha = np.tile(np.arange(256, dtype=np.uint8), 256).reshape(256, 256)
+    img = np.dstack([fg, fg, fg, alpha])
+    for value in range(256):
+        color = (value, value, value)
+        diff = composite_alpha(img, color).astype(np.float64) - blend_float(img, color)
+        assert np.abs(diff).max() <= 1, value
+
+
+def test_fully_opaque_returns_foreground():
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (7, 5, 4), dtype=np.uint8)
+    img[:, :, 3] = 255
+    result = composite_alpha(img, (10, 20, 30))
+    assert result.shape == (7, 5, 3)
+    np.testing.assert_array_equal(result, img[:, :, :3])
+
+
+def test_fully_transparent_returns_background_in_bgr():
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (7, 5, 4), dtype=np.uint8)
+    img[:, :, 3] = 0
+    result = composite_alpha(img, (10, 20, 30))
+    assert result.shape == (7, 5, 3)
+    assert (result == np.array((30, 20, 10), dtype=np.uint8)).all()
+
+
+def test_chunk_boundary_matches_single_chunk(monkeypatch):
+    rng = np.random.default_rng(1)
+    w, h = 9, 10
+    img = rng.integers(0, 256, (h, w, 4), dtype=np.uint8)
+    color = (200, 100, 50)
+    expected = composite_alpha(img, color)
+
+    # 1回に3行ずつ処理させ、高さ (10) が行数の倍数にならない場合を確かめます
+    monkeypatch.setattr(common, "ALPHA_BLEND_CHUNK_PIXELS", 3 * w)
+    result = composite_alpha(img, color)
+    np.testing.assert_array_equal(result, expected)
+    assert np.abs(result.astype(np.float64) - blend_float(img, color)).max() <= 1
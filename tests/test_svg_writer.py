@@ -0,0 +1,143 @@
+import io
+import re
+import numpy as np
+import pytest
+from src.common import points_to_svg_path
+from src.svg_writer import _oriented, group_paths_by_color, points_to_compact_path, write_compact_svg
+
+
+def parse_path(d):
+    """
+    SVGパス (M/m/L/l/H/h/V/v/Z/z) を仕様どおりに解釈し、サブパスごとの絶対座標の頂点のリストを返します。
+    moveto (M/m) の後に続く座標の組は、それぞれ暗黙の lineto (L/l) として扱います。
+    """
+    tokens = re.findall(r"[MmLlHhVvZz]|-?\d+", d)
+    subpaths = []
+    x = y = 0
+    start = (0, 0)
+    command = None
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.isalpha():
+            command = token
+            i += 1
+            if command in "Zz":
+                x, y = start
+                continue
+        elif command is None:
+            raise ValueError(f"コマンドのない座標: {d}")
+        if command in "Mm":
+            dx, dy = int(tokens[i]), int(tokens[i + 1])
+            i += 2
+            x, y = (x + dx, y + dy) if command == "m" else (dx, dy)
+            start = (x, y)
+            subpaths.append([(x, y)])
+            # moveto の後の座標の組は暗黙の lineto になります
+            command = "l" if command == "m" else "L"
+        elif command in "Ll":
+            dx, dy = int(tokens[i]), int(tokens[i + 1])
+            i += 2
+            x, y = (x + dx, y + dy) if command == "l" else (dx, dy)
+            subpaths[-1].append((x, y))
+        elif command in "Hh":
+            value = int(tokens[i])
+            i += 1
+            x = x + value if command == "h" else value
+            subpaths[-1].append((x, y))
+        elif command in "Vv":
+            value = int(tokens[i])
+            i += 1
+            y = y + value if command == "v" else value
+            subpaths[-1].append((x, y))
+    return subpaths
+
+
+def _dedup(points):
+    """連続する同じ頂点をまとめます (コンパクト形式では移動のない頂点を省くため)。"""
+    result = []
+    for point in points:
+        if not result or result[-1] != point:
+            result.append(point)
+    return result
+
+
+def _random_polygons(count=200, seed=0):
+    rng = np.random.default_rng(seed)
+    polygons = [
+        np.array([[10, 10], [20, 20], [30, 10]]),
+        np.array([[10, 10], [20, 10], [20, 30], [5, 40]]),
+        np.array([[0, 0], [0, 5], [5, 5], [5, 0]]),
+        np.array([[3, 3], [3, 3], [-4, 7], [8, -2]]),
+    ]
+    for _ in range(count):
+        n = int(rng.integers(3, 12))
+        points = rng.integers(-50, 200, size=(n, 2))
+        # 水平・垂直の移動も含めます
+        points[rng.random(n) < 0.3, 0] = points[0, 0]
+        points[rng.random(n) < 0.3, 1] = points[0, 1]
+        polygons.append(points)
+    return polygons
+
+
+def test_compact_path_diagonal_first_step_is_relative():
+    assert points_to_compact_path([[10, 10], [20, 20], [30, 10]]) == "M10 10l10 10 10-10z"
+
+
+@pytest.mark.parametrize("index", range(204))
+def test_compact_path_matches_absolute_path(index):
+    points = _random_polygons()[index]
+    expected = parse_path(points_to_svg_path(points))
+    assert parse_path(points_to_compact_path(points)) == [_dedup(expected[0])]
+
+
+def test_compact_path_relative_start():
+    points = np.array([[15, 12], [25, 30], [25, 10]])
+    d = "M0 0z" + points_to_compact_path(points, start=(0, 0))
+    assert parse_path(d)[1] == [tuple(p) for p in points.tolist()]
+
+
+def test_compact_svg_subpaths_match_paths():
+    polygons = _random_polygons(seed=1)
+    paths = [{"points": p, "color": (i % 3, 0, 0)} for i, p in enumerate(polygons)]
+    buffer = io.StringIO()
+    write_compact_svg(buffer, 200, 200, paths)
+    written = [parse_path(d) for d in re.findall(r' d="([^"]*)"', buffer.getvalue())]
+
+    groups = group_paths_by_color(paths)
+    assert len(written) == len(groups)
+    for subpaths, group in zip(written, groups):
+        merged = len(group["subpaths"]) > 1
+        assert subpaths == [
+            _dedup([tuple(p) for p in (_oriented(points) if merged else points).tolist()])
+            for points in group["subpaths"]
+        ]
+
+
+def _stroke_test_paths():
+    # 赤の2つのパスの間に青のパスを描画します。青のパスと2つ目の赤のパスは
+    # 塗りのバウンディングボックスは離れていますが、太いストロークでは重なります
+    return [
+        {"points": np.array([[0, 0], [10, 0], [10, 10], [0, 10]]), "color": (0, 0, 255)},
+        {"points": np.array([[50, 0], [60, 0], [60, 10], [50, 10]]), "color": (255, 0, 0)},
+        {"points": np.array([[63, 0], [73, 0], [73, 10], [63, 10]]), "color": (0, 0, 255)},
+    ]
+
+
+def test_group_paths_merges_when_boxes_are_apart():
+    groups = group_paths_by_color(_stroke_test_paths())
+    assert [len(group["subpaths"]) for group in groups] == [2, 1]
+
+
+def test_group_paths_keeps_order_when_strokes_overlap():
+    groups = group_paths_by_color(_stroke_test_paths(), padding=2)
+    assert [group["color"] for group in groups] == [(0, 0, 255), (255, 0, 0), (0, 0, 255)]
+
+
+def test_compact_svg_does_not_merge_across_stroke():
+    paths = _stroke_test_paths()
+    buffer = io.StringIO()
+    write_compact_svg(buffer, 80, 20, paths, stroke_color=(0, 0, 0), stroke_width=4)
+    written = [parse_path(d) for d in re.findall(r' d="([^"]*)"', buffer.getvalue())]
+    # 単独のパスは向きを変えずに、元の頂点の順で書き込みます
+    assert written == [[[tuple(p) for p in item["points"].tolist()]] for item in paths]